@@ -6,10 +6,13 @@ import sys
 import itertools
 import scipy.optimize as so
 import os
-from pyconturb import gen_turb, gen_spat_grid, TimeConstraint  # functions we need from PyConTurb
+from pyconturb import gen_turb, SpatialGrid, TimeConstraint  # functions we need from PyConTurb
 from pyconturb.tictoc import Timer
 from pyconturb.wind_profiles import power_profile
+from pyconturb.io.sinks import BtsSink, Hawc2Sink, MultiSink
+from pyconturb.resources import estimate_resources, format_estimate
 from helper_functions import *
+from cases import get_case_params
 
 # --- Parameters
 dtype=np.float32 # TODO
@@ -17,16 +20,28 @@ bBackWard=False
 Suffix=''
 
 # --- Parameters from command line
+# Usage: 01_GenerateTurbBox.py Case Combine(T/F/A) [i_shard n_shards]
+#   A(uto): the first process to finish its shard combines, the others exit
+# Progress of the running cases: python -m pyconturb.status data
+shard = None
 if len(sys.argv)>1:
     Case    = sys.argv[1].strip()
-    combine_freq_data = sys.argv[3].lower()=='t'
+    combine_freq_data = {'t':True, 'f':False, 'a':'auto'}[sys.argv[2].lower()[0]]
     write_freq_data = True
+    if len(sys.argv)>4:
+        shard = (int(sys.argv[3]), int(sys.argv[4])) # frequencies handled by this process
 else:
     write_freq_data = False
     Case='A1'
     Suffix+='_nochunks'
     combine_freq_data = True
 
+# --- Memory of this process: a share of the node's RAM for each process of the node
+# (the shards of Submit*.sh), used by gen_turb to size its chunks
+mem_frac = 0.8
+n_procs  = shard[1] if shard is not None else 1
+mem_budget = int(mem_frac*os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/n_procs)
+
 # --- Constants and derived params
 # ymin,ymax = -240,240
 # zmin,zmax = 3,240
@@ -37,15 +52,19 @@ zmin,zmax = 3,480  # 0->6D
 ny = 214
 nz = 160
 
-Suffix=Suffix+'_'+str(ny)'_'+str(nz)
+Suffix=Suffix+'_'+str(ny)+'_'+str(nz)
 
 print('>>> Case:   {}'.format(Case))
 print('>>> Suffix: {}'.format(Suffix))
 print('>>> Write:  {} {}'.format(write_freq_data,combine_freq_data))
+print('>>> Shard:  {}'.format(shard))
+print('>>> Memory: {:.1f} GiB'.format(mem_budget/2**30))
 print('>>> y:      {} {} {}'.format(ymin,ymax,ny))
 print('>>> z:      {} {} {}'.format(zmin,zmax,nz))
 h_hub=57;
-pkl_file = '{}{}.pkl'.format(Case,Suffix)
+OUT_Folder='_ForHenrik/'
+box_file = '{}{}{}'.format(OUT_Folder,Case,Suffix) # .bts and HAWC2 .u/.v/.w written by gen_turb
+box_exts = ['.bts','.u','.v','.w']
 pkl_space = '{}{}_space.pkl'.format(Case,Suffix)
 con_file = '35Hz_data/{}_pyConTurb_tc.csv'.format(Case)
 
@@ -55,42 +74,12 @@ con_tc.index = con_tc.index.map(lambda x: float(x) if (x not in 'kxyz') else x)
 time_df = con_tc.get_time()
 dt      = con_tc.get_time().index[1]
 T       = con_tc.get_T()-dt          # TODO
-print('>>> Pkl : {}Mb'.format(0.07*ny*nz))
 print('>>> T, dt:',T,dt)
 
 # --- Fitting power law and sigma
 # alpha,u_ref, my_wsp_func,veer_func = get_wsp_func(con_tc, h_hub, plot   = False)
 # my_sig_func                        = get_sigma_func(con_tc, plot = False)
-if Case=='A1':
-    def my_sig_func(k, y, z, **kwargs):
-        sig = np.zeros(y.shape)
-        sig[k==0] =  0.46577620264919134*np.exp(-0.009459702869284256*z[k==0])+0.5242096170226613
-        sig[k==1] =  0.32501065767141885*np.exp(-0.009059732365499604*z[k==1])+0.4664357892808409
-        sig[k==2] =  0.25265083664918636*np.exp(-0.00816719396912162 *z[k==2])+0.27864558900332614
-        return sig
-    alpha=0.09501
-    u_ref=8.86407 
-elif Case=='A2':
-    def my_sig_func(k, y, z, **kwargs):
-        sig = np.zeros(y.shape)
-        sig[k==0] = 0.8099028667369905 *np.exp(-0.021555344194775908  *z[k==0])+0.4071960755269242
-        sig[k==1] = 135.7599449425806  *np.exp(-3.5109472359675726e-06*z[k==1])+-135.1080431878093
-        sig[k==2] = 0.22495339546333412*np.exp(-0.011140930815265206  *z[k==2])+0.31941416670478984
-        return sig
-    alpha=0.10748
-    u_ref=9.51186
-elif Case=='B1':
-    def my_sig_func(k, y, z, **kwargs):
-        sig = np.zeros(y.shape)
-        sig[k==0] = 0.5115673365356883*np.exp(-0.013331621241907558 *z[k==0])+0.47484654611672855
-        sig[k==1] = 0.3991956202078298*np.exp(-0.011923833640356686 *z[k==1])+0.4190659656311234
-        sig[k==2] = 0.39194178694509046*np.exp(-0.004711856260504405*z[k==2])+0.26768397422947954
-        return sig
-
-    alpha=0.09482
-    u_ref=7.61636
-
-
+my_sig_func, alpha, u_ref = get_case_params(Case)
 
 
 sig_func=None
@@ -117,22 +106,30 @@ interp_data = ['wsp','sig']  # use the default IEC 61400-1 profile instead of in
 interp_data = "none"  # use the default IEC 61400-1 profile instead of interpolating from contstraints
 
 # --- Save box spatial data
-spat_df = gen_spat_grid(y, z)
+spat_df = SpatialGrid(y, z)  # compact y-z grid, see get_indices for the column lookup
 pickle.dump(spat_df, open(pkl_space,'wb'))
 
+# --- Estimated memory, FLOPs and disk of this process (python -m pyconturb.resources for the runtime)
+print(format_estimate(estimate_resources(spat_df, con_tc=con_tc, sig_func=sig_func, dtype=dtype, mem_budget=mem_budget,
+    shard=shard, write_freq_data=write_freq_data, out_formats=['bts','hawc2'], benchmark=False, **kwargs)))
+
 # --- Generate constrained turbulence
 # We now pass our constraint object and other arguments into `gen_turb` as follows.
-if os.path.exists(pkl_file):
-    print('>>> NOT GENERATING TURBULENCE, PKL FILE EXIST',pkl_file)
+if os.path.exists(box_file+'.bts'):
+    print('>>> NOT GENERATING TURBULENCE, BTS FILE EXIST',box_file+'.bts')
 else:
+    os.makedirs(OUT_Folder, exist_ok=True)
+    # the time series are streamed to the files, chunk by chunk, by the combining process
+    tmp_file = box_file+'.tmp'
+    sink = MultiSink(BtsSink(tmp_file+'.bts', spat_df), Hawc2Sink(tmp_file, spat_df))
     with Timer('all:'):
-        sim_turb_df = gen_turb(spat_df, con_tc=con_tc, interp_data=interp_data, wsp_func=wsp_func, veer_func=veer_func, sig_func=sig_func, seed=12, verbose=False,
-                write_freq_data=write_freq_data, combine_freq_data=combine_freq_data, preffix='data/'+Case+Suffix+'_', dtype=dtype, **kwargs)
+        out = gen_turb(spat_df, con_tc=con_tc, interp_data=interp_data, wsp_func=wsp_func, veer_func=veer_func, sig_func=sig_func, seed=12, verbose=False,
+                write_freq_data=write_freq_data, combine_freq_data=combine_freq_data, shard=shard, preffix='data/'+Case+Suffix+'_', dtype=dtype, out=sink, mem_budget=mem_budget, **kwargs)
 
-    if sim_turb_df is not None: 
-        with Timer('Export:'):
-            print('>>> Exporting to pkl_file')
-            pickle.dump(sim_turb_df, open(pkl_file,'wb'))
+    if out is not None: 
+        for ext in box_exts[::-1]: # atomic, an existing bts means all files are complete
+            os.replace(tmp_file+ext, box_file+ext)
+        print('>>> Written',box_file+'.bts/.u/.v/.w')
 # 
 # **Note**: The profile functions selected for the wind speed, turbulence standard deviation and power spectra affect whether you regenerate the constraining data if a simulation point is collocated. One option is to use the built-in profile functions that interpolates these profiles from your data (see related example in the documentation). Otherwise, you can define your own profile functions for custom interpolation.
 
@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 # import weio
 from TurbSimFile import TurbSimFile
 from MannBoxFile import MannBoxFile
-from pyconturb import gen_turb, gen_spat_grid, TimeConstraint  # functions we need from PyConTurb
+from pyconturb import gen_turb, gen_spat_grid, SpatialGrid, TimeConstraint  # functions we need from PyConTurb
 
 import pickle
 from helper_functions import *
@@ -25,8 +25,8 @@ for Case in Cases:
     Suffix='_161'
     Plot=False
     # Plot=False
-    GenerateBox=True
-    # GenerateBox=False
+    # GenerateBox=True
+    GenerateBox=False # the .bts and HAWC2 files are now written directly by 01_GenerateTurbBox.py
 
 
     # --- Constants and derived params
@@ -36,8 +36,11 @@ for Case in Cases:
     con_file  = '35Hz_data/{}_pyConTurb_tc.csv'.format(Case)
     # --- Loading files
     print('Loading files...')
-    sim_ts  = pickle.load(open(pkl_file,'rb'))
+    if GenerateBox or Plot: # time series pickled by older versions of 01_GenerateTurbBox.py
+        sim_ts  = pickle.load(open(pkl_file,'rb'))
     sim_sp = pickle.load(open(pkl_space,'rb'))
+    if isinstance(sim_sp, SpatialGrid): # compact grid saved by 01_GenerateTurbBox.py
+        sim_sp = sim_sp.to_df()
     con_tc = TimeConstraint(pd.read_csv(con_file, index_col=0))  # load data from csv directly into tc
     con_tc.index = con_tc.index.map(lambda x: float(x) if (x not in 'kxyz') else x)  # index cleaning
     con_ts = con_tc.get_time()
@@ -45,7 +48,8 @@ for Case in Cases:
 
     RefPoints = con_sp.filter(regex='u_', axis=1).loc[['x','y','z']]
     print(RefPoints)
-    print(sim_ts.columns)
+    if GenerateBox or Plot:
+        print(sim_ts.columns)
     print(sim_sp.columns)
 
     if GenerateBox:
@@ -80,16 +84,17 @@ for Case in Cases:
     ts_filename='{}{}.bts'.format(Case,Suffix)
     print('Reading TurbSim')
     ts=TurbSimFile(box_file)
-    mn = MannBoxFile()
-    print('Writting u')
-    mn.fromTurbSim(ts['u'],0)
-    mn.write(ts_filename.replace('.bts','.u'))
-    print('Writting v')
-    mn.fromTurbSim(ts['u'],1)
-    mn.write(ts_filename.replace('.bts','.v'))
-    print('Writting w')
-    mn.fromTurbSim(ts['u'],2)
-    mn.write(ts_filename.replace('.bts','.w'))
+    if GenerateBox:
+        mn = MannBoxFile()
+        print('Writting u')
+        mn.fromTurbSim(ts['u'],0)
+        mn.write(ts_filename.replace('.bts','.u'))
+        print('Writting v')
+        mn.fromTurbSim(ts['u'],1)
+        mn.write(ts_filename.replace('.bts','.v'))
+        print('Writting w')
+        mn.fromTurbSim(ts['u'],2)
+        mn.write(ts_filename.replace('.bts','.w'))
 
     # --- Probe and info files
     print('Probe and info files')
@@ -107,7 +112,7 @@ for Case in Cases:
         f.write('\n')
         y_fit, pfit, model =  fit_powerlaw_u_alpha(z, u, z_ref=zMid, p0=(10,0.1))
         f.write('Power law: alpha={:.5f}  -  u={:.5f}  at z={:.5f}\n'.format(pfit[1],pfit[0],zMid))
-        f.write('Periodic: {}\n'.format(ts.checkPeriodic(sigmaTol=1.5, aTol=0.5))
+        f.write('Periodic: {}\n'.format(ts.checkPeriodic(sigmaTol=1.5, aTol=0.5)))
 
     # Creating csv file with data at some probe locations
     Columns=['Time_[s]']
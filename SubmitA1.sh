@@ -8,5 +8,6 @@
 #SBATCH --mail-type BEGIN,END,FAIL              # Send e-mail when job begins, ends or fails
 #SBATCH -o slurm-%x-%j.log                      # Output
 
-python -u 01_GenerateTurbBox.py A1 F  &
-python -u 01_GenerateTurbBox.py A1 T 
+python -u 01_GenerateTurbBox.py A1 A 0 2 &
+python -u 01_GenerateTurbBox.py A1 A 1 2 &
+wait
@@ -8,5 +8,6 @@
 #SBATCH --mail-type BEGIN,END,FAIL              # Send e-mail when job begins, ends or fails
 #SBATCH -o slurm-%x-%j.log                      # Output
 
-python -u GenerateTurbBox.py B1 F  &
-python -u GenerateTurbBox.py B1 T 
+python -u GenerateTurbBox.py B1 A 0 2 &
+python -u GenerateTurbBox.py B1 A 1 2 &
+wait
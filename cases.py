@@ -0,0 +1,43 @@
+"""
+Parameters of the measured cases A1, A2 and B1: sigma profile, shear exponent and
+reference wind speed fitted on the 35Hz data (see get_wsp_func and get_sigma_func in
+helper_functions.py)
+"""
+import numpy as np
+
+CASES = ['A1', 'A2', 'B1']
+
+
+def get_case_params(Case):
+    """ Return sig_func, alpha, u_ref of a case """
+    if Case=='A1':
+        def my_sig_func(k, y, z, **kwargs):
+            sig = np.zeros(y.shape)
+            sig[k==0] =  0.46577620264919134*np.exp(-0.009459702869284256*z[k==0])+0.5242096170226613
+            sig[k==1] =  0.32501065767141885*np.exp(-0.009059732365499604*z[k==1])+0.4664357892808409
+            sig[k==2] =  0.25265083664918636*np.exp(-0.00816719396912162 *z[k==2])+0.27864558900332614
+            return sig
+        alpha=0.09501
+        u_ref=8.86407
+    elif Case=='A2':
+        def my_sig_func(k, y, z, **kwargs):
+            sig = np.zeros(y.shape)
+            sig[k==0] = 0.8099028667369905 *np.exp(-0.021555344194775908  *z[k==0])+0.4071960755269242
+            sig[k==1] = 135.7599449425806  *np.exp(-3.5109472359675726e-06*z[k==1])+-135.1080431878093
+            sig[k==2] = 0.22495339546333412*np.exp(-0.011140930815265206  *z[k==2])+0.31941416670478984
+            return sig
+        alpha=0.10748
+        u_ref=9.51186
+    elif Case=='B1':
+        def my_sig_func(k, y, z, **kwargs):
+            sig = np.zeros(y.shape)
+            sig[k==0] = 0.5115673365356883*np.exp(-0.013331621241907558 *z[k==0])+0.47484654611672855
+            sig[k==1] = 0.3991956202078298*np.exp(-0.011923833640356686 *z[k==1])+0.4190659656311234
+            sig[k==2] = 0.39194178694509046*np.exp(-0.004711856260504405*z[k==2])+0.26768397422947954
+            return sig
+        alpha=0.09482
+        u_ref=7.61636
+    else:
+        raise ValueError('Unknown case {}, must be one of {}'.format(Case, CASES))
+    my_sig_func.spatial_coords = ('k', 'z')  # sigma only varies with height
+    return my_sig_func, alpha, u_ref
@@ -8,6 +8,7 @@ import scipy.optimize as so
 import string
 
 from curve_fitting import *
+from pyconturb import SpatialGrid
 
 # --- General fitter
 def fit_powerlaw_u_alpha(x, y, z_ref=100, p0=(10,0.1)):
@@ -139,6 +140,17 @@ def get_sigma_func(con_tc, plot=False):
 
 def get_indices(df, vy, vz, atol=None):
     """ """
+    if isinstance(df, SpatialGrid):  # indices by arithmetic on the regular grid
+        iy, iz = df.nearest(*np.meshgrid(vy, vz, indexing='ij'))
+        iy, iz = iy.ravel(), iz.ravel()
+        if atol is not None:
+            if np.any(np.abs(df.y[iy]-np.repeat(vy, len(vz)))>atol):
+                raise Exception('Wrong y')
+            if np.any(np.abs(df.z[iz]-np.tile(vz, len(vy)))>atol):
+                raise Exception('Wrong z')
+        PointID = list(iy*df.nz+iz)
+        Iu, Iv, Iw = [list(df.index(iy, iz, k)) for k in range(3)]
+        return PointID, Iu, Iv, Iw
     df_u = df.filter(regex='u_', axis=1)
     PointID=[]
     Iu=[]
@@ -1,4 +1,6 @@
-from pyconturb.core import TimeConstraint
-from pyconturb.simulation import gen_turb
+from pyconturb.core import TimeConstraint, SpatialGrid
+from pyconturb.simulation import gen_turb, gen_turb_arr
+from pyconturb.resources import estimate_resources
+from pyconturb._coh_cache import CohCache
 from pyconturb._utils import gen_spat_grid
-from pyconturb._version import __version__, __release__
\ No newline at end of file
+from pyconturb._version import __version__, __release__
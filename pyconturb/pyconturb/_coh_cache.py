@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Cache of the Cholesky factors of coherence matrices
+
+The coherence matrix of a block of points only depends on the point coordinates, the
+coherence model and its parameters and the frequency, while the spectra and
+constraints only enter through the magnitudes. Because ``chol(D C D) = D chol(C)`` for
+a diagonal, positive ``D``, the factor of the coherence matrix ``C`` can be reused by
+every simulation on the same grid (other seeds, sigma profiles, constraint files) and
+only the magnitude scaling has to be applied.
+
+In the built-in coherence models, the frequency and mean wind speed only appear as
+the reduced frequency ``f / u_ref``. The factors of these models are therefore indexed
+by reduced frequency (and the key of the geometry does not contain ``u_ref``), so a
+sweep over wind speeds on the same grid reuses the factors wherever the reduced
+frequencies of two wind speeds coincide (e.g., ``f = i / T`` at 8 and 10 m/s for
+every ``i`` multiple of 4 at 8 m/s).
+
+The cache has two tiers: an in-process LRU dictionary and an optional directory with
+one ``.npy`` file per frequency and geometry. Both tiers are limited in size, and the
+least recently used factors are evicted first.
+"""
+from collections import OrderedDict
+import os
+import threading
+
+import numpy as np
+
+from pyconturb._freq_store import hash_inputs, _tmp_filename
+
+
+_COH_PARAMS = ['u_ref', 'l_c', 'ed', 'backward_comp']  # kwargs used by the coh models
+_REDUCED_FREQ_MODELS = ['iec', '3d']  # models depending only on f / u_ref
+_KEY_DIGITS = 12  # significant digits of the frequencies in the keys
+
+
+class CohCache(object):
+    """Two-tier (memory and disk) cache of coherence Cholesky factors.
+
+    The object can be pickled (e.g., sent to worker processes); every copy has its own
+    memory tier and shares the disk tier.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of the on-disk tier. Created if it does not exist. Default is None
+        (memory tier only).
+    max_bytes : int, optional
+        Maximum size of the on-disk tier. Default is 4 GiB.
+    max_mem_bytes : int, optional
+        Maximum size of the memory tier. Default is 256 MiB.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2**32, max_mem_bytes=2**28):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_mem_bytes = max_mem_bytes
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._init_memory()
+
+    def _init_memory(self):
+        self._mem = OrderedDict()  # key: factor, in order of use
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def __getstate__(self):
+        return {'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes,
+                'max_mem_bytes': self.max_mem_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_memory()
+
+    @property
+    def reuse_ratio(self):
+        """Fraction of the requested factors that were found in the cache"""
+        n_req = self.hits + self.misses
+        return self.hits / n_req if n_req else 0.
+
+    def factors(self, geom_key, freq, compute, key_freq=None):
+        """Cholesky factors of the coherence matrices at the frequencies ``freq``,
+        shape ``(len(freq), n_b, n_b)``. Factors not in the cache are computed in a
+        single call to ``compute(freq_missing)`` and added to the cache. The factors
+        are indexed by ``key_freq`` (e.g., the reduced frequencies), default ``freq``,
+        rounded to 12 significant digits."""
+        key_freq = freq if key_freq is None else key_freq
+        keys = [f'{geom_key}_{float(f"{f:.{_KEY_DIGITS - 1}e}").hex()}'
+                for f in key_freq]
+        found = [self.get(key) for key in keys]
+        i_miss = [i for i, fac in enumerate(found) if fac is None]
+        with self._lock:
+            self.hits += len(keys) - len(i_miss)
+            self.misses += len(i_miss)
+        if i_miss:
+            new = compute(np.asarray(freq)[i_miss])
+            for i, fac in zip(i_miss, new):
+                self.put(keys[i], fac)
+                found[i] = fac
+        return np.stack(found)
+
+    def get(self, key):
+        """Factor of a key (None if not cached). A factor found on disk is added to
+        the memory tier."""
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            fac = np.load(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):  # not cached (or evicted meanwhile)
+            return None
+        self._put_memory(key, fac)
+        return fac
+
+    def put(self, key, fac):
+        """Add a factor to both tiers, evicting the least recently used ones"""
+        self._put_memory(key, fac)
+        if self.cache_dir is None or fac.nbytes > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = _tmp_filename(path)
+        np.save(tmp_path, fac)
+        os.replace(tmp_path + '.npy', path)
+        self._evict_disk()
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
+        if self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npy'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def _put_memory(self, key, fac):
+        if fac.nbytes > self.max_mem_bytes:
+            return
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return
+            self._mem[key] = fac
+            self._mem_bytes += fac.nbytes
+            while self._mem_bytes > self.max_mem_bytes:
+                _, old = self._mem.popitem(last=False)
+                self._mem_bytes -= old.nbytes
+
+    def _evict_disk(self):
+        """Remove the least recently used files until the directory fits max_bytes"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:  # removed by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        tot_bytes = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if tot_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # removed by another process
+                pass
+            tot_bytes -= size
+
+
+def coh_geom_key(spat_df, coh_model='iec', dtype=np.float64, **kwargs):
+    """Hash of everything the coherence matrix of the points in spat_df depends on:
+    the components and lateral/vertical coordinates, the coherence model, its
+    parameters and the data type. ``u_ref`` is left out for the models indexed by
+    reduced frequency (see ``coh_key_freq``)."""
+    coh_kwargs = {key: kwargs[key] for key in _COH_PARAMS if key in kwargs}
+    if coh_model in _REDUCED_FREQ_MODELS:
+        coh_kwargs.pop('u_ref', None)
+    geom = spat_df.loc[['k', 'y', 'z']].values.astype(float)
+    return hash_inputs(geom, coh_model, np.dtype(dtype).str, coh_kwargs)[:32]
+
+
+def coh_key_freq(freq, coh_model='iec', **kwargs):
+    """Frequencies indexing the cached factors: the reduced frequency ``f / u_ref`` for
+    the built-in coherence models, the frequency otherwise."""
+    if coh_model in _REDUCED_FREQ_MODELS:
+        return np.asarray(freq) / kwargs['u_ref']
+    return freq
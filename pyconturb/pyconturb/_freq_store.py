@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""On-disk store for the correlated Fourier components of a simulation
+
+The store replaces the one-pickle-per-frequency files used for parallel processing.
+It consists of two ``.npy`` files sharing a prefix:
+
+* ``<preffix>pyConTurb_fft.npy``: complex array of shape ``(n_f, n_s)``, preallocated
+  when the store is first created. Rows are filled in place by any process.
+* ``<preffix>pyConTurb_done.npy``: ``(n_f,)`` uint8 completion bitmap. A flag is only
+  set once the row has been written and flushed to disk.
+
+Every process writes distinct byte ranges with plain seek/write calls, so several
+processes (or nodes on a shared filesystem) can fill the same store. The combined
+spectrum is opened as a read-only memmap, i.e., without any copy.
+
+Alternatively, each shard of frequencies can be saved as a time-domain partial
+(``<preffix>pyConTurb_part{i}of{n}.npy``), and the box is the sum of the partials.
+
+A checkpoint manifest (``<preffix>pyConTurb_manifest.json``) records a hash of the
+simulation inputs and the key of the random phases. It is written atomically before
+any result, and a call with different inputs refuses to attach to existing results,
+so a rerun with the same arguments continues where a killed run stopped (skipping the
+flagged frequencies or existing partials) without mixing results of other inputs.
+
+A single process per case combines the results. It is chosen with a lock file
+(``<preffix>pyConTurb_combine.lock``), polls for new results, ingests them as they
+appear and keeps its progress in ``<preffix>pyConTurb_combine.json``.
+"""
+import functools
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import types
+import warnings
+
+import numpy as np
+import pandas as pd
+import scipy.fft
+
+
+_CHUNK_BYTES = 2**26  # approx. size of point chunks when converting to time domain
+_POLL_INTERVAL = 1.  # [s] time between checks for new results when combining
+_COMBINE_TIMEOUT = 3600.  # [s] max. time without new results when combining
+
+
+class FreqStore(object):
+    """Preallocated on-disk ``(n_f, n_s)`` spectrum with a completion bitmap.
+
+    Creating the object creates the files if they do not exist and otherwise attaches
+    to the existing ones (after checking the shape and dtype). The object only stores
+    paths and sizes, so it can be pickled and sent to other processes.
+
+    Parameters
+    ----------
+    preffix : str
+        Prefix of the two store files.
+    n_f : int
+        Number of frequencies (rows).
+    n_s : int
+        Number of points (columns).
+    dtype : data type, optional
+        Complex data type of the spectrum. Default is np.complex128.
+    """
+    def __init__(self, preffix, n_f, n_s, dtype=np.complex128):
+        self.preffix = preffix
+        self.data_path = preffix + 'pyConTurb_fft.npy'
+        self.done_path = preffix + 'pyConTurb_done.npy'
+        self.shape = (n_f, n_s)
+        self.dtype = np.dtype(dtype)
+        done = np.zeros(n_f, dtype=np.uint8)
+        done[0] = 1  # DC component is zero, nothing to simulate
+        _create_npy(self.done_path, done.shape, done.dtype, fill=done)
+        _create_npy(self.data_path, self.shape, self.dtype)
+        self._data_offset = _check_npy(self.data_path, self.shape, self.dtype)
+        self._done_offset = _check_npy(self.done_path, done.shape, done.dtype)
+
+    def write(self, i_fs, cor_pha):
+        """Write rows ``i_fs`` of the spectrum, then flag them as done"""
+        cor_pha = np.asarray(cor_pha, dtype=self.dtype)
+        row_size = self.shape[1] * self.dtype.itemsize
+        with open(self.data_path, 'r+b') as fid:
+            for i_f, row in zip(i_fs, cor_pha):
+                fid.seek(self._data_offset + i_f * row_size)
+                fid.write(row.tobytes())
+            fid.flush()
+            os.fsync(fid.fileno())  # rows must be on disk before they are flagged
+        with open(self.done_path, 'r+b') as fid:
+            for i_f in i_fs:
+                fid.seek(self._done_offset + i_f)
+                fid.write(b'\x01')
+
+    def done(self):
+        """Boolean array of the frequencies that have been written"""
+        return np.load(self.done_path).astype(bool)
+
+    def missing(self):
+        """Indices of the frequencies that have not been written yet"""
+        return np.flatnonzero(~self.done())
+
+    def is_complete(self):
+        """True if all frequencies have been written"""
+        return bool(self.done().all())
+
+    def load(self):
+        """Read-only memmap of the full ``(n_f, n_s)`` spectrum (no copy)"""
+        return np.load(self.data_path, mmap_mode='r')
+
+    def delete(self):
+        """Remove the store files"""
+        for path in [self.data_path, self.done_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _tmp_filename(path):
+    """Temporary name of a file being written, unique to the process and thread"""
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def _create_npy(path, shape, dtype, fill=None):
+    """Atomically create a .npy file if it does not exist yet. The file is written
+    under a temporary name and hard-linked to ``path``, which fails if another process
+    created it first, so an existing store is never replaced."""
+    if os.path.exists(path):
+        return
+    tmp_path = _tmp_filename(path)
+    arr = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+    if fill is not None:
+        arr[...] = fill
+    arr.flush()
+    del arr
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:  # another process was faster
+        pass
+    finally:
+        os.remove(tmp_path)
+
+
+def _check_npy(path, shape, dtype):
+    """Verify shape/dtype of an existing .npy file and return its header size"""
+    with open(path, 'rb') as fid:
+        version = np.lib.format.read_magic(fid)
+        if version == (1, 0):
+            file_shape, fortran, file_dtype = np.lib.format.read_array_header_1_0(fid)
+        else:
+            file_shape, fortran, file_dtype = np.lib.format.read_array_header_2_0(fid)
+        offset = fid.tell()
+    if (tuple(file_shape) != tuple(shape)) or (file_dtype != dtype) or fortran:
+        raise ValueError(f'Existing file {path} does not match the simulation '
+                         + f'(shape {file_shape}, dtype {file_dtype})!')
+    return offset
+
+
+def partial_filename(preffix, i_shard, n_shards):
+    """Name of the time-domain partial of a shard"""
+    return f'{preffix}pyConTurb_part{i_shard}of{n_shards}.npy'
+
+
+def save_time_partial(path, fft_rows, i_fs, n_t, dtype=np.float64, n_pts_chunk=None):
+    """Save the time-domain contribution of the frequencies ``i_fs`` to a .npy file.
+
+    The inverse FFT is linear in the frequency rows, so the turbulence box is the sum
+    of the partials of all shards. ``fft_rows`` holds the ``(len(i_fs), n_s)``
+    correlated Fourier components of the shard; the other frequencies are zero. The
+    transform is done point chunk by point chunk, and the file is written under a
+    temporary name and renamed when complete, so an existing partial is complete.
+    """
+    n_f, n_s = n_t // 2 + 1, fft_rows.shape[1]
+    if n_pts_chunk is None:
+        n_pts_chunk = max(1, _CHUNK_BYTES // (16 * n_f))
+    tmp_path = _tmp_filename(path)
+    part = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(n_t, n_s))
+    for i_p in range(0, n_s, n_pts_chunk):
+        cols = slice(i_p, i_p + n_pts_chunk)
+        spec = np.zeros((n_f, part[:, cols].shape[1]), dtype=fft_rows.dtype)
+        spec[i_fs] = fft_rows[:, cols]
+        part[:, cols] = scipy.fft.irfft(spec, axis=0, n=n_t) * n_t
+    part.flush()
+    del part
+    os.replace(tmp_path, path)
+
+
+def sum_time_partials(paths, dtype=np.float64, n_pts_chunk=None):
+    """Sum the time-domain partials in ``paths``, streaming over point chunks so that
+    only one chunk of each partial is in memory at a time. Returns ``(n_t, n_s)``."""
+    parts = [np.load(path, mmap_mode='r') for path in paths]
+    n_t, n_s = parts[0].shape
+    if n_pts_chunk is None:
+        n_pts_chunk = max(1, _CHUNK_BYTES // (8 * n_t * len(parts)))
+    turb_arr = np.empty((n_t, n_s), dtype=dtype)
+    for i_p in range(0, n_s, n_pts_chunk):
+        cols = slice(i_p, i_p + n_pts_chunk)
+        turb_arr[:, cols] = parts[0][:, cols]
+        for part in parts[1:]:
+            turb_arr[:, cols] += part[:, cols]
+    return turb_arr
+
+
+def combine_lock_filename(preffix):
+    """Name of the lock file of the combining process"""
+    return preffix + 'pyConTurb_combine.lock'
+
+
+def combine_record_filename(preffix):
+    """Name of the progress record of the combining process"""
+    return preffix + 'pyConTurb_combine.json'
+
+
+def acquire_combine_lock(preffix):
+    """Try to become the (single) combining process of a case. Returns True if the lock
+    was acquired. A lock left by a dead process on this host is taken over."""
+    path = combine_lock_filename(preffix)
+    owner = f'{socket.gethostname()} {os.getpid()}'
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _lock_is_stale(path):
+                return False
+            os.remove(path)  # owner is dead, remove and try again
+            continue
+        with os.fdopen(fd, 'w') as fid:
+            fid.write(owner)
+        return True
+    return False
+
+
+def release_combine_lock(preffix):
+    """Remove the lock file of the combining process"""
+    path = combine_lock_filename(preffix)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _lock_is_stale(path):
+    """True if the lock was written by a process on this host that no longer runs"""
+    try:
+        with open(path, 'r') as fid:
+            host, pid = fid.read().split()
+        pid = int(pid)
+    except (OSError, ValueError):  # being written or garbled, assume alive
+        return False
+    if host != socket.gethostname():  # can't check other hosts
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:  # exists, but owned by someone else
+        return False
+    return False
+
+
+def _write_record(path, record):
+    """Atomically (over)write a json progress record"""
+    tmp_path = _tmp_filename(path)
+    with open(tmp_path, 'w') as fid:
+        json.dump(record, fid)
+    os.replace(tmp_path, path)
+
+
+def _read_record(path):
+    """Read a json progress record (empty dict if there is none)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fid:
+        return json.load(fid)
+
+
+def combine_store(store, poll=_POLL_INTERVAL, timeout=_COMBINE_TIMEOUT):
+    """Wait until every frequency of the store is done and return the spectrum as a
+    read-only memmap. The rows are written in place by the workers, so only the
+    bitmap is polled; the function returns as soon as the last frequency is flagged.
+    Raises TimeoutError if no new frequency is done during ``timeout`` seconds."""
+    record_path = combine_record_filename(store.preffix)
+    n_f, last_done, t_last = store.shape[0], -1, time.time()
+    while True:
+        n_done = int(store.done().sum())
+        if n_done != last_done:  # progress, update the record
+            _write_record(record_path, {'n_total': n_f, 'n_done': n_done,
+                                        'updated': time.time()})
+            print('Combining frequencies, {}/{} present'.format(n_done, n_f))
+            last_done, t_last = n_done, time.time()
+        if n_done == n_f:
+            return store.load()
+        if time.time() - t_last > timeout:
+            raise TimeoutError(f'No new frequency in {timeout} s, '
+                               + f'{n_f - n_done} missing in {store.data_path}')
+        time.sleep(poll)
+
+
+def combine_time_partials(preffix, n_shards, dtype=np.float64, poll=_POLL_INTERVAL,
+                          timeout=_COMBINE_TIMEOUT, n_pts_chunk=None):
+    """Sum the time-domain partials of all shards as they appear.
+
+    Each partial is added to a running sum on disk (``<preffix>pyConTurb_sum.npy``) as
+    soon as its file exists, and the ingested shards are kept in the progress record,
+    so a restarted combiner continues where it stopped. The shard being added is
+    recorded first; if the combiner died while adding it, the sum is rebuilt from the
+    ingested partials. Returns the ``(n_t, n_s)`` sum as a read-only memory map.
+    Raises TimeoutError if no new partial appears during ``timeout`` seconds.
+    """
+    paths = [partial_filename(preffix, i_shard, n_shards) for i_shard in range(n_shards)]
+    sum_path, record_path = preffix + 'pyConTurb_sum.npy', combine_record_filename(preffix)
+    record = _read_record(record_path)
+    ingested = record.get('ingested', [])
+    if (record.get('pending') is not None) or (ingested and not os.path.exists(sum_path)):
+        ingested = []  # interrupted while adding a partial, rebuild the sum
+    t_last = time.time()
+    while len(ingested) < n_shards:
+        new = [i for i in range(n_shards) if i not in ingested and os.path.exists(paths[i])]
+        if not new:
+            if time.time() - t_last > timeout:
+                raise TimeoutError(f'No new partial in {timeout} s, '
+                                   + f'{n_shards - len(ingested)} missing')
+            time.sleep(poll)
+            continue
+        for i_shard in new:
+            _write_record(record_path, {'n_total': n_shards, 'ingested': ingested,
+                                        'pending': i_shard, 'updated': time.time()})
+            if not ingested:  # first partial, initialize the running sum
+                part = np.load(paths[i_shard], mmap_mode='r')
+                tot = np.lib.format.open_memmap(sum_path, mode='w+', dtype=dtype,
+                                                shape=part.shape)
+                del part
+            else:
+                tot = np.load(sum_path, mmap_mode='r+')
+            _add_partial(tot, paths[i_shard], first=not ingested, n_pts_chunk=n_pts_chunk)
+            tot.flush()
+            del tot
+            ingested = ingested + [i_shard]
+            _write_record(record_path, {'n_total': n_shards, 'ingested': ingested,
+                                        'pending': None, 'updated': time.time()})
+            print('Combining partials, {}/{} present'.format(len(ingested), n_shards))
+        t_last = time.time()
+    return np.load(sum_path, mmap_mode='r')
+
+
+def _add_partial(tot, path, first=False, n_pts_chunk=None):
+    """Add (or copy, if first) a time-domain partial to tot, one point chunk at a time"""
+    part = np.load(path, mmap_mode='r')
+    n_t, n_s = part.shape
+    if n_pts_chunk is None:
+        n_pts_chunk = max(1, _CHUNK_BYTES // (16 * n_t))
+    for i_p in range(0, n_s, n_pts_chunk):
+        cols = slice(i_p, i_p + n_pts_chunk)
+        if first:
+            tot[:, cols] = part[:, cols]
+        else:
+            tot[:, cols] += part[:, cols]
+
+
+def delete_combine_files(preffix):
+    """Remove the checkpoint manifest and the progress record and running sum of the
+    combining process"""
+    for path in [combine_record_filename(preffix), preffix + 'pyConTurb_sum.npy',
+                 manifest_filename(preffix)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def manifest_filename(preffix):
+    """Name of the checkpoint manifest of a case"""
+    return preffix + 'pyConTurb_manifest.json'
+
+
+def hash_inputs(*inputs):
+    """Hash (hex string) of simulation inputs. Handles data frames, arrays, dicts,
+    sequences, scalars (by repr) and functions: Python functions by qualified name,
+    bytecode, constants, names used, defaults and closure contents, so that edited
+    functions, lambdas and closures of other values hash differently; other callables
+    (builtins, ufuncs) by qualified name. Warns if an input has no reliable hash (its
+    repr holds a memory address), as the hash then changes with every run."""
+    sha = hashlib.sha256()
+    seen = set()  # functions being hashed, e.g. recursive closures
+    def feed(obj):
+        if isinstance(obj, pd.DataFrame):
+            feed([obj.index.tolist(), obj.columns.tolist(), obj.values])
+        elif isinstance(obj, np.ndarray):
+            arr = np.ascontiguousarray(obj)
+            sha.update(repr((arr.shape, arr.dtype.str)).encode())
+            if arr.dtype == object:  # e.g., mixed data frames
+                sha.update(repr(arr.tolist()).encode())
+            else:
+                sha.update(arr.tobytes())
+        elif isinstance(obj, types.CodeType):
+            feed([obj.co_code, obj.co_consts, obj.co_names])
+        elif isinstance(obj, types.FunctionType):
+            sha.update(f'{obj.__module__}.{obj.__qualname__}'.encode())
+            if id(obj) not in seen:  # else a recursive reference, hashed by name
+                seen.add(id(obj))
+                cells = []
+                for cell in obj.__closure__ or ():
+                    try:
+                        cells.append(cell.cell_contents)
+                    except ValueError:  # empty cell
+                        cells.append(None)
+                feed([obj.__code__, obj.__defaults__, obj.__kwdefaults__, cells])
+                seen.discard(id(obj))
+        elif isinstance(obj, functools.partial):
+            feed([obj.func, obj.args, obj.keywords])
+        elif isinstance(obj, types.MethodType):
+            feed([obj.__func__, obj.__self__])
+        elif callable(obj) and hasattr(obj, '__qualname__'):
+            sha.update(f'{obj.__module__}.{obj.__qualname__}'.encode())
+        elif isinstance(obj, dict):
+            for key in sorted(obj, key=str):
+                feed(key)
+                feed(obj[key])
+        elif isinstance(obj, (list, tuple)):
+            sha.update(f'[{len(obj)}'.encode())
+            for item in obj:
+                feed(item)
+        elif isinstance(obj, (set, frozenset)):  # order of repr varies between runs
+            feed(sorted(obj, key=repr))
+        else:
+            text = repr(obj)
+            if ' at 0x' in text:
+                warnings.warn(f'Input {text} can not be hashed reliably, a rerun will '
+                              + 'not continue the results written to disk.')
+            sha.update(text.encode())
+        sha.update(b';')
+    feed(list(inputs))
+    return sha.hexdigest()
+
+
+def open_manifest(preffix, input_hash, pha_key, seed=None):
+    """Create the checkpoint manifest of a case, or check an existing one.
+
+    Returns the phase key to use: the one of the manifest if it exists, so that reruns
+    with ``seed=None`` continue with the same phases. Raises a ValueError if the
+    existing manifest was written for different inputs.
+    """
+    path = manifest_filename(preffix)
+    manifest = {'input_hash': input_hash, 'seed': seed,
+                'pha_key': np.asarray(pha_key).tolist(), 'created': time.time()}
+    if not os.path.exists(path):  # atomic creation, first process wins
+        tmp_path = _tmp_filename(path)
+        with open(tmp_path, 'w') as fid:
+            json.dump(manifest, fid)
+            fid.flush()
+            os.fsync(fid.fileno())
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:  # another process was faster
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'r') as fid:
+        manifest = json.load(fid)
+    if manifest['input_hash'] != input_hash:
+        raise ValueError(f'Existing results with preffix "{preffix}" were generated '
+                         + 'with different inputs! Delete them or change preffix.')
+    return np.array(manifest['pha_key'], dtype=np.uint64)
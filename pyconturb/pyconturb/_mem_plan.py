@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Sizing of the chunks of gen_turb from a memory budget
+
+The memory of a simulation has a fixed part, the arrays held for the whole run (the
+spectrum, the magnitudes and the output box, when they are in memory), and a working
+part that grows with the chunk sizes:
+
+* the frequency chunks (``nf_chunk``): per frequency, the coherence matrix of the
+  largest coupled block, factored in place, and the phases of all points and seeds;
+* the pairs of points of the coherence matrices computed at once (``pair_chunk``):
+  per pair, the indices, the distance and the coherences of the chunk's frequencies;
+* the point chunks converted to the time domain (``n_pts_chunk``): per point, a
+  column of the spectrum and two time series.
+
+With a memory budget, the working part is what is left of the budget once the fixed
+part is taken out. It is shared by the ``n_workers`` frequency chunks processed at
+the same time, three quarters going to the chunk buffers and one quarter to the
+temporaries of the coherence pairs. The byte counts are estimates of the largest
+arrays, not an exact account of the interpreter's memory.
+"""
+import warnings
+
+import numpy as np
+
+
+_FINAL_MEM_BUDGET = 2**28  # working memory of the time conversion without a budget
+_PAIR_CHUNK = 10000  # pairs per coherence chunk without a budget
+_PAIR_OVERHEAD = 100  # [B] per pair: index tuple, indices and distance
+_MIN_PAIR_CHUNK = 1000  # below, the loop over the pair chunks dominates
+
+
+def plan_chunks(n_t, n_s, n_sp=None, n_seeds=1, n_mags=None, n_coh=None,
+                dtype=np.float64, mem_budget=None, n_workers=1, n_shards=1, nf_chunk=None,
+                spectrum_in_memory=True, mags_in_memory=True, output_in_memory=True,
+                coh_cache=False):
+    """Chunk sizes of a simulation and its memory use per stage.
+
+    Parameters
+    ----------
+    n_t : int
+        Number of time steps.
+    n_s : int
+        Number of simulated points, constraints included.
+    n_sp : int, optional
+        Number of output points. Default is ``n_s``.
+    n_seeds : int, optional
+        Number of seeds simulated together. Default is 1.
+    n_mags : int, optional
+        Number of columns of the magnitudes (constraints and unique points). Default
+        is ``n_s``.
+    n_coh : int, optional
+        Size of the largest coupled coherence block. Default is ``n_s``.
+    dtype : data-type, optional
+        Real data type of the simulation. Default is np.float64.
+    mem_budget : int, optional
+        [B] Memory the simulation may use. Default is None: ``nf_chunk`` (or 1)
+        frequencies per chunk, 10000 pairs per coherence chunk and 256 MiB of working
+        memory for the time conversion.
+    n_workers : int, optional
+        Number of frequency chunks processed at the same time. Default is 1.
+    n_shards : int, optional
+        Number of shards the frequencies are split into. Default is 1.
+    nf_chunk : int, optional
+        Number of frequencies per chunk, overrides the planned one. Default is None.
+    spectrum_in_memory : bool, optional
+        Whether the spectrum of the shard is held in memory (not in an on-disk store).
+    mags_in_memory : bool, optional
+        Whether the magnitudes of all frequencies are held in memory (not computed
+        chunk by chunk).
+    output_in_memory : bool, optional
+        Whether the output boxes are arrays in memory (not files or sinks).
+    coh_cache : bool, optional
+        Whether a coherence cache is used (the factors are copied out of it).
+
+    Returns
+    -------
+    plan : dict
+        ``nf_chunk``, ``pair_chunk`` and ``n_pts_chunk`` (points per time conversion
+        chunk), and ``mem``, a dict of the estimated bytes of the ``spectrum``,
+        ``magnitudes`` and ``output`` arrays, of the frequency ``chunks`` and
+        coherence ``pairs`` of all workers and of the ``final`` time conversion.
+    """
+    n_sp = n_s if n_sp is None else n_sp
+    n_mags = n_s if n_mags is None else n_mags
+    n_coh = n_s if n_coh is None else n_coh
+    itemsize = np.dtype(dtype).itemsize
+    c_itemsize = np.result_type(dtype, np.complex64).itemsize
+    n_f = n_t // 2 + 1
+    n_f_shard = -(-(n_f - 1) // n_shards)  # frequencies of a shard (DC excluded)
+    # arrays held for the whole run
+    mem = {'spectrum': spectrum_in_memory * min(n_f, n_f_shard + 1) * n_seeds * n_s
+           * c_itemsize,
+           'magnitudes': mags_in_memory * n_f * n_mags * itemsize,
+           'output': output_in_memory * n_seeds * n_t * n_sp * itemsize}
+    fixed = sum(mem.values())
+    # working memory per frequency of a chunk and per coherence pair
+    freq_bytes = ((1 + bool(coh_cache)) * n_coh**2 * itemsize  # coherence/factors
+                  + 4 * n_seeds * n_s * c_itemsize  # phases and correlated phases
+                  + 2 * n_s * itemsize)  # magnitudes
+    pair_bytes = lambda nf: _PAIR_OVERHEAD + 4 * nf * itemsize  # distance, coherences
+    n_pairs = max(n_coh * (n_coh - 1) // 2, 1)
+    if mem_budget is None:
+        nf_chunk = nf_chunk or 1
+        pair_chunk = _PAIR_CHUNK
+        final_budget = _FINAL_MEM_BUDGET
+    else:
+        work = mem_budget - fixed
+        if work <= 0:
+            warnings.warn(f'The arrays held in memory ({fixed / 2**20:.0f} MiB) exceed '
+                          + f'mem_budget ({mem_budget / 2**20:.0f} MiB), using the '
+                          + 'smallest chunks.', stacklevel=3)
+        per_worker = max(work, 0) / n_workers
+        if nf_chunk is None:  # enough chunks to keep all workers busy
+            nf_chunk = int(min(max(0.75 * per_worker // freq_bytes, 1),
+                               max(-(-n_f_shard // n_workers), 1)))
+        pair_chunk = int(max(0.25 * per_worker // pair_bytes(nf_chunk),
+                             _MIN_PAIR_CHUNK))
+        final_budget = mem_budget - fixed + mem['magnitudes']  # magnitudes freed
+    pair_chunk = min(pair_chunk, n_pairs)
+    # a column of the spectrum and two time series per point of the time conversion
+    pt_bytes = n_f * c_itemsize + 2 * n_t * itemsize
+    n_pts_chunk = int(min(max(final_budget // pt_bytes, 1), max(n_seeds * n_sp, 1)))
+    mem['chunks'] = n_workers * nf_chunk * freq_bytes
+    mem['pairs'] = n_workers * pair_chunk * pair_bytes(nf_chunk)
+    mem['final'] = n_pts_chunk * pt_bytes
+    return {'nf_chunk': nf_chunk, 'pair_chunk': pair_chunk, 'n_pts_chunk': n_pts_chunk,
+            'mem': mem}
+
+
+def format_plan(plan):
+    """One-line summary of a plan of ``plan_chunks``"""
+    mem = ', '.join(f'{stage} {n_bytes / 2**20:.1f}' for (stage, n_bytes)
+                    in plan['mem'].items())
+    return (f'nf_chunk={plan["nf_chunk"]}, pair_chunk={plan["pair_chunk"]}, '
+            + f'n_pts_chunk={plan["n_pts_chunk"]}; memory [MiB]: {mem}')
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Progress of the calls to gen_turb working on a case, in a shared status file
+
+The calls working on a case (e.g., the shards started by Submit*.sh, all with the same
+``preffix``) share a small json status file, ``<preffix>pyConTurb_status.json``, with
+one entry per call: its stage (``'frequencies'``, ``'partial'``, ``'combining'``,
+``'time series'`` or ``'done'``), the units of the stage done (frequencies or points,
+skipped ones included) out of the total, the rolling time per unit and throughput
+over the last chunks, and the ETA of the stage. The frequencies done out of the
+frequencies of the call are kept in ``frequencies`` through the later stages.
+
+Each call only (re)writes its own entry, holding an exclusive lock on
+``<status file>.lock`` (if ``fcntl`` is available) and replacing the file atomically,
+so concurrent calls on a node or on a shared filesystem never lose each other's
+entries; without the lock, a lost entry is restored by the next update of its call.
+The file is updated at most every ``interval`` seconds (and at every stage change and
+first chunk of a stage), and a one-line summary is printed at each update. The
+combining call deletes the file once the box is written, like the other files of the
+case, so the file of a case is only found while it runs (or if it failed).
+``pyconturb.status`` summarizes the status files of all cases.
+"""
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import socket
+import threading
+import time
+
+from pyconturb.tictoc import pretty_time
+from pyconturb._freq_store import _tmp_filename
+try:  # optional, used to lock the status file between processes
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+_STATUS_INTERVAL = 30.  # [s] min. time between two updates of the status file
+_N_ROLLING = 20  # chunks of the rolling timings
+_UNIT_NAMES = {'frequencies': 'frequency', 'points': 'point'}  # singular
+
+
+def status_filename(preffix):
+    """Name of the status file of a case"""
+    return preffix + 'pyConTurb_status.json'
+
+
+class Progress(object):
+    """Progress of a call to gen_turb, written to the status file of its case.
+
+    Parameters
+    ----------
+    preffix : str
+        Prefix of the files of the case.
+    shard : tuple, optional
+        ``(i_shard, n_shards)`` of the call. The entry of a shard is replaced by the
+        calls rerunning it. Default is None (entry of the process).
+    interval : float, optional
+        [s] Minimum time between two updates of the file. Default is 30 s.
+    log : bool, optional
+        Whether to print a summary at every update. Default is True.
+    """
+
+    def __init__(self, preffix, shard=None, interval=_STATUS_INTERVAL, log=True):
+        self.path = status_filename(preffix)
+        self.interval, self.log = interval, log
+        self.key = (f'shard {shard[0]}of{shard[1]}' if shard is not None
+                    else f'{socket.gethostname()}:{os.getpid()}')
+        self.entry = {'host': socket.gethostname(), 'pid': os.getpid(),
+                      'shard': None if shard is None else list(shard),
+                      'started': time.time(), 'frequencies': [0, 0]}
+        self._lock = threading.Lock()
+        self._create = True  # whether an update may create the file
+        self.start('setup')
+
+    def start(self, stage, n_total=0, unit='frequencies'):
+        """Start a stage of n_total units"""
+        with self._lock:
+            now = time.time()
+            self.entry.update({'stage': stage, 'unit': unit, 'n_total': int(n_total),
+                               'n_done': 0, 'n_skipped': 0, 'sec_per_unit': None,
+                               'rate': None, 'eta': None, 'stage_started': now})
+            if stage == 'frequencies':
+                self.entry['frequencies'] = [0, int(n_total)]
+            self._chunks = deque([(now, 0, 0.)], maxlen=_N_ROLLING + 1)
+            self._t_last = now
+            self._flush(now)
+
+    def add(self, n_new, seconds=0., n_skipped=0):
+        """Record a chunk of n_new units computed in seconds (worker time) and of
+        n_skipped units already done"""
+        with self._lock:
+            now = time.time()
+            self.entry['n_done'] += int(n_new) + int(n_skipped)
+            self.entry['n_skipped'] += int(n_skipped)
+            if self.entry['stage'] == 'frequencies':
+                self.entry['frequencies'][0] = self.entry['n_done']
+            if n_new:
+                self._chunks.append((now, int(n_new), float(seconds)))
+                n_roll = sum(n for (_, n, _) in list(self._chunks)[1:])
+                sec_roll = sum(sec for (_, _, sec) in list(self._chunks)[1:])
+                span = now - self._chunks[0][0]
+                self.entry['sec_per_unit'] = sec_roll / n_roll if n_roll else None
+                self.entry['rate'] = n_roll / span if span > 0 else None
+            n_left = self.entry['n_total'] - self.entry['n_done']
+            self.entry['eta'] = (n_left / self.entry['rate'] if self.entry['rate']
+                                 else None)
+            first = n_new and len(self._chunks) == 2  # first rate of the stage
+            if now - self._t_last >= self.interval or n_left <= 0 or first:
+                self._flush(now)
+
+    def track(self, write):
+        """Wrap ``write(pts, chunk)`` of the time conversion to count the points
+        written, timed from the end of the previous write"""
+        def tracked(pts, chunk):
+            t0 = self._t_write
+            write(pts, chunk)
+            self._t_write = time.time()
+            self.add(len(pts), seconds=self._t_write - t0)
+        self._t_write = time.time()
+        return tracked
+
+    def finish(self, delete=False):
+        """Mark the call as done, or delete the status file of the case (the case is
+        done). The entry is not written if the file was already deleted."""
+        if delete:
+            with _locked(self.path):
+                for path in [self.path, self.path + '.lock']:
+                    if os.path.exists(path):
+                        os.remove(path)
+            return
+        self._create = False
+        self.start('done')
+
+    def _flush(self, now):
+        """Write the entry to the status file and print it"""
+        self._t_last = now
+        self.entry['updated'] = now
+        update_status(self.path, self.key, dict(self.entry),
+                      create=self._create)
+        if self.log and self.entry['stage'] not in ['setup', 'done']:
+            print('[PROGRESS] ' + format_entry(self.key, self.entry))
+
+
+def update_status(path, key, entry, create=True):
+    """Replace the entry ``key`` of a status file (only if it exists if not create)"""
+    if not (create or os.path.exists(path)):  # e.g., deleted by the combining call
+        return
+    with _locked(path):
+        if not (create or os.path.exists(path)):  # deleted meanwhile
+            if fcntl is not None and os.path.exists(path + '.lock'):
+                os.remove(path + '.lock')  # recreated by _locked
+            return
+        status = read_status(path)
+        status[key] = entry
+        tmp_path = _tmp_filename(path)
+        with open(tmp_path, 'w') as fid:
+            json.dump(status, fid)
+        os.replace(tmp_path, path)
+
+
+def read_status(path):
+    """Entries of a status file (empty dict if there is none or it is unreadable)"""
+    try:
+        with open(path, 'r') as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return {}
+
+
+def format_entry(key, entry):
+    """One-line summary of an entry of a status file"""
+    line = f'{key}: {entry["stage"]}'
+    if entry['n_total']:
+        line += (f' {entry["n_done"]}/{entry["n_total"]} {entry["unit"]}'
+                 + f' ({entry["n_done"] / entry["n_total"]:.0%})')
+    if entry['sec_per_unit'] is not None:
+        line += (f', {entry["sec_per_unit"]:.3g} s per '
+                 + _UNIT_NAMES.get(entry['unit'], entry['unit']))
+    if entry['rate'] is not None:
+        line += f', {entry["rate"]:.3g} {entry["unit"]}/s'
+    if entry['eta'] is not None:
+        line += f', ETA {pretty_time(entry["eta"]).strip()}'
+    return line
+
+
+def is_alive(entry):
+    """False if the entry was written by a process of this host that no longer runs"""
+    if entry.get('host') != socket.gethostname():  # can't check other hosts
+        return True
+    try:
+        os.kill(entry['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, but owned by someone else
+        return True
+    return True
+
+
+@contextmanager
+def _locked(path):
+    """Exclusive lock on path + '.lock' between processes (no-op without fcntl)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as fid:
+        fcntl.flock(fid, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fid, fcntl.LOCK_UN)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """utility functions
 """
+import itertools
 import os
 
 import numpy as np
@@ -21,49 +22,35 @@ def check_sims_collocated(spat_df, con_tc):
     constraints. Returns boolean (True=all collocated)"""
     if con_tc is None:  # no constraints
         return False
-    con_spat_df = con_tc.get_spat()
-    # numerical arrays for which rows 
-    con_arr = con_spat_df.T.values
-    spat_arr = spat_df.T.values
-    # magic with broadcasting (thank you numpy)
-    sim_arr = spat_arr[:, np.newaxis, :]  # [ns, 1, 4] array of sim pts
-    s_in_c = np.all(np.equal(sim_arr, con_arr), axis=2)  # [ns, nc] array of if si is in cj
-    s_non_uniq = np.any(s_in_c, axis=1)  # [ns] array of if s is non unique
-    return np.all(s_non_uniq)
+    con_arr = con_tc.get_spat().loc[_spat_rownames].values.T  # [nc, 4]
+    spat_arr = spat_df.loc[_spat_rownames].values.T  # [ns, 4]
+    # same id for equal points, sim point collocated if its id is a constraint's
+    pt_ids = _row_ids(np.concatenate((con_arr, spat_arr)))
+    return bool(np.isin(pt_ids[con_arr.shape[0]:], pt_ids[:con_arr.shape[0]]).all())
+
 
 def clean_turb(spat_df, all_spat_df, turb_df, decimals=10):
     """Remove the columns we don't return and rename the rest correctly. Will check only
     to decimals places when removing duplicates (data unchanged)."""
+    spat_arr = spat_df.loc[_spat_rownames].values.astype(float).T  # [ns, 4]
     # drop the columns that aren't in spat_df (use isclose for float comparisons)
-    drop_cols = all_spat_df.apply(lambda col:
-                                  not np.all(np.isclose(col.values, spat_df.values.T),
-                                             axis=1).sum()).values
+    drop_cols = _match_points(all_spat_df.loc[_spat_rownames].values.astype(float).T,
+                              spat_arr) < 0
     turb_df.drop(turb_df.columns[drop_cols], axis=1, inplace=True)
     all_spat_df.drop(all_spat_df.columns[drop_cols], axis=1, inplace=True)
     # get unique locs in spat_df (need rounding logic here for dropping float duplicates)
-    spat_xyz = spat_df.loc[['x', 'y', 'z']]
-    spat_xyz = spat_xyz.T.loc[~spat_xyz.T.apply(np.round,
-                                                    args=[decimals]).duplicated()].T
-    # for each column in all_spat_df, find the correct name using spat_df and rename it
-    rename_map={}
-    for colname in all_spat_df:
-        col = all_spat_df[colname]
-        k, x, y, z = col.values
-        pid = np.all(np.isclose(np.array([x, y, z]), spat_xyz.values.T),
-                     axis=1).argmax()  # use np.isclose for float comparisons
-        new_name = f'{"uvw"[int(k)]}_p{pid}'
-        if colname!=new_name:
-            rename_map[colname]=new_name
+    spat_xyz = spat_arr[:, 1:][_first_rows(spat_arr[:, 1:], decimals)]
+    # name of each point: component and first unique loc it is close to (else p0)
+    def point_names(df):
+        pids = np.maximum(_match_points(df.loc[['x', 'y', 'z']].values.astype(float).T,
+                                        spat_xyz), 0)
+        return [f'{"uvw"[int(k)]}_p{pid}' for (k, pid) in zip(df.loc['k'].values, pids)]
+    # rename the columns of all_spat_df using spat_df, then order according to spat_df
+    rename_map = {colname: new_name for (colname, new_name)
+                  in zip(all_spat_df.columns, point_names(all_spat_df))
+                  if colname != new_name}
     turb_df.rename(columns=rename_map, inplace=True)
-    # order according to spat_df
-    col_names = []
-    for colname in spat_df:
-        col = spat_df[colname]
-        k, x, y, z = col.values
-        pid = np.all(np.isclose(np.array([x, y, z]), spat_xyz.values.T),
-                     axis=1).argmax()  # use np.isclose for float comparisons
-        col_names.append(f'{"uvw"[int(k)]}_p{pid}')
-    return turb_df[col_names]
+    return turb_df[point_names(spat_df)]
 
 
 def combine_spat_con(spat_df, con_tc, drop_duplicates=True, decimals=10):
@@ -79,11 +66,78 @@ def combine_spat_con(spat_df, con_tc, drop_duplicates=True, decimals=10):
     comb_df = pd.concat((con_spat_df, spat_df), axis=1)
     if drop_duplicates:
         # need to round before dropping to prevent machine-precision floats being "uniq"
-        comb_df = comb_df.T.loc[~comb_df.T.apply(np.round,
-                                                 args=[decimals]).duplicated()].T
+        comb_df = comb_df.loc[:, _first_rows(comb_df.values.astype(float).T, decimals)]
     return comb_df
 
 
+def _row_ids(arr, decimals=None):
+    """Integer id of every row of arr (n, d), the same for equal rows (compared after
+    rounding to decimals places if given). Hash-based, O(n)."""
+    arr = np.asarray(arr, dtype=float)
+    if decimals is not None:
+        arr = np.round(arr, decimals)
+    ids = np.zeros(arr.shape[0], dtype=np.int64)
+    for col in (arr + 0.).T:  # -0. -> 0.
+        codes, uniq = pd.factorize(col)
+        ids = pd.factorize(ids * (uniq.size + 1) + codes + 1)[0]  # ids stay < n
+    return ids
+
+
+def _first_rows(arr, decimals=None):
+    """Boolean mask of the first occurrence of every distinct row of arr (n, d), rows
+    compared after rounding to decimals places if given"""
+    first = np.zeros(len(arr), dtype=bool)
+    first[np.unique(_row_ids(arr, decimals), return_index=True)[1]] = True
+    return first
+
+
+def _match_points(pts, ref, rtol=1e-05, atol=1e-08):
+    """Index of the first row of ref (n_r, d) close to every row of pts (n_p, d) as
+    ``np.isclose(pts[i], ref[j]).all()``, -1 if none.
+
+    The points are hashed on cells twice as wide as the tolerance, so only the ref
+    points of the (at most 2**d) cells around a point are compared to it: O(n log n)
+    for points further apart than the tolerance instead of O(n_p * n_r).
+    """
+    pts, ref = np.asarray(pts, dtype=float), np.asarray(ref, dtype=float)
+    match = np.full(len(pts), -1)
+    if not (pts.size and ref.size):
+        return match
+    tol = atol + rtol * np.abs(ref).max(axis=0)  # upper bound of the tolerance
+    ref_cells = np.floor(ref / (2 * tol))
+    lo_cells = np.floor((pts - tol) / (2 * tol))  # cells of the points within tol
+    hi_cells = np.floor((pts + tol) / (2 * tol))
+    # number the cells with ref points, key of a cell = mixed-radix of the numbers
+    axes = [np.unique(col) for col in ref_cells.T]
+    def cell_keys(cells):  # key of every cell, -1 if no ref point in it
+        keys, valid = np.zeros(len(cells), dtype=np.int64), np.ones(len(cells), bool)
+        for (ax, col) in zip(axes, cells.T):
+            i = np.minimum(np.searchsorted(ax, col), ax.size - 1)
+            valid &= ax[i] == col
+            keys = keys * ax.size + i
+        return np.where(valid, keys, -1)
+    ref_keys = cell_keys(ref_cells)
+    order = np.argsort(ref_keys, kind='stable')  # ref points grouped by cell
+    uniq_keys, starts, counts = np.unique(ref_keys[order], return_index=True,
+                                          return_counts=True)
+    best = np.full(len(pts), len(ref))
+    for use_hi in itertools.product([False, True], repeat=pts.shape[1]):
+        i_pts = np.flatnonzero((hi_cells != lo_cells)[:, use_hi].all(axis=1))  # new cell
+        keys = cell_keys(np.where(use_hi, hi_cells[i_pts], lo_cells[i_pts]))
+        pos = np.minimum(np.searchsorted(uniq_keys, keys), uniq_keys.size - 1)
+        hit = (keys >= 0) & (uniq_keys[pos] == keys)
+        i_pts, pos = i_pts[hit], pos[hit]
+        # all the pairs (point, ref point of the cell)
+        n_pair = counts[pos]
+        i_pts = np.repeat(i_pts, n_pair)
+        i_ref = order[np.repeat(starts[pos] - np.cumsum(n_pair) + n_pair, n_pair)
+                      + np.arange(n_pair.sum())]
+        close = np.isclose(pts[i_pts], ref[i_ref], rtol=rtol, atol=atol).all(axis=1)
+        np.minimum.at(best, i_pts[close], i_ref[close])
+    match[best < len(ref)] = best[best < len(ref)]
+    return match
+
+
 def df_to_h2turb(turb_df, spat_df, path, prefix=''):
     """ksec3d-style turbulence dataframe to binary files for hawc2
 
@@ -95,8 +149,7 @@ def df_to_h2turb(turb_df, spat_df, path, prefix=''):
        along y.
     """
     nx = turb_df.shape[0]  # turbulence dimensions for reshaping
-    ny = len(set(spat_df.loc['y'].values))
-    nz = len(set(spat_df.loc['z'].values))
+    ny, nz = [ax.size for ax in get_grid_axes(spat_df)]
     # make and save binary files for all three components
     for c in 'uvw':
         arr = turb_df.filter(regex=f'{c}_', axis=1).values.reshape((nx, ny, nz))
@@ -124,6 +177,14 @@ def gen_spat_grid(y, z, comps=[0, 1, 2]):
     return pd.DataFrame(spat_arr, index=_spat_rownames, columns=col_names)
 
 
+def get_grid_axes(spat_df):
+    """y and z coordinates of a y-z grid given by a spat_df or a SpatialGrid"""
+    if isinstance(spat_df, pd.DataFrame):
+        return (pd.unique(spat_df.loc['y'].values.astype(float)),
+                pd.unique(spat_df.loc['z'].values.astype(float)))
+    return spat_df.y, spat_df.z
+
+
 def get_freq(**kwargs):
     """get frequency array"""
     n_t = int(np.ceil(kwargs['T'] / kwargs['dt']))
@@ -135,7 +196,7 @@ def get_freq(**kwargs):
 
 def h2turb_to_arr(spat_df, path):
     """raw-load a hawc2 turbulent binary file to numeric array"""
-    ny, nz = pd.unique(spat_df.loc['y']).size, pd.unique(spat_df.loc['z']).size
+    ny, nz = [ax.size for ax in get_grid_axes(spat_df)]
     bin_arr = np.fromfile(path, dtype=np.dtype(_HAWC2_BIN_FMT))
     nx = bin_arr.size // (ny * nz)
     if (nx * ny * nz) != bin_arr.size:
@@ -237,7 +298,7 @@ def make_hawc2_input(turb_dir, spat_df, **kwargs):
 
     # string for mann model block
     T, dt = kwargs['T'], kwargs['dt']
-    y, z = set(spat_df.loc['y'].values), set(spat_df.loc['z'].values)
+    y, z = get_grid_axes(spat_df)
     n_x, du = int(np.ceil(T / dt)), dt * kwargs['u_ref']
     n_y, dv = len(y), (max(y) - min(y)) / (len(y) - 1)
     n_z, dw = len(z), (max(z) - min(z)) / (len(z) - 1)
@@ -252,6 +313,8 @@ def make_hawc2_input(turb_dir, spat_df, **kwargs):
                '  end mann '
 
     # string for output
+    if not isinstance(spat_df, pd.DataFrame):  # SpatialGrid
+        spat_df = spat_df.to_df()
     pts_df = spat_df.loc[['x', 'y', 'z'], spat_df.loc['k'] == 0]
     str_output = ''
     for col in pts_df.columns:
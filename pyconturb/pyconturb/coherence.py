@@ -8,6 +8,10 @@ import numpy as np
 
 def get_coh_mat(freq, spat_df, coh_model='iec', dtype=np.float64, **kwargs):
     """Create coherence matrix for given frequencies and coherence model
+
+    The returned array has shape ``(n_s, n_s, n_f)``. For the current (not
+    ``backward_comp``) models it is a view of a C-contiguous ``(n_f, n_s, n_s)`` stack,
+    so ``np.moveaxis(coh_mat, -1, 0)`` gives the stacked matrices without a copy.
     """
     if 'backward_comp' in kwargs.keys() and kwargs['backward_comp']:
         if coh_model == 'iec':  # IEC coherence model
@@ -33,6 +37,26 @@ def get_coh_mat(freq, spat_df, coh_model='iec', dtype=np.float64, **kwargs):
 
     return coh_mat
 
+
+def get_coh_blocks(spat_df, coh_model='iec'):
+    """Independent blocks of the coherence matrix for the points in spat_df.
+
+    Points in different blocks have zero coherence, so the coherence matrix is
+    block-diagonal (up to a permutation) and can be factored one block at a time.
+    Returns a list of ``(idx, coupled)`` tuples, where ``idx`` are the column indices
+    of the block in spat_df (in increasing order) and ``coupled`` is False if the block
+    is the identity matrix.
+    """
+    k = spat_df.loc['k'].values
+    if coh_model == 'iec':  # only u-components are correlated
+        blocks = [(np.flatnonzero(k == 0), True), (np.flatnonzero(k != 0), False)]
+    elif coh_model == '3d':  # each component only correlated with itself
+        blocks = [(np.flatnonzero(k == kval), True) for kval in range(3)]
+    else:  # unknown coherence model
+        raise ValueError(f'Coherence model "{coh_model}" not recognized.')
+    return [(idx, coupled) for (idx, coupled) in blocks if idx.size]
+
+
 def chunker(iterable,nPerChunks):
     """ Return list of nPerChunks elements of an iterable """
     it = iter(iterable)
@@ -42,8 +66,9 @@ def chunker(iterable,nPerChunks):
            return
        yield chunk
 
-def get_iec_coh_mat(freq, spat_df, dtype=np.float64, **kwargs):
-    """Create IEC 61400-1 Ed. 3 coherence matrix for given frequencies
+def get_iec_coh_mat(freq, spat_df, dtype=np.float64, pair_chunk=10000, **kwargs):
+    """Create IEC 61400-1 Ed. 3 coherence matrix for given frequencies. The coherences
+    are computed for ``pair_chunk`` pairs of points at a time.
     """
     # preliminaries
     if kwargs['ed'] != 3:  # only allow edition 3
@@ -54,27 +79,30 @@ def get_iec_coh_mat(freq, spat_df, dtype=np.float64, **kwargs):
     n_f, n_s = freq.size, spat_df.shape[1]
     # misc storage
     xyz = spat_df.loc[['x', 'y', 'z']].values.astype(float)
-    coh_mat = np.repeat(np.atleast_3d(np.eye((n_s),dtype=dtype)), n_f, axis=2) # TODO use sparse matrix 
+    coh_mat = np.zeros((n_f, n_s, n_s), dtype=dtype)  # frequencies stacked on 1st axis
+    coh_mat[:, np.arange(n_s), np.arange(n_s)] = 1
     exp_constant = np.sqrt( (1/ kwargs['u_ref'] * freq)**2 + (0.12 / kwargs['l_c'])**2).astype(dtype)
     Icomp = np.arange(n_s)[spat_df.iloc[0, :].values==0]  # Selecting only u-components
     # loop through number of combinations, nPerChunks at a time to reduce memory impact
-    for ii_jj in chunker(itertools.combinations(Icomp, 2), nPerChunks=10000):
+    for ii_jj in chunker(itertools.combinations(Icomp, 2), nPerChunks=pair_chunk):
         # get indices of point-pairs
         ii = np.array([tup[0] for tup in ii_jj])
         jj = np.array([tup[1] for tup in ii_jj])
         # calculate distances and coherences
         r = np.sqrt((xyz[1, ii] - xyz[1, jj])**2 + (xyz[2, ii] - xyz[2, jj])**2)
+        r = r.astype(dtype, copy=False)  # so the coherences are in the output precision
         coh_values = np.exp(-12 * np.abs(r.reshape(-1, 1))* exp_constant)
         # Previous method (same math, different numerics)
         # coh_values = np.exp(-12 *
         #                     np.sqrt((r.reshape(-1, 1) / kwargs['u_ref'] * freq)**2
         #                             + (0.12 * r.reshape(-1, 1) / kwargs['l_c'])**2))
-        coh_mat[ii, jj, :] = coh_values
-        coh_mat[jj, ii, :] = np.conj(coh_values)
-    return coh_mat
+        coh_mat[:, ii, jj] = coh_values.T
+        coh_mat[:, jj, ii] = np.conj(coh_values.T)
+    return np.moveaxis(coh_mat, 0, -1)  # (n_s, n_s, n_f) view of stack
 
-def get_3d_coh_mat(freq, spat_df, dtype=np.float64, **kwargs):
-    """Create coherence matrix with 3d coherence for given frequencies
+def get_3d_coh_mat(freq, spat_df, dtype=np.float64, pair_chunk=10000, **kwargs):
+    """Create coherence matrix with 3d coherence for given frequencies. The coherences
+    are computed for ``pair_chunk`` pairs of points at a time.
     """
     if any([k not in kwargs.keys() for k in ['u_ref', 'l_c']]):  # check kwargs
         raise ValueError('Missing keyword arguments for IEC coherence model')
@@ -83,25 +111,27 @@ def get_3d_coh_mat(freq, spat_df, dtype=np.float64, **kwargs):
     n_f, n_s = freq.size, spat_df.shape[1]
     # misc storage
     xyz = spat_df.loc[['x', 'y', 'z']].values
-    coh_mat = np.repeat(np.atleast_3d(np.eye((n_s),dtype=dtype)), n_f, axis=2)
+    coh_mat = np.zeros((n_f, n_s, n_s), dtype=dtype)  # frequencies stacked on 1st axis
+    coh_mat[:, np.arange(n_s), np.arange(n_s)] = 1
     # loop through the three components
     for (k, lc_scale) in [(0, 1), (1, 2.7 / 8.1), (2, 0.66 / 8.1)]:
         Icomp = np.arange(n_s)[spat_df.iloc[0, :].values==k]  # Selecting only 1 component
         l_c = kwargs['l_c'] * lc_scale
         exp_constant = np.sqrt( (1/ kwargs['u_ref'] * freq)**2 + (0.12 / l_c)**2).astype(dtype)
         # loop through number of combinations, nPerChunks at a time to reduce memory impact
-        for ii_jj in chunker(itertools.combinations(Icomp, 2), nPerChunks=10000):
+        for ii_jj in chunker(itertools.combinations(Icomp, 2), nPerChunks=pair_chunk):
             ii = np.array([tup[0] for tup in ii_jj])
             jj = np.array([tup[1] for tup in ii_jj])
             r = np.sqrt((xyz[1, ii] - xyz[1, jj])**2 + (xyz[2, ii] - xyz[2, jj])**2)
+            r = r.astype(dtype, copy=False)  # coherences in the output precision
             coh_values = np.exp(-12 * np.abs(r.reshape(-1, 1))* exp_constant)
             # Previous method (same math, different numerics)
             # coh_values = np.exp(-12 *
             #                    np.sqrt((r.reshape(-1, 1) / kwargs['u_ref'] * freq)**2
             #                            + (0.12 * r.reshape(-1, 1) / l_c)**2))
-            coh_mat[ii, jj, :] = coh_values
-            coh_mat[jj, ii, :] = np.conj(coh_values)
-    return coh_mat
+            coh_mat[:, ii, jj] = coh_values.T
+            coh_mat[:, jj, ii] = np.conj(coh_values.T)
+    return np.moveaxis(coh_mat, 0, -1)  # (n_s, n_s, n_f) view of stack
 
 
 def get_3d_coh_mat_old(freq, spat_df, **kwargs):
@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+from pyconturb._utils import _spat_rownames
+
 
 class TimeConstraint(DataFrame):
     """DataFrame-style object that specfies time constraints for simulation.
@@ -71,3 +73,110 @@ class TimeConstraint(DataFrame):
                               + con_turb_df.index.to_list())
         self.__init__(con_df)
         return self
+
+
+class SpatialGrid(object):
+    """Compact spatial information of the points of a regular y-z grid.
+
+    Equivalent to the ``spat_df`` of ``gen_spat_grid(y, z, comps)`` (same points, same
+    order: the components of a point, then z, then y), but only the grid axes are
+    stored. The component codes (int8), the grid indices and the coordinates of the
+    points are computed on demand, and the column of the point at ``(iy, iz)`` is
+    found by arithmetic. Accepted wherever a spatial dataframe of a y-z grid is
+    (``gen_turb``, the output sinks, ``df_to_h2turb``, etc.).
+
+    Parameters
+    ----------
+    y : array-like
+        [m] Lateral coordinates of the grid, evenly spaced.
+    z : array-like
+        [m] Vertical coordinates of the grid, evenly spaced.
+    comps : list, optional
+        Turbulence components of every point (0=u, 1=v, 2=w). Default is [0, 1, 2].
+    x : float, optional
+        [m] Longitudinal coordinate of the grid plane. Default is 0.
+    """
+
+    def __init__(self, y, z, comps=[0, 1, 2], x=0):
+        self.y = np.atleast_1d(np.asarray(y, dtype=float))
+        self.z = np.atleast_1d(np.asarray(z, dtype=float))
+        self.comps = np.asarray(comps, dtype=np.int8)
+        self.x = float(x)
+        for name, ax in [('y', self.y), ('z', self.z)]:
+            step = np.diff(ax)
+            if (ax.ndim != 1) or (step.size and ((step[0] == 0) or not
+                                                 np.allclose(step, step[0]))):
+                raise ValueError(f'{name} must be a 1D array of evenly spaced values!')
+        if ((self.comps.ndim != 1) or (np.unique(self.comps).size != self.comps.size)
+                or np.any((self.comps < 0) | (self.comps > 2))):
+            raise ValueError('comps must be unique components among 0, 1 and 2!')
+        self._comp_pos = np.full(3, -1)  # position of a component among the comps
+        self._comp_pos[self.comps] = np.arange(self.comps.size)
+
+    def __repr__(self):
+        return (f'SpatialGrid(ny={self.ny}, nz={self.nz}, '
+                + f'comps={self.comps.tolist()}, n_sp={self.n_sp})')
+
+    y0 = property(lambda self: self.y[0], doc='First y coordinate')
+    z0 = property(lambda self: self.z[0], doc='First z coordinate')
+    ny = property(lambda self: self.y.size, doc='Number of y coordinates')
+    nz = property(lambda self: self.z.size, doc='Number of z coordinates')
+    dy = property(lambda self: (self.y[-1] - self.y0) / max(self.ny - 1, 1),
+                  doc='Step of the y coordinates (0 if only one)')
+    dz = property(lambda self: (self.z[-1] - self.z0) / max(self.nz - 1, 1),
+                  doc='Step of the z coordinates (0 if only one)')
+    n_c = property(lambda self: self.comps.size, doc='Number of components per point')
+    n_sp = property(lambda self: self.ny * self.nz * self.n_c,
+                    doc='Number of points/components (columns of spat_df)')
+    shape = property(lambda self: (len(_spat_rownames), self.n_sp),
+                     doc='Shape of the equivalent spat_df')
+
+    @property
+    def k(self):
+        """Component of every column, int8 ``(n_sp,)``"""
+        return np.tile(self.comps, self.ny * self.nz)
+
+    @property
+    def i_p(self):
+        """Index of the point (location) of every column ``(n_sp,)``"""
+        return np.arange(self.n_sp) // self.n_c
+
+    @property
+    def iy(self):
+        """Index in y of every column ``(n_sp,)``"""
+        return self.i_p // self.nz
+
+    @property
+    def iz(self):
+        """Index in z of every column ``(n_sp,)``"""
+        return self.i_p % self.nz
+
+    @property
+    def values(self):
+        """Spatial information ``(4, n_sp)``, rows k, x, y and z as in spat_df"""
+        i_p = self.i_p
+        return np.array([self.k, np.full(self.n_sp, self.x), self.y[i_p // self.nz],
+                         self.z[i_p % self.nz]], dtype=float)
+
+    @property
+    def columns(self):
+        """Names of the columns, e.g. ``u_p0``, as in gen_spat_grid and gen_turb"""
+        return pd.Index(np.char.add(np.char.add(np.array(list('uvw'))[self.k], '_p'),
+                                    self.i_p.astype(str)), dtype=object)
+
+    def index(self, iy, iz, k=0):
+        """Column(s) of component(s) k at the grid point(s) (iy, iz)"""
+        pos = self._comp_pos[k]
+        if np.any(pos < 0):
+            raise ValueError(f'Component(s) {k} not in the grid!')
+        return (np.asarray(iy) * self.nz + iz) * self.n_c + pos
+
+    def nearest(self, y, z):
+        """Grid indices (iy, iz) of the grid point(s) nearest to (y, z)"""
+        iy = np.rint((np.asarray(y) - self.y0) / (self.dy or 1)).astype(int)
+        iz = np.rint((np.asarray(z) - self.z0) / (self.dz or 1)).astype(int)
+        return np.clip(iy, 0, self.ny - 1), np.clip(iz, 0, self.nz - 1)
+
+    def to_df(self):
+        """Equivalent spat_df (pandas.DataFrame)"""
+        return pd.DataFrame(self.values, index=_spat_rownames, columns=self.columns)
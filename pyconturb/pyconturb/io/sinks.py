@@ -0,0 +1,224 @@
+"""Output sinks streaming the time series of gen_turb to turbulence files
+
+A sink is passed to ``gen_turb`` as ``out``. The time series are converted point chunk
+by point chunk and each chunk is written straight into the (memory-mapped) files, so
+neither the full box nor a data frame of it is ever held in memory.
+
+A sink must have the methods ``start(t)`` (called once with the time array),
+``write(pts, chunk)`` (time series ``chunk``, ``(n_t, len(pts))``, of the points of
+indices ``pts`` in ``spat_df``, mean wind included) and ``close()``. A sink with
+``needs_scan = True`` is first given every chunk through ``scan(pts, chunk)``, e.g. to
+get the range of the data before writing it.
+
+Notes
+-----
+The file layouts are the ones of TurbSimFile and MannBoxFile (weio library), used by
+02_ConvertExtract.py and 03_TurbSim2Mann.py.
+"""
+import struct
+import time
+
+import numpy as np
+
+from pyconturb.core import SpatialGrid
+
+
+_BTS_INTMIN, _BTS_INTRNG = -32768, 65535  # int16 range of the .bts data
+_HAWC2_BIN_FMT = '<f'  # HAWC2 binary turbulence datatype
+
+
+class _GridSink(object):
+    """Time series of the u, v and w components on a regular y-z grid. Coordinates
+    are rounded to ``decimals`` places when building the grid."""
+
+    def __init__(self, spat_df, remove_mean='', decimals=7):
+        if isinstance(spat_df, SpatialGrid):  # grid indices by arithmetic
+            k = spat_df.k.astype(int)
+            y_ord, z_ord = np.argsort(spat_df.y), np.argsort(spat_df.z)  # increasing
+            self.y, iy = spat_df.y[y_ord], np.argsort(y_ord)[spat_df.iy]
+            self.z, iz = spat_df.z[z_ord], np.argsort(z_ord)[spat_df.iz]
+        else:
+            k = spat_df.loc['k'].values.astype(int)
+            self.y, iy = np.unique(np.around(spat_df.loc['y'].values.astype(float),
+                                             decimals), return_inverse=True)
+            self.z, iz = np.unique(np.around(spat_df.loc['z'].values.astype(float),
+                                             decimals), return_inverse=True)
+        ny, nz = self.y.size, self.z.size
+        if np.unique(k + 3 * (iy + ny * iz)).size != 3 * ny * nz or k.size != 3 * ny * nz:
+            raise ValueError('spat_df must hold each component u, v, w once at every '
+                             + 'point of a y-z grid!')
+        self.k, self.iy, self.iz = k, iy, iz
+        self.n_sp = k.size
+        self.remove_mean = np.array(['uvw'[i] in remove_mean for i in range(3)])
+
+    def start(self, t):
+        self.t = np.asarray(t)
+
+    def close(self):
+        pass
+
+    def _values(self, pts, chunk):
+        """Chunk in single precision, per-point mean removed for the chosen
+        components"""
+        chunk = np.asarray(chunk, dtype=np.float32)
+        rm_cols = self.remove_mean[self.k[pts]]
+        if rm_cols.any():
+            chunk = chunk.copy()
+            chunk[:, rm_cols] -= chunk[:, rm_cols].mean(axis=0, dtype=np.float64)
+        return chunk
+
+
+class BtsSink(_GridSink):
+    """Write to a TurbSim binary file (.bts), as TurbSimFile.write.
+
+    The data are stored as int16 with a scaling per component, so the range of each
+    component is scanned before the data are written. Like 02_ConvertExtract.py, the
+    mean of the v and w components is removed at every point and the file is flagged
+    as periodic (``ID=8``).
+
+    Parameters
+    ----------
+    path : str
+        Path to the .bts file.
+    spat_df : pandas.DataFrame or pyconturb.SpatialGrid
+        Spatial information of the points (as given to ``gen_turb``), the u, v and w
+        components on a regular y-z grid.
+    remove_mean : str, optional
+        Components whose mean is removed at every point. Default is ``'vw'``.
+    ID : int, optional
+        TurbSim identifier (7: not periodic, 8: periodic). Default is 8.
+    """
+    needs_scan = True
+
+    def __init__(self, path, spat_df, remove_mean='vw', ID=8):
+        super().__init__(spat_df, remove_mean=remove_mean)
+        self.path, self.ID = path, ID
+        ny, nz = self.y.size, self.z.size
+        # hub values as TurbSimFile.hubValues with zHub at the middle of the box
+        self.z_hub = (self.z[0] + self.z[-1]) / 2
+        i_hub = 3 * (np.argmin(np.abs(self.y - (self.y[0] + self.y[-1]) / 2))
+                     + ny * np.argmin(np.abs(self.z - self.z_hub)))  # u at hub
+        self._i_hub = np.flatnonzero(self.k + 3 * (self.iy + ny * self.iz) == i_hub)[0]
+        self.u_hub = 0.
+        self._data = None
+
+    def start(self, t):
+        super().start(t)
+        self._min = np.full(3, np.inf, dtype=np.float32)
+        self._max = np.full(3, -np.inf, dtype=np.float32)
+
+    def scan(self, pts, chunk):
+        """Update the range of every component and the hub wind speed"""
+        chunk = self._values(pts, chunk)
+        for k in range(3):
+            cols = self.k[pts] == k
+            if cols.any():
+                self._min[k] = min(self._min[k], chunk[:, cols].min())
+                self._max[k] = max(self._max[k], chunk[:, cols].max())
+        is_hub = np.asarray(pts) == self._i_hub
+        if is_hub.any():
+            self.u_hub = float(np.mean(chunk[:, is_hub]))
+
+    def write(self, pts, chunk):
+        """Scale a chunk to int16 and write it in the file"""
+        if self._data is None:
+            self._open()
+        chunk = self._values(pts, chunk)
+        k = self.k[pts]
+        self._data[:, self.iz[pts], self.iy[pts], k] = (chunk * self.scl[k]
+                                                        + self.off[k]).astype(np.int16)
+
+    def close(self):
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+
+    def _open(self):
+        """Write the header and memory-map the data, (n_t, nz, ny, 3)"""
+        self.scl = np.ones(3, dtype=np.float32)
+        rng = self._max - self._min
+        self.scl[rng > 0] = _BTS_INTRNG / rng[rng > 0]
+        self.off = (_BTS_INTMIN - self.scl * self._min).astype(np.float32)
+        ny, nz, nt = self.y.size, self.z.size, self.t.size
+        dy = self.y[1] - self.y[0] if ny > 1 else 0
+        dz = self.z[1] - self.z[0] if nz > 1 else 0
+        dt = self.t[1] - self.t[0]
+        info = 'Generated by PyConTurb on {:s}.'.format(
+            time.strftime('%d-%b-%Y at %H:%M:%S', time.localtime()))
+        header = (struct.pack('<h4l', self.ID, nz, ny, 0, nt)
+                  + struct.pack('<6f', dz, dy, dt, self.u_hub, self.z_hub, self.z[0])
+                  + struct.pack('<6f', *np.ravel(np.column_stack((self.scl, self.off))))
+                  + struct.pack('<l', len(info)) + info.encode())
+        with open(self.path, 'wb') as fid:
+            fid.write(header)
+        self._data = np.memmap(self.path, dtype='<i2', mode='r+', offset=len(header),
+                               shape=(nt, nz, ny, 3))
+
+
+class Hawc2Sink(_GridSink):
+    """Write to HAWC2 (Mann box) binary files ``<path>.u``, ``<path>.v`` and
+    ``<path>.w``, as MannBoxFile.write: float32, z the fastest index, then y (from
+    the largest to the smallest y), then time. Like 03_TurbSim2Mann.py, the mean of
+    every component is removed at every point.
+
+    Parameters
+    ----------
+    path : str
+        Path to the files, without extension.
+    spat_df : pandas.DataFrame or pyconturb.SpatialGrid
+        Spatial information of the points (as given to ``gen_turb``), the u, v and w
+        components on a regular y-z grid.
+    remove_mean : str, optional
+        Components whose mean is removed at every point. Default is ``'uvw'``.
+    """
+
+    def __init__(self, path, spat_df, remove_mean='uvw'):
+        super().__init__(spat_df, remove_mean=remove_mean)
+        self.path = path
+        self._data = None
+
+    def start(self, t):
+        super().start(t)
+        shape = (self.t.size, self.y.size, self.z.size)
+        self._data = [np.memmap(f'{self.path}.{c}', dtype=_HAWC2_BIN_FMT, mode='w+',
+                                shape=shape) for c in 'uvw']
+
+    def write(self, pts, chunk):
+        """Write a chunk in the files of its components"""
+        chunk = self._values(pts, chunk)
+        k, iy_flip, iz = self.k[pts], self.y.size - 1 - self.iy[pts], self.iz[pts]
+        for i_c, data in enumerate(self._data):
+            cols = k == i_c
+            data[:, iy_flip[cols], iz[cols]] = chunk[:, cols]
+
+    def close(self):
+        if self._data is not None:
+            for data in self._data:
+                data.flush()
+            self._data = None
+
+
+class MultiSink(object):
+    """Write the same time series to several sinks (e.g., a .bts file and HAWC2
+    binaries)"""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.needs_scan = any(getattr(sink, 'needs_scan', False) for sink in sinks)
+
+    def start(self, t):
+        for sink in self.sinks:
+            sink.start(t)
+
+    def scan(self, pts, chunk):
+        for sink in self.sinks:
+            if getattr(sink, 'needs_scan', False):
+                sink.scan(pts, chunk)
+
+    def write(self, pts, chunk):
+        for sink in self.sinks:
+            sink.write(pts, chunk)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -8,12 +8,38 @@ from pyconturb.sig_models import get_sig_values
 from pyconturb._utils import get_freq
 
 
-def get_magnitudes(spat_df, spec_func, sig_func, **kwargs):
-    """"""
+_MAG_CHUNK_BYTES = 2**26  # approx. size of the frequency chunks of the scaling pass
+_SPATIAL_COORDS = ('k', 'y', 'z')  # coordinates passed to the spectrum/sigma functions
+
+
+def get_magnitudes(spat_df, spec_func, sig_func, return_index=False, **kwargs):
+    """Magnitudes (nf, nsp) of the points in spat_df. The spectrum and sigma are only
+    evaluated on the unique points (see ``get_unique_points``). With return_index,
+    return the (nf, n_unique) magnitudes and the (nsp,) index map instead."""
     t, freq = get_freq(**kwargs)
-    spc_arr = get_spec_values(freq, spat_df, spec_func, **kwargs)
-    mags_arr = spc_to_mag(spat_df, spc_arr, sig_func, **kwargs)
-    return mags_arr
+    uniq_df, inv = get_unique_points(spat_df, spec_func, sig_func)
+    spc_arr = get_spec_values(freq, uniq_df, spec_func, **kwargs)
+    mags_arr = spc_to_mag(uniq_df, spc_arr, sig_func, **kwargs)
+    if return_index:
+        return mags_arr, inv
+    return mags_arr[:, inv]
+
+
+def get_unique_points(spat_df, *funcs):
+    """Points of spat_df with distinct values of the coordinates used by the functions
+    and the (nsp,) index map, such that ``values[..., inv]`` broadcasts values of the
+    unique points to all points. A function declares the coordinates it depends on
+    with its ``spatial_coords`` attribute (e.g., ``('k', 'z')``), default is all of
+    k, y and z."""
+    coords = [c for c in _SPATIAL_COORDS
+              if any(c in getattr(func, 'spatial_coords', _SPATIAL_COORDS)
+                     for func in funcs)]
+    n_sp = spat_df.shape[1]
+    if not n_sp or not coords:  # nothing to compare, all points (or one) the same
+        return spat_df.iloc[:, :min(n_sp, 1)], np.zeros(n_sp, dtype=int)
+    vals = spat_df.loc[coords].values.astype(float)
+    _, i_first, inv = np.unique(vals, axis=1, return_index=True, return_inverse=True)
+    return spat_df.iloc[:, i_first], np.ravel(inv)
 
 
 def spc_to_mag(spat_df, spc_arr, sig_func, **kwargs):
@@ -34,3 +60,36 @@ def spc_to_mag(spat_df, spc_arr, sig_func, **kwargs):
                              - ((n_t+1) % 2)*np.abs(mags[-1, :])**2))
     alpha = std_theo / std_now
     return (alpha * mags).astype(float)  # (nf, nsp)
+
+
+def get_mag_scaling(spat_df, spec_func, sig_func, nf_chunk=None, **kwargs):
+    """Scaling (n_sp,) of the unscaled magnitudes to the correct ti, computed
+    in a streaming pass over chunks of ``nf_chunk`` frequencies (so that the full
+    ``(nf, nsp)`` spectrum is never in memory). Same as in ``spc_to_mag``."""
+    t, freq = get_freq(**kwargs)
+    n_t, df, n_sp = t.size, freq[1], spat_df.shape[1]
+    if nf_chunk is None:
+        nf_chunk = max(1, _MAG_CHUNK_BYTES // (8 * max(n_sp, 1)))
+    sum_sq = np.zeros(n_sp)  # sum of squared unscaled magnitudes (DC is zero)
+    for i_f in range(1, freq.size, nf_chunk):
+        spc_arr = get_spec_values(freq[i_f:i_f + nf_chunk], spat_df, spec_func, **kwargs)
+        sum_sq += np.sum(np.abs(spc_arr) * df / 2, axis=0)  # |mags|^2
+    std_theo = get_sig_values(spat_df, sig_func, **kwargs)  # (n_sp,)
+    if n_t == 2:
+        std_now = np.sqrt(n_t/(n_t-1) * sum_sq)
+    else:
+        last_sq = np.abs(get_spec_values(freq[-1:], spat_df, spec_func,
+                                         **kwargs)[0]) * df / 2
+        std_now = np.sqrt(n_t/(n_t-1) * (2*sum_sq - ((n_t+1) % 2)*last_sq))
+    return np.asarray(std_theo / std_now, dtype=float)
+
+
+def get_chunk_magnitudes(i_fs, spat_df, spec_func, mag_scale, **kwargs):
+    """Magnitudes (len(i_fs), nsp) of the frequency indices i_fs, scaled by mag_scale
+    from ``get_mag_scaling`` (DC component is 0)"""
+    t, freq = get_freq(**kwargs)
+    i_fs = np.asarray(i_fs)
+    spc_arr = get_spec_values(freq[i_fs], spat_df, spec_func, **kwargs)
+    mags = np.sqrt(spc_arr * freq[1] / 2)  # (len(i_fs), nsp)
+    mags[i_fs == 0, :] = 0.  # mean is zero to make math easier
+    return (mag_scale * mags).astype(float)
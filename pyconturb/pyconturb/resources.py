@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Dry-run estimate of the resources of a simulation with ``gen_turb``
+
+Nothing is simulated: the memory per stage comes from the chunk plan of ``gen_turb``
+(see ``pyconturb._mem_plan``), the floating-point operations and disk usage are
+counted from the sizes of the problem and the runtime is projected from rates
+measured by a short benchmark of the same kernels on the current machine.
+
+The floating-point operations (FLOPs) are counted per stage:
+
+* coherence: ~12 per pair of coupled points and frequency (the exponential counted as
+  10);
+* factorization: ``n_b**3 / 3`` per coupled block of ``n_b`` points and frequency
+  (Cholesky);
+* correlation: the product of the factors with the phases of all seeds (and the
+  triangular solve of the constraints);
+* irfft: ``2.5 n_t log2(n_t)`` per time series.
+
+The frequency stages are split between the shards, which run in parallel; the time
+conversion is done by the combining call (or by every shard with time partials). The
+magnitudes, phases and file input/output are not included in the runtime.
+
+Can be run from the command line, e.g. for the grid of 01_GenerateTurbBox.py::
+
+    python -m pyconturb.resources --y -320 320 214 --z 3 480 160 --T 600 --dt 0.02857 \\
+        --dtype float32 --n-con 9 --shards 2 --write-freq-data --out bts hawc2
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.fft
+
+from pyconturb.coherence import get_coh_mat, get_coh_blocks
+from pyconturb.core import SpatialGrid
+from pyconturb.magnitudes import get_unique_points
+from pyconturb.sig_models import iec_sig
+from pyconturb.simulation import _cholesky_inplace, _apply_cor_mat
+from pyconturb.spectral_models import kaimal_spectrum
+from pyconturb._mem_plan import plan_chunks
+from pyconturb._utils import _spat_rownames
+
+
+_COH_FLOPS = 12  # per pair and frequency: two products and an exponential
+_FFT_FLOPS = 2.5  # real FFT of n points: 2.5 n log2(n)
+_OUT_ITEMSIZE = {'bts': 2, 'hawc2': 4}  # [B] per value of the turbulence files
+_BENCH_N_COH = 400  # points of the coherence benchmark
+_BENCH_N_CHOL = 1000  # points of the factorization and correlation benchmarks
+_BENCH_NF = 4  # frequencies of the benchmarks
+_BENCH_FFT_SIZE = 2**22  # values of the irfft benchmark
+
+
+def estimate_resources(spat_df, T=600, dt=1, con_tc=None, coh_model='iec', seed=None,
+                       sig_func=None, spec_func=None, dtype=np.float64, mem_budget=None,
+                       n_workers=1, shard=None, nf_chunk=None, write_freq_data=False,
+                       time_partials=False, partial_dtype=None, coh_cache=False,
+                       out_formats=None, benchmark=True, **kwargs):
+    """Memory, FLOPs, disk and runtime of a simulation with ``gen_turb``, without
+    simulating it.
+
+    The parameters are the ones of ``gen_turb``, except the constraints and outputs,
+    of which only the sizes matter. Points collocated with constraints are counted
+    twice, so the estimate is an upper bound.
+
+    Parameters
+    ----------
+    spat_df : pandas.DataFrame or pyconturb.SpatialGrid
+        Spatial information on the points to simulate, as given to ``gen_turb``.
+    con_tc : pyconturb.TimeConstraint or int, optional
+        Constraining data, or the number of constraint time series (taken as the u, v
+        and w components of ``con_tc / 3`` points). Default is None (no constraints).
+    seed : int or list of int, optional
+        Seed, or list of seeds of an ensemble. Only the number of seeds is used.
+    sig_func, spec_func : function, optional
+        Profile functions of ``gen_turb``, used to count the unique points of the
+        magnitudes and to know whether the magnitudes are computed chunk by chunk.
+        Default is the IEC sigma and the Kaimal spectrum.
+    coh_cache : bool, optional
+        Whether a coherence cache is used. Its disk tier holds the factors of all
+        frequencies at most (its own size limit aside).
+    out_formats : str or list of str, optional
+        Output files, among ``'npy'`` (``out`` a file name), ``'bts'`` and ``'hawc2'``
+        (sinks of ``pyconturb.io.sinks``). Default is None (boxes in memory).
+    benchmark : bool, optional
+        Whether to measure the rates of the kernels and project the runtime (about a
+        second). Default is True.
+    **kwargs
+        Keyword arguments of the models, accepted so the keyword arguments of a call
+        to ``gen_turb`` can be passed as they are. Not used.
+
+    Returns
+    -------
+    est : dict
+        ``n_t``, ``n_f``, ``n_s`` (points with constraints) and ``n_sp`` (output
+        points), ``plan`` (see ``plan_chunks``), and dicts of the estimated ``mem``
+        [B] (peak of the ``correlation`` and ``final`` stages, and overall ``peak``),
+        ``flops`` (``coherence``, ``factorization``, ``correlation`` and ``irfft``, all
+        shards), ``disk`` [B] (``store``, ``partials``, ``coh_cache``, ``output`` and
+        ``total``), ``rates`` [FLOP/s] and ``runtime`` [s] of this call (per stage and
+        ``total``). ``rates`` and ``runtime`` are None without `benchmark`.
+    """
+    dtype = np.dtype(dtype)
+    itemsize = dtype.itemsize
+    c_itemsize = np.result_type(dtype, np.complex64).itemsize
+    spec_func = kaimal_spectrum if spec_func is None else spec_func
+    sig_func = iec_sig if sig_func is None else sig_func
+    if isinstance(out_formats, str):
+        out_formats = [out_formats]
+    out_formats = list(out_formats or [])
+    if any(fmt not in ['npy', *_OUT_ITEMSIZE] for fmt in out_formats):
+        raise ValueError(f'Unknown output format in {out_formats}!')
+    n_seeds = len(seed) if isinstance(seed, (list, tuple, np.ndarray)) else 1
+    n_shards = shard[1] if shard is not None else 1
+    # points: constraints first, as in gen_turb
+    if isinstance(spat_df, SpatialGrid):
+        spat_df = spat_df.to_df()
+    n_sp = spat_df.shape[1]
+    if con_tc is None:
+        con_k = np.zeros(0)
+    elif np.ndim(con_tc) == 0:  # number of constraint time series
+        con_k = np.arange(int(con_tc)) % 3
+    else:
+        con_k = con_tc.loc['k'].values.astype(float)
+    n_d = con_k.size
+    n_s = n_d + n_sp
+    k = np.concatenate((con_k, spat_df.loc['k'].values.astype(float)))
+    blocks = get_coh_blocks(pd.DataFrame([k], index=['k']), coh_model=coh_model)
+    cpl_blocks = [(idx.size, np.count_nonzero(idx < n_d))  # sizes of coupled blocks
+                  for (idx, cpl) in blocks if cpl]
+    n_mags = n_d + get_unique_points(spat_df, spec_func, sig_func)[0].shape[1]
+    # memory, from the chunk plan of gen_turb
+    n_t = int(np.ceil(T / dt))
+    n_f = n_t // 2 + 1
+    plan = plan_chunks(n_t, n_s, n_sp=n_sp, n_seeds=n_seeds, n_mags=n_mags,
+                       n_coh=max([n_b for (n_b, _) in cpl_blocks], default=1),
+                       dtype=dtype, mem_budget=mem_budget, n_workers=n_workers,
+                       n_shards=n_shards, nf_chunk=nf_chunk,
+                       spectrum_in_memory=not write_freq_data,
+                       mags_in_memory=not getattr(spec_func, 'freq_pointwise', False),
+                       output_in_memory=not out_formats, coh_cache=coh_cache)
+    pm = plan['mem']
+    mem = {'correlation': pm['spectrum'] + pm['magnitudes'] + pm['chunks'] + pm['pairs'],
+           'final': pm['spectrum'] + pm['output'] + pm['final']}
+    mem['peak'] = max(mem.values())
+    # operations, all frequencies (DC excluded) and all shards
+    n_cols = n_seeds * (n_shards * n_s if time_partials else n_sp)  # time series
+    flops = {stage: (n_f - 1) * sum(_freq_flops(n_b, n_db, n_seeds)[stage]
+                                    for (n_b, n_db) in cpl_blocks)
+             for stage in ['coherence', 'factorization', 'correlation']}
+    flops['irfft'] = n_cols * _irfft_flops(n_t)
+    # disk
+    n_c = n_seeds * n_s
+    p_itemsize = np.dtype(partial_dtype or dtype).itemsize
+    disk = {'store': write_freq_data * (n_f * n_c * c_itemsize + n_f),
+            'partials': time_partials * n_t * n_c * (n_shards * p_itemsize + itemsize),
+            'coh_cache': bool(coh_cache) * (n_f - 1) * sum(n_b**2 for (n_b, _)
+                                                           in cpl_blocks) * itemsize,
+            'output': sum(n_seeds * n_t * n_sp * _OUT_ITEMSIZE.get(fmt, itemsize)
+                          for fmt in out_formats)}
+    disk['total'] = sum(disk.values())
+    # runtime of this call: its shard of the frequencies and its time conversion
+    rates, runtime = None, None
+    if benchmark:
+        rates = benchmark_rates(n_t, n_coh=max([n_b for (n_b, _) in cpl_blocks],
+                                               default=2),
+                                n_seeds=n_seeds, nf_chunk=plan['nf_chunk'],
+                                pair_chunk=plan['pair_chunk'], coh_model=coh_model,
+                                dtype=dtype, n_workers=n_workers)
+        runtime = {stage: flops[stage] / rates[stage] / n_shards for stage in rates}
+        runtime['irfft'] = (n_cols / (n_shards if time_partials else 1)
+                            * _irfft_flops(n_t) / rates['irfft'])
+        runtime['total'] = sum(runtime.values())
+    return {'n_t': n_t, 'n_f': n_f, 'n_s': n_s, 'n_sp': n_sp, 'plan': plan, 'mem': mem,
+            'flops': flops, 'disk': disk, 'rates': rates, 'runtime': runtime}
+
+
+def benchmark_rates(n_t, n_coh=_BENCH_N_CHOL, n_seeds=1, nf_chunk=1, pair_chunk=10000,
+                    coh_model='iec', dtype=np.float64, n_workers=1):
+    """Rates [FLOP/s] of the coherence, factorization, correlation and irfft kernels of
+    ``gen_turb`` on this machine, measured on blocks of at most ``n_coh`` points (the
+    rates of larger blocks are usually higher, so the projected runtimes are
+    conservative) and on ``n_t`` time steps.
+
+    The pairs of points of the coherence matrices are set up once per chunk of
+    frequencies, so the coherence is timed on 1 and on several frequencies and its
+    rate is the one of chunks of ``nf_chunk`` frequencies."""
+    dtype = np.dtype(dtype)
+    dtype_complex = np.result_type(dtype, np.complex64)
+    rates = {}
+    # coherence of a block of points, time a + b * nf for nf frequencies
+    n_b = max(min(n_coh, _BENCH_N_COH), 2)
+    blk_df = _bench_block(n_b)
+    freq = np.arange(1, _BENCH_NF + 1) / 600
+    coh_kwargs = {'u_ref': 10, 'l_c': 340.2}
+    sec_1, sec_nf = [_time(lambda: get_coh_mat(freq[:nf], blk_df, coh_model=coh_model,
+                                               dtype=dtype, pair_chunk=pair_chunk,
+                                               **coh_kwargs))
+                     for nf in [1, _BENCH_NF]]
+    b = max(sec_nf - sec_1, 0) / (_BENCH_NF - 1)
+    rates['coherence'] = (nf_chunk * _freq_flops(n_b, 0, n_seeds)['coherence']
+                          / max(sec_1 - b + b * nf_chunk, 1e-9))
+    # factorization and correlation of a block
+    n_b = max(min(n_coh, _BENCH_N_CHOL), 2)
+    coh = np.moveaxis(get_coh_mat(freq, _bench_block(n_b), coh_model=coh_model,
+                                  dtype=dtype, **coh_kwargs), -1, 0).copy()
+    fac = coh.copy()
+    def factor():
+        np.copyto(fac, coh)
+        _cholesky_inplace(fac)
+    sec = _time(factor)
+    sec_copy = _time(lambda: np.copyto(fac, coh))
+    n_flops = _freq_flops(n_b, 0, n_seeds)
+    rates['factorization'] = (_BENCH_NF * n_flops['factorization']
+                              / max(sec - sec_copy, 1e-9))
+    mags = np.ones((_BENCH_NF, n_b), dtype=dtype)
+    pha = np.ones((_BENCH_NF, n_b, n_seeds), dtype=dtype_complex)
+    dat = np.ones((_BENCH_NF, 0), dtype=dtype_complex)
+    sec = _time(lambda: _apply_cor_mat(fac, mags, dat, pha, 0))
+    rates['correlation'] = _BENCH_NF * n_flops['correlation'] / sec
+    # inverse FFT of time series of the simulated length
+    n_cols = int(min(max(_BENCH_FFT_SIZE // n_t, 1), 64))
+    spec = np.ones((n_t // 2 + 1, n_cols), dtype=dtype_complex)
+    sec = _time(lambda: scipy.fft.irfft(spec, axis=0, n=n_t, workers=n_workers))
+    rates['irfft'] = n_cols * _irfft_flops(n_t) / sec
+    return rates
+
+
+def format_estimate(est):
+    """Summary of an estimate of ``estimate_resources``, one quantity per line"""
+    def size(n_bytes):
+        return f'{n_bytes / 2**30:.2f} GiB'
+    plan = est['plan']
+    lines = [f'Points: {est["n_sp"]} ({est["n_s"]} with constraints), '
+             + f'{est["n_t"]} time steps, {est["n_f"]} frequencies',
+             f'Chunks: nf_chunk={plan["nf_chunk"]}, pair_chunk={plan["pair_chunk"]}, '
+             + f'n_pts_chunk={plan["n_pts_chunk"]}',
+             'Memory: ' + ', '.join(f'{stage} {size(n_bytes)}' for (stage, n_bytes)
+                                    in est['mem'].items()),
+             'FLOPs:  ' + ', '.join(f'{stage} {n:.2e}' for (stage, n)
+                                    in est['flops'].items()),
+             'Disk:   ' + ', '.join(f'{kind} {size(n_bytes)}' for (kind, n_bytes)
+                                    in est['disk'].items())]
+    if est['runtime'] is not None:
+        lines += ['Rates:  ' + ', '.join(f'{stage} {rate / 1e9:.2f} GFLOP/s'
+                                         for (stage, rate) in est['rates'].items()),
+                  'Time:   ' + ', '.join(f'{stage} {sec:.1f} s' for (stage, sec)
+                                         in est['runtime'].items())]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Command-line interface, see ``python -m pyconturb.resources --help``"""
+    parser = argparse.ArgumentParser(
+        prog='python -m pyconturb.resources',
+        description='Estimate the memory, FLOPs, disk and runtime of gen_turb on a '
+                    + 'regular y-z grid, without simulating.')
+    parser.add_argument('--y', nargs=3, type=float, required=True,
+                        metavar=('YMIN', 'YMAX', 'NY'), help='lateral grid [m]')
+    parser.add_argument('--z', nargs=3, type=float, required=True,
+                        metavar=('ZMIN', 'ZMAX', 'NZ'), help='vertical grid [m]')
+    parser.add_argument('--T', type=float, default=600, help='duration [s]')
+    parser.add_argument('--dt', type=float, default=1, help='time step [s]')
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64')
+    parser.add_argument('--coh-model', choices=['iec', '3d'], default='iec')
+    parser.add_argument('--n-con', type=int, default=0,
+                        help='number of constraint time series')
+    parser.add_argument('--n-seeds', type=int, default=1)
+    parser.add_argument('--mem-budget', type=float, help='memory budget [GiB]')
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--shards', type=int, default=1, help='number of shards')
+    parser.add_argument('--write-freq-data', action='store_true')
+    parser.add_argument('--time-partials', action='store_true')
+    parser.add_argument('--coh-cache', action='store_true')
+    parser.add_argument('--out', nargs='*', default=[], choices=['npy', 'bts', 'hawc2'],
+                        help='output files (default: boxes in memory)')
+    parser.add_argument('--no-benchmark', action='store_true',
+                        help='skip the benchmark and the runtime projection')
+    args = parser.parse_args(argv)
+    (ymin, ymax, ny), (zmin, zmax, nz) = args.y, args.z
+    grid = SpatialGrid(np.linspace(ymin, ymax, int(ny)), np.linspace(zmin, zmax, int(nz)))
+    est = estimate_resources(
+        grid, T=args.T, dt=args.dt, con_tc=args.n_con or None, coh_model=args.coh_model,
+        seed=list(range(args.n_seeds)) if args.n_seeds > 1 else None,
+        dtype=np.dtype(args.dtype),
+        mem_budget=None if args.mem_budget is None else int(args.mem_budget * 2**30),
+        n_workers=args.n_workers, shard=(0, args.shards) if args.shards > 1 else None,
+        write_freq_data=args.write_freq_data, time_partials=args.time_partials,
+        coh_cache=args.coh_cache, out_formats=args.out, benchmark=not args.no_benchmark)
+    print(format_estimate(est))
+    return est
+
+
+def _freq_flops(n_b, n_db, n_seeds):
+    """FLOPs per frequency of a coupled block of n_b points (n_db constraints)"""
+    return {'coherence': _COH_FLOPS * n_b * (n_b - 1) // 2,
+            'factorization': n_b**3 / 3,
+            'correlation': 4 * n_b**2 * n_seeds + 4 * n_db**2}
+
+
+def _irfft_flops(n_t):
+    """FLOPs of the inverse FFT of a time series of n_t steps"""
+    return _FFT_FLOPS * n_t * np.log2(max(n_t, 2))
+
+
+def _bench_block(n_b):
+    """spat_df of n_b u components on a square grid of 10 m spacing"""
+    n_side = int(np.ceil(np.sqrt(n_b)))
+    yz = np.array(np.meshgrid(np.arange(n_side), np.arange(n_side))).reshape(2, -1)
+    return pd.DataFrame(np.vstack((np.zeros((2, n_b)), 10. * yz[:, :n_b])),
+                        index=_spat_rownames)
+
+
+def _time(func, n_rep=3):
+    """Median of n_rep timings of func() [s]"""
+    times = []
+    for _ in range(n_rep):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return max(float(np.median(times)), 1e-9)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,9 @@ def get_sig_values(spat_df, sig_func, **kwargs):
 
     where k, y and z can be floats, np.arrays or pandas.Series. You can use
     the functions built into PyConTurb (see below) or define your own custom
-    function. The output is assumed to be in m/s.
+    function. The output is assumed to be in m/s. A function that only depends on
+    some of the coordinates can declare them, e.g. ``sig_func.spatial_coords = ('k',
+    'z')``, and is then only evaluated on the unique values of those coordinates.
 
     Parameters
     ----------
@@ -84,6 +86,9 @@ def data_sig(k, y, z, con_tc=None, **kwargs):
     return out_array
 
 
+data_sig.spatial_coords = ('k', 'y', 'z')
+
+
 def iec_sig(k, y, z, turb_class=_DEF_KWARGS['turb_class'], **kwargs):
     """Turbulence standard deviation as specified in IEC 61400-1 Ed. 3.
 
@@ -114,3 +119,6 @@ def iec_sig(k, y, z, turb_class=_DEF_KWARGS['turb_class'], **kwargs):
     sig1 = i_ref * (0.75 * kwargs['u_ref'] + 5.6)  # std dev in u
     sig_k = sig1 * np.asarray(1.0 * (k == 0) + 0.8 * (k == 1) + 0.5 * (k == 2))
     return np.array(sig_k, dtype=float)
+
+
+iec_sig.spatial_coords = ('k',)  # constant per component
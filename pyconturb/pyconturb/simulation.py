@@ -9,36 +9,58 @@ import warnings
 
 import numpy as np
 import pandas as pd
-import scipy
+import scipy.fft
+import scipy.linalg
 
-from pyconturb.coherence import get_coh_mat
-from pyconturb.core import TimeConstraint
-from pyconturb.magnitudes import get_magnitudes
+from pyconturb.coherence import get_coh_mat, get_coh_blocks
+from pyconturb._coh_cache import CohCache, coh_geom_key, coh_key_freq
+from pyconturb._mem_plan import plan_chunks, format_plan
+from pyconturb._progress import Progress
+from pyconturb.core import TimeConstraint, SpatialGrid
+from pyconturb.magnitudes import (get_magnitudes, get_mag_scaling, get_unique_points,
+                                  get_chunk_magnitudes)
 from pyconturb.sig_models import iec_sig, data_sig
 from pyconturb.spectral_models import kaimal_spectrum, data_spectrum
 from pyconturb.wind_profiles import get_wsp_values, power_profile, data_profile
 from pyconturb._utils import (combine_spat_con, _spat_rownames, _DEF_KWARGS,
-                              clean_turb, check_sims_collocated)
+                              check_sims_collocated, _row_ids, _first_rows,
+                              _match_points)
+from pyconturb._freq_store import (FreqStore, partial_filename, save_time_partial,
+                                   acquire_combine_lock, release_combine_lock,
+                                   combine_store, combine_time_partials,
+                                   delete_combine_files, hash_inputs, manifest_filename,
+                                   open_manifest)
 
 from pyconturb.tictoc import Timer
 import os
 import pickle
-from retrying import retry
-import glob
-import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from multiprocessing import shared_memory
+try:  # optional, used to limit the number of BLAS threads of each worker
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+
 
 def gen_turb(spat_df, T=600, dt=1, con_tc=None, coh_model='iec',
              wsp_func=None, veer_func=None, sig_func=None, spec_func=None,
-             interp_data='none', seed=None, nf_chunk=1, verbose=False, dtype=np.float64, 
-             write_freq_data=False, combine_freq_data=False, preffix='', **kwargs):
+             interp_data='none', seed=None, nf_chunk=None, verbose=False, dtype=np.float64, 
+             write_freq_data=False, combine_freq_data=False, preffix='', n_workers=1,
+             backend='threads', shard=None, time_partials=False, partial_dtype=None,
+             coh_cache=None, out=None, mem_budget=None, **kwargs):
     """Generate a turbulence box (constrained or unconstrained).
 
     Parameters
     ----------
-    spat_df : pandas.DataFrame
+    spat_df : pandas.DataFrame or pyconturb.SpatialGrid
         Spatial information on the points to simulate. Must have rows `[k, x, y, z]`,
         and each of the `n_sp` columns corresponds to a different spatial location and
-        turbine component (u, v or w).
+        turbine component (u, v or w). A SpatialGrid for the points of a y-z grid.
     T : float, optional
         Total length of time to simulate in seconds. Default is 600.
     dt : float, optional
@@ -56,7 +78,10 @@ def gen_turb(spat_df, T=600, dt=1, con_tc=None, coh_model='iec',
         See details in `Turbulence standard deviation` section.
     spec_func : function, optional
         Function to specify spatial variation of turbulence power spectrum. See
-        details in `Turbulence spectra` section.
+        details in `Turbulence spectra` section. If the function evaluates each
+        frequency independently of the others in ``f`` (as the built-in spectra do),
+        set its ``freq_pointwise`` attribute to True: the magnitudes are then
+        computed per frequency chunk instead of for all frequencies at once.
     interp_data : str, optional
         Interpolate mean wind speed, standard deviation, and/or power spectra profile
         functions from provided constraint data. Possible options are ``'none'`` (use
@@ -64,46 +89,203 @@ def gen_turb(spat_df, T=600, dt=1, con_tc=None, coh_model='iec',
         functions), or a list containing and combination of ``'wsp'``, ``'sig'`` and
         ``'spec'`` (interpolate the wind speed, standard deviation and/or power spectra).
         Default is IEC 61400-1 profiles (i.e., no interpolation).
-    seed : int, optional
+    seed : int or list of int, optional
         Optional random seed for turbulence generation. Use the same seed and
-        settings to regenerate the same turbulence box.
+        settings to regenerate the same turbulence box. The random phases of each
+        frequency are drawn from a counter-based generator keyed by the seed and the
+        frequency index, so any subset of frequencies can be generated on its own.
+        With a list of seeds, an ensemble of boxes (one per seed) is generated: the
+        coherence and Cholesky factor of each frequency are computed once and applied
+        to the phases of all seeds in one matrix-matrix product. Each box is the same
+        (to round-off) as the box generated with that seed alone.
+    shard : tuple, optional
+        Tuple ``(i_shard, n_shards)`` to only process shard ``i_shard`` out of
+        ``n_shards`` of the frequencies: frequency index ``i_f`` (DC excluded, i.e.,
+        ``i_f >= 1``) belongs to shard ``(i_f - 1) % n_shards``, whatever the chunk
+        sizes of the calls. Should be used with `write_freq_data` or `time_partials`
+        is True. Because the phases only depend on the seed and frequency index,
+        ``n_shards`` calls with the same seed (e.g., on different nodes) give exactly
+        the same turbulence as a single call without duplicated work. Default is None
+        (all frequencies).
+    time_partials : logical, optional
+        Instead of the frequency-domain store of `write_freq_data`, save the
+        time-domain contribution of this call's frequencies (its `shard`) to the file
+        preffix+'pyConTurb_part{i_shard}of{n_shards}.npy'. The inverse FFT is linear,
+        so the turbulence box is the sum of the partials of all shards, and no process
+        needs to hold the full spectrum. With `combine_freq_data` is True, the call
+        waits for the partials of all shards, sums them point chunk by point chunk and
+        returns `turb_df`. The progress is reported as with `write_freq_data`.
+        Default is False.
+    partial_dtype : data type, optional
+        Data type of the time-domain partials (e.g., np.float32 to halve the disk
+        usage). Default is `dtype`.
+    coh_cache : CohCache or str, optional
+        Cache of the Cholesky factors of the coherence matrices (see
+        ``pyconturb.CohCache``), or the directory of an on-disk cache. The factors only
+        depend on the grid geometry and coherence parameters, so simulations on the
+        same grid (other seeds, spectra or constraints) reuse them and only apply the
+        magnitude scaling, ``chol(D C D) = D chol(C)``. The factors of the built-in
+        coherence models are indexed by reduced frequency ``f / u_ref``, so they are
+        also reused across mean wind speeds. The fraction of reused factors is
+        printed if `verbose` is True (see ``CohCache.reuse_ratio``).
+        Default is None (no cache).
+    out : str, np.ndarray, sink or list, optional
+        Target of the ``(n_t, n_sp)`` time series, in the column order of
+        ``spat_df``: the name of a .npy file (written as a memory map), an array of
+        that shape and `dtype` or a sink writing turbulence files (e.g., ``BtsSink``
+        or ``Hawc2Sink`` of ``pyconturb.io.sinks``, made with ``spat_df``). With a
+        list of seeds, a list with one target per seed. The spectrum is converted to
+        the time domain point chunk by point chunk and each chunk is written straight
+        to the target, so with a file the box never needs to fit in memory. The
+        returned data frames wrap the targets; a sink is returned instead of a data
+        frame. Default is None (new arrays in memory).
+    mem_budget : int, optional
+        Approximate memory (bytes) the simulation may use, arrays held in memory
+        (spectrum, magnitudes, output) included. The frequency chunks (unless
+        ``nf_chunk`` is given), the pairs of points of the coherence computations and
+        the point chunks converted to the time domain are sized to fill it; with
+        ``verbose`` the chosen sizes are printed (see ``plan_chunks`` in
+        ``pyconturb._mem_plan``). Default is None: 10000 coherence pairs at a time and
+        256 MiB for the time conversion besides the spectrum and output.
     nf_chunk : int, optional
-        Number of frequencies in a chunk of analysis. Increasing this number may speed
-        up computation but may result in more (or too much) memory used. Smaller grids
-        may benefit from larger values for ``nf_chunk``. Default is 1.
+        Number of frequencies in a chunk of analysis. The coherence matrices,
+        Cholesky decompositions and correlations of all frequencies in a chunk are
+        computed in single stacked calls. Increasing this number may speed up
+        computation but may result in more (or too much) memory used. Smaller grids
+        (or long time series) may benefit from larger values for ``nf_chunk``.
+        Default is None: sized from ``mem_budget`` if given, else 1.
     write_freq_data : logical, optional
-        The data for each frequency is saved to a file, unless the file already exist, 
-        in which case the frequency is skipped. This parameter is useful for parallel 
-        processing, in conjunction with `combine_freq_data` and `preffix`. 
-        The frequencies are processed in random order. This way, two identical calls to
-        `gen_turb` can be run simulatenously, making it unlikely that two frequencies will
-        be processed at the same time.
-        Default is False.
-    combine_freq_data : logical, optional
-        When True, attempt to read all the files generated (by `write_freq_data`=True),
-        combine the data, and return the turbulence data frame `turb_df`. When parallel
-        calls are used, only one processor should be responsible to combine the files.
-        Should be used with write_freq_data is True.
+        The data for each frequency is written to a single preallocated on-disk store
+        (an ``(n_f, n_s)`` .npy file plus a completion bitmap), unless the store flags
+        the frequency as done, in which case the frequency is skipped. This parameter
+        is useful for parallel processing, in conjunction with `combine_freq_data` and
+        `preffix`. Use `shard` to split the frequencies between parallel calls. Without
+        `shard`, the frequencies are processed in random order, making it unlikely that
+        two identical calls to `gen_turb` run simultaneously process the same
+        frequency at the same time. A checkpoint manifest (preffix+
+        'pyConTurb_manifest.json') with a hash of the inputs is written first, so a
+        rerun with the same arguments (e.g., after the job was killed) continues where
+        it stopped, while a call with different inputs raises a ValueError instead of
+        mixing the results. With `seed`=None, the phases of the manifest are reused.
+        The progress of the calls of a case (frequencies done, rolling time per
+        frequency, ETA) is kept in preffix+'pyConTurb_status.json', summarized by
+        ``python -m pyconturb.status``, and printed every 30 s instead of the timings
+        of every chunk (still printed if `verbose`). Default is False.
+    combine_freq_data : logical or 'auto', optional
+        When True, wait until all frequencies of the store (written by
+        `write_freq_data`=True) are done, open it as a memmap and return the
+        turbulence data frame `turb_df`. The store is polled and the inverse transform
+        starts as soon as the last frequency is flagged as done; the progress is kept
+        in preffix+'pyConTurb_combine.json'. When parallel calls are used, only one
+        processor should be responsible to combine the files. With 'auto', the calls
+        elect the combining one themselves through a lock file
+        (preffix+'pyConTurb_combine.lock'): the first call to finish its own work
+        combines, the other ones return None. The combiner deletes the files of the
+        case before releasing the lock, and a call electing itself after that returns
+        None as well (also with True). Should be used with write_freq_data or
+        time_partials is True.
         Default is False.
     preffix : string, optional
         preffix used for the file generation. Only applies when `write_freq_data` is True.
-        Filenames are generated as: preffix+'pyConTurb'+str(i_f)+'.pkl'
-        Default is ''.
+        Filenames are generated as: preffix+'pyConTurb_fft.npy',
+        preffix+'pyConTurb_done.npy', preffix+'pyConTurb_manifest.json' and
+        preffix+'pyConTurb_status.json'. Default is ''.
+    n_workers : int, optional
+        Number of workers used to process the frequency chunks in parallel (see
+        ``backend``). The frequencies are independent and the linear algebra releases
+        the GIL, so threads use the cores of a single machine without extra
+        processes. If `threadpoolctl` is installed, the BLAS threads are limited so
+        that the total does not exceed the number of cores. The inverse FFTs of the
+        final stage also use ``n_workers`` threads. Default is 1 (serial).
+    backend : str, optional
+        How the ``n_workers`` workers are run. ``'threads'`` uses a thread pool in the
+        current process. ``'processes'`` uses a process pool whose workers attach to
+        shared-memory copies of the magnitudes, spatial coordinates, phases and
+        constraint FFT, and write their rows of the spectrum in place in a
+        shared-memory array. The random phases only depend on the seed and frequency
+        index, so both backends give the same result for a given ``seed``. Default is
+        ``'threads'``.
     verbose : bool, optional
         Print extra information during turbulence generation. Default is False.
     dtype : data type, optional
-        Change precision of calculation (np.float32 or np.float64). Will reduce the 
-        storage, and might slightly reduce the computational time. Default is np.float64
+        Change precision of calculation (np.float32 or np.float64). With np.float32,
+        the constraint FFT, magnitudes, phases, coherence matrices, spectrum and
+        inverse FFT are all single precision (complex64), which halves the memory and
+        storage. The phases are drawn from the same random numbers, so the box is the
+        double-precision box up to round-off (~1e-5 of the std dev on the A1/A2/B1
+        cases, see 05_CheckFloat32.py). Default is np.float64
     **kwargs
         Optional keyword arguments to be fed into the
         spectral/turbulence/profile/etc. models.
 
     Returns
     -------
-    turb_df : pandas.DataFrame
+    turb_df : pandas.DataFrame or list of pandas.DataFrame
         Generated turbulence box. Each row corresponds to a time step and each
-        column corresponds to a point/component in ``spat_df``.
+        column corresponds to a point/component in ``spat_df``. A list with one box
+        per seed if `seed` is a list. The sink (closed) if `out` is a sink.
+
+    See Also
+    --------
+    gen_turb_arr : same simulation on coordinate arrays, returning arrays.
+    """
+    is_grid = isinstance(spat_df, SpatialGrid)
+    k, x, y, z = spat_df.values if is_grid else spat_df.loc[_spat_rownames].values
+    turb = gen_turb_arr(k, y, z, x=x, T=T, dt=dt, con_tc=con_tc, coh_model=coh_model,
+                        wsp_func=wsp_func, veer_func=veer_func, sig_func=sig_func,
+                        spec_func=spec_func, interp_data=interp_data, seed=seed,
+                        nf_chunk=nf_chunk, verbose=verbose, dtype=dtype,
+                        write_freq_data=write_freq_data,
+                        combine_freq_data=combine_freq_data, preffix=preffix,
+                        n_workers=n_workers, backend=backend, shard=shard,
+                        time_partials=time_partials, partial_dtype=partial_dtype,
+                        coh_cache=coh_cache, out=out, mem_budget=mem_budget, **kwargs)
+    if turb is None:  # nothing to simulate, or not the combining call
+        return None
+    # name the time series as clean_turb and wrap them, without copies
+    col_names = spat_df.columns if is_grid else _turb_columns(spat_df)
+    def to_df(arr):
+        if _is_sink(arr):
+            return arr
+        return pd.DataFrame(arr, index=np.arange(arr.shape[0]) * dt, columns=col_names,
+                            copy=False)
+    return [to_df(arr) for arr in turb] if isinstance(turb, list) else to_df(turb)
+
+
+def gen_turb_arr(k, y, z, x=0, T=600, dt=1, con_tc=None, coh_model='iec',
+                 wsp_func=None, veer_func=None, sig_func=None, spec_func=None,
+                 interp_data='none', seed=None, nf_chunk=None, verbose=False, dtype=np.float64, 
+                 write_freq_data=False, combine_freq_data=False, preffix='', n_workers=1,
+                 backend='threads', shard=None, time_partials=False, partial_dtype=None,
+                 coh_cache=None, out=None, mem_budget=None, **kwargs):
+    """Generate a turbulence box on coordinate arrays, without data frames.
+
+    Core of ``gen_turb``, which is a wrapper adding the column names and time index.
+    The points are given as arrays (broadcast together) instead of ``spat_df``; the
+    other parameters are the ones of ``gen_turb``.
+
+    Parameters
+    ----------
+    k : array-like
+        Turbulence component of each point (0=u, 1=v, 2=w), ``(n_sp,)``.
+    y : array-like
+        [m] Lateral coordinate of each point.
+    z : array-like
+        [m] Vertical coordinate of each point.
+    x : array-like, optional
+        [m] Longitudinal coordinate of each point. Default is 0.
+
+    Returns
+    -------
+    turb : np.ndarray or list of np.ndarray
+        Generated turbulence box ``(n_t, n_sp)``, in the order of the points, as an
+        array, the memory map of `out` if it is a file name, or the sink if `out` is
+        a sink. A list with one box per seed if `seed` is a list. None if nothing
+        is simulated (all points collocated with constraints, or not the combining
+        call).
     """
+    spat_df = pd.DataFrame(np.array(np.broadcast_arrays(k, x, y, z), dtype=float),
+                           index=_spat_rownames)  # columns labelled 0, ..., n_sp - 1
     if verbose:
         print('Beginning turbulence simulation...')
     # if con_data passed in, throw deprecation warning
@@ -121,7 +303,8 @@ def gen_turb(spat_df, T=600, dt=1, con_tc=None, coh_model='iec',
         print('All simulation points collocated with constraints! '
               + 'Nothing to simulate.')
         return None
-    dtype_complex=np.complex64 if dtype==np.float32 else np.complex128
+    dtype = np.dtype(dtype)
+    dtype_complex = np.result_type(dtype, np.complex64)  # complex64 for float32
 
     # add T, dt, con_tc to kwargs
     kwargs = {**_DEF_KWARGS, **kwargs, 'T': T, 'dt': dt, 'con_tc': con_tc}
@@ -151,156 +334,677 @@ def gen_turb(spat_df, T=600, dt=1, con_tc=None, coh_model='iec',
     n_f = n_t // 2 + 1  # no. freqs
     freq = np.arange(n_f) / kwargs['T']  # frequency array
 
-    # get magnitudes of points to simulate. (nf, nsim). con_tc in kwargs.
-    sim_mags = get_magnitudes(all_spat_df.iloc[:, n_d:], spec_func, sig_func, **kwargs)
-
     if constrained:
-        conturb_fft = np.fft.rfft(con_tc.get_time().values, axis=0) / n_t  # constr fft
-        con_mags = np.abs(conturb_fft)  # mags of constraints
-        all_mags = np.concatenate((con_mags, sim_mags), axis=1)  # con and sim
+        # constr fft, in the precision of the simulation (scipy keeps single precision)
+        conturb_fft = scipy.fft.rfft(con_tc.get_time().values.astype(dtype, copy=False),
+                                     axis=0) / n_t
     else:
-        all_mags = sim_mags  # just sim
-    all_mags=all_mags.astype(dtype, copy=False)
+        conturb_fft = np.empty((n_f, 0), dtype=dtype_complex)  # no constraints
+
+    # get magnitudes of constraints and points to simulate. (nf, n_s). con_tc in kwargs.
+    # If the spectrum is evaluated frequency by frequency (spec_func.freq_pointwise),
+    # only the scaling to the correct ti (nsim,) is computed here, in a streaming pass
+    # over the frequencies, and the magnitudes are computed per chunk. The spectrum and
+    # sigma are only evaluated on the unique simulation points (e.g., unique (k, z) for
+    # Kaimal and IEC sigma), the magnitudes of point i being in column mag_idx[i]
+    uniq_spat_df, uniq_idx = get_unique_points(all_spat_df.iloc[:, n_d:], spec_func,
+                                               sig_func)
+    mag_idx = np.concatenate((np.arange(n_d), n_d + uniq_idx))
+    all_mags, mag_scale = None, None
+    if getattr(spec_func, 'freq_pointwise', False):
+        mag_scale = get_mag_scaling(uniq_spat_df, spec_func, sig_func, **kwargs)
+    else:
+        sim_mags = get_magnitudes(uniq_spat_df, spec_func, sig_func, **kwargs)
+        all_mags = np.concatenate((np.abs(conturb_fft), sim_mags), axis=1,
+                                  dtype=dtype)  # con and sim
+        del sim_mags
 
     # get uncorrelated phasors for simulation
-    np.random.seed(seed=seed)  # initialize random number generator
-    sim_unc_pha = np.exp(1j * 2*np.pi * np.random.rand(n_f, n_s - n_d))
-    if not (n_t % 2):  # if even time steps, last phase must be 0 or pi for real sig
-        sim_unc_pha[-1, :] = np.exp(1j * np.round(np.real(sim_unc_pha[-1, :])) * np.pi)
+    ensemble = isinstance(seed, (list, tuple, np.ndarray))  # one box per seed
+    seeds = list(seed) if ensemble else [seed]
+    n_seeds = len(seeds)
+    if not n_seeds:
+        raise ValueError('At least one seed must be given!')
+    outs = list(out) if (ensemble and out is not None) else [out] * n_seeds
+    if len(outs) != n_seeds:
+        raise ValueError('With a list of seeds, out must be a list of the same length!')
+    # keys of the counter-based generator, (n_seeds, 2)
+    pha_keys = np.array([get_phase_key(sd) for sd in seeds])
+    if write_freq_data or time_partials:  # checkpoint, never mix results of other inputs
+        input_hash = hash_inputs(spat_df, coh_model, wsp_func, veer_func, sig_func,
+                                 spec_func, seed, dtype, partial_dtype, kwargs)
+        pha_keys = open_manifest(preffix, input_hash, pha_keys, seed=seed)
+    n_c = n_seeds * n_s  # no. of Fourier columns, seed-major (all points of 1st seed...)
+
+    # chunk sizes from the memory budget (the largest coupled coherence block)
+    blocks = get_coh_blocks(all_spat_df, coh_model=coh_model)
+    i_shard, n_shards = shard if shard is not None else (0, 1)
+    plan = plan_chunks(n_t, n_s, n_sp=spat_df.shape[1], n_seeds=n_seeds,
+                       n_mags=mag_idx.max(initial=-1) + 1,
+                       n_coh=max([idx.size for (idx, cpl) in blocks if cpl], default=1),
+                       dtype=dtype, mem_budget=mem_budget, n_workers=n_workers,
+                       n_shards=n_shards, nf_chunk=nf_chunk,
+                       spectrum_in_memory=not write_freq_data,
+                       mags_in_memory=all_mags is not None,
+                       output_in_memory=any((o is None) or isinstance(o, np.ndarray)
+                                            for o in outs),
+                       coh_cache=coh_cache is not None)
+    nf_chunk = plan['nf_chunk']
+    if verbose:
+        print('Chunks: ' + format_plan(plan))
+
+    # split the frequencies (DC excluded) into chunks
+    freq_idx = np.arange(1, freq.size)
+    if shard is not None:  # only this shard's frequencies, whatever the chunk size
+        if not 0 <= i_shard < n_shards:
+            raise ValueError(f'Bad shard {shard}, must have 0 <= i_shard < n_shards!')
+        freq_idx = freq_idx[i_shard::n_shards]
+    freq_chunks = [freq_idx[i:i + nf_chunk] for i in range(0, freq_idx.size, nf_chunk)]
+    if write_freq_data and shard is None:  # random order so parallel calls will likely not conflict
+        freq_chunks = [freq_chunks[i]
+                       for i in np.random.default_rng().permutation(len(freq_chunks))]
+    n_chunks = len(freq_chunks)
+    shard_fs = np.sort(np.concatenate(freq_chunks)) if n_chunks else freq_idx[:0]
+
+    # on-disk store for the frequency data or time-domain partial
+    if write_freq_data and time_partials:
+        raise ValueError('Only one of write_freq_data and time_partials may be True!')
+    store = FreqStore(preffix, n_f, n_c, dtype_complex) if write_freq_data else None
+    rows = None  # row in turb_fft of each frequency (if not all frequencies stored)
+    if time_partials:
+        part_path = partial_filename(preffix, i_shard, n_shards)
+        if os.path.exists(part_path):  # shard already done, nothing to simulate
+            print('>>> Partial exists, skipping ', part_path)
+            freq_chunks, n_chunks = [], 0
+        rows = np.zeros(n_f, dtype=int)
+        rows[shard_fs] = np.arange(shard_fs.size)
+    # progress of the parallel calls in the status file of the case
+    progress = None
+    if write_freq_data or time_partials:
+        progress = Progress(preffix, shard=shard)
+        progress.start('frequencies', sum(i_fs.size for i_fs in freq_chunks))
 
     # no coherence if one point
     if one_point:
-        turb_fft = all_mags * sim_unc_pha
+        if all_mags is None:
+            all_mags = _get_chunk_mags(np.arange(n_f), uniq_spat_df, spec_func,
+                                       mag_scale, conturb_fft, dtype, **kwargs)
+        all_mags = all_mags[:, mag_idx]
+        turb_fft = np.hstack([all_mags * get_unc_phases(np.arange(n_f), n_s, n_t, key,
+                                                        dtype=dtype_complex)
+                              for key in pha_keys])
+        if write_freq_data:
+            store.write(np.arange(1, n_f), turb_fft[1:])
+        if time_partials:
+            turb_fft = turb_fft[shard_fs]
+        if progress is not None:
+            progress.add(shard_fs.size)
 
     # if more than one point, correlate everything
     else:
 
-        if not write_freq_data: # then we need to store
-            turb_fft = np.zeros((n_f, n_s), dtype=dtype_complex)
-        n_chunks = int(np.ceil(freq.size / nf_chunk))
-
-        # Shuffle the freuqencies so that parallel processing will likely not conflict
-        freq_idx = np.arange(1, freq.size)
-        random.shuffle(freq_idx)
-        # loop through frequencies
-        for iif,i_f in enumerate(freq_idx):
-            sLbl='{:5d}/{} - '.format(i_f,len(freq_idx))
-            with Timer(sLbl+'Freq_loop:'):
-                filename = freq_data_filename(preffix, i_f)
-                if write_freq_data and os.path.exists(filename):
-                    print('>>> File exists, skipping ', filename)
-                    continue
+        if time_partials:  # only this shard's frequencies
+            turb_fft = np.zeros((shard_fs.size, n_c), dtype=dtype_complex)
+        elif not write_freq_data: # then we need to store
+            turb_fft = np.zeros((n_f, n_c), dtype=dtype_complex)
 
-                i_chunk = i_f // nf_chunk  # calculate chunk number
-                if (i_f - 1) % nf_chunk == 0:  # genr cohrnc chunk when needed
-                    if verbose:
-                        print(f'  Processing chunk {i_chunk + 1} / {n_chunks}')
-                    with  Timer(sLbl+'Coherence'):
-                        all_coh_mat = get_coh_mat(freq[i_chunk * nf_chunk:
-                                                       (i_chunk + 1) * nf_chunk],
-                                                  all_spat_df, coh_model=coh_model,
-                                                  dtype=dtype,
-                                                  **kwargs)
-
-                with  Timer(sLbl+'Sigma:'):
-                    # assemble "sigma" matrix, which is coh matrix times mag arrays
-                    sigma = np.einsum('i,j->ij', all_mags[i_f, :],
-                                      all_mags[i_f, :]) * all_coh_mat[:, :, i_f % nf_chunk]
-
-                with  Timer(sLbl+'Cholesky:'):
-                    # get cholesky decomposition of sigma matrix
-                    cor_mat = scipy.linalg.cholesky(sigma,overwrite_a=True, check_finite=False, lower=True)
-
-                # if constraints, assign data unc_pha
-                if constrained:
-                    with  Timer(sLbl+'Solve:'):
-                        dat_unc_pha = np.linalg.solve(cor_mat[:n_d, :n_d], conturb_fft[i_f, :])
-                else:
-                    dat_unc_pha = []
-                with  Timer(sLbl+'Rest:'):
-                    unc_pha = np.concatenate((dat_unc_pha, sim_unc_pha[i_f, :]))
-                    cor_pha = cor_mat @ unc_pha
-
-                    # calculate and save correlated Fourier components
-                    if write_freq_data:
-                        save_freq_data(cor_pha, filename)
-                    else:
-                        turb_fft[i_f, :] = cor_pha
-
-        try:
-            del all_mags
-            del all_coh_mat  # free up memory
-            del sigma
-            del cor_pha
-            del unc_pha
-        except:
-            pass
-
-    if write_freq_data and not combine_freq_data:
-        return None
+        if isinstance(coh_cache, str):  # directory of an on-disk cache
+            coh_cache = CohCache(coh_cache)
+
+        # if the spectrum function can't be sent to worker processes (e.g., a lambda),
+        # the magnitudes are computed here and shared
+        if (all_mags is None and n_workers > 1 and backend == 'processes'
+                and not _is_picklable(spec_func)):
+            all_mags = _get_chunk_mags(np.arange(n_f), uniq_spat_df, spec_func,
+                                       mag_scale, conturb_fft, dtype, **kwargs)
+            spec_func = None
+
+        # everything needed to process a chunk
+        sim = {'freq': freq, 'all_spat_df': all_spat_df, 'blocks': blocks,
+               'all_mags': all_mags, 'spec_func': spec_func, 'mag_scale': mag_scale,
+               'uniq_spat_df': uniq_spat_df, 'mag_idx': mag_idx,
+               'conturb_fft': conturb_fft,
+               'pha_keys': pha_keys, 'n_t': n_t, 'n_d': n_d, 'coh_model': coh_model,
+               'dtype': dtype, 'kwargs': kwargs, 'n_chunks': n_chunks,
+               'store': store, 'verbose': verbose, 'rows': rows, 'coh_cache': coh_cache,
+               'pair_chunk': plan['pair_chunk'],
+               'chunk_log': verbose or progress is None,  # else progress lines only
+               'turb_fft': None if write_freq_data else turb_fft}
+
+        # loop through frequency chunks, the progress recorded as they complete
+        record = (lambda res: None) if progress is None else (
+            lambda res: progress.add(*res))
+        if n_workers == 1:
+            for i_chunk, i_fs in enumerate(freq_chunks):
+                record(_process_chunk(i_chunk, i_fs, sim))
+        elif backend == 'threads':
+            with _limit_blas_threads(n_workers):
+                with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                    for res in pool.map(_process_chunk, range(n_chunks), freq_chunks,
+                                        [sim] * n_chunks):
+                        record(res)
+        elif backend == 'processes':
+            turb_fft = _process_chunks_in_pool(freq_chunks, sim, n_workers,
+                                               record=record)
+        else:
+            raise ValueError(f'Unknown backend "{backend}"!')
+
+        if verbose and coh_cache is not None and (coh_cache.hits + coh_cache.misses):
+            print('Coherence factors reused: {:.1%}'.format(coh_cache.reuse_ratio))
+        sim = None
+    all_mags = None  # freed for the time conversion
 
-    if write_freq_data and combine_freq_data:
-        turb_fft = load_freq_data(n_f, n_s, preffix, dtype_complex)
+    turb_arr = None
+    if time_partials:
+        if not os.path.exists(part_path):
+            progress.start('partial')
+            with  Timer('Partial'):
+                save_time_partial(part_path, turb_fft, shard_fs, n_t,
+                                  dtype=partial_dtype or dtype,
+                                  n_pts_chunk=plan['n_pts_chunk'])
+        del turb_fft  # free up memory
 
-    with  Timer('Final'):
-        # convert to time domain and pandas dataframe
-        turb_arr = np.fft.irfft(turb_fft, axis=0, n=n_t) * n_t
-        turb_arr = turb_arr.astype(dtype, copy=False)           
-        turb_df = pd.DataFrame(turb_arr, columns=all_spat_df.columns, index=t)
+    combiner = False  # whether this call combines the results written to disk
+    if write_freq_data or time_partials:
+        combiner = _elect_combiner(preffix, combine_freq_data)
+        if not combiner:
+            progress.finish()
+            return None
+        progress.start('combining')
 
-        # return just the desired simulation points
-        turb_df = clean_turb(spat_df, all_spat_df, turb_df)
+    try:
+        if time_partials:
+            turb_arr = load_time_partials(preffix, n_shards, dtype)
+        if write_freq_data:
+            turb_fft = load_freq_data(store)
 
-        # add in mean wind speed according to specified profile
-        wsp_profile = get_wsp_values(spat_df, wsp_func, veer_func, **kwargs)
-        turb_df[:] += wsp_profile
+        with  Timer('Final'):
+            # time series of the points of spat_df, with the mean wind, written point
+            # chunk by point chunk to the targets
+            col_idx = _point_columns(spat_df, all_spat_df)
+            wsp_values = get_wsp_values(spat_df, wsp_func, veer_func, **kwargs)
+            if turb_arr is None:  # from the spectrum
+                src, freq_domain = turb_fft, True
+            else:  # from the sum of the time partials
+                src, freq_domain = turb_arr, False
+            turbs = []
+            if progress is not None:  # points written, scanned ones included
+                n_passes = sum(1 + bool(_is_sink(target)
+                                        and getattr(target, 'needs_scan', False))
+                               for target in outs)
+                progress.start('time series', n_passes * col_idx.size, unit='points')
+            track = (lambda write: write) if progress is None else progress.track
+            for i_sd, target in enumerate(outs):
+                cols = i_sd * n_s + col_idx
+                if _is_sink(target):  # e.g., .bts file, see pyconturb.io.sinks
+                    if getattr(target, 'n_sp', col_idx.size) != col_idx.size:
+                        raise ValueError('The sink must be made with the spat_df of '
+                                         + 'gen_turb!')
+                    target.start(t)
+                    writes = [target.write]
+                    if getattr(target, 'needs_scan', False):
+                        writes.insert(0, target.scan)
+                    for write in writes:
+                        _to_time_domain(src, track(write), cols, wsp_values, n_t,
+                                        freq_domain=freq_domain, n_workers=n_workers,
+                                        n_pts_chunk=plan['n_pts_chunk'])
+                    target.close()
+                    turbs.append(target)
+                    continue
+                out_arr = _open_output(target, (n_t, col_idx.size), dtype)
+                _to_time_domain(src, track(partial(_write_columns, out_arr)), cols,
+                                wsp_values, n_t, freq_domain=freq_domain,
+                                n_workers=n_workers, n_pts_chunk=plan['n_pts_chunk'])
+                if isinstance(out_arr, np.memmap):
+                    out_arr.flush()
+                turbs.append(out_arr)
+            del src, turb_arr  # release the memmap of the partials
+    except BaseException:
+        if combiner:  # another call can combine
+            release_combine_lock(preffix)
+        raise
 
     if verbose:
         print('Turbulence generation complete.')
 
-    if write_freq_data and combine_freq_data:
+    # the files of the case are deleted before the lock is released, so that a late
+    # call finds the case combined (see _elect_combiner)
+    if write_freq_data:
+        with  Timer('Delete'):
+            del turb_fft  # release the memmap
+            delete_freq_data(store)
+    if time_partials:
         with  Timer('Delete'):
-            delete_freq_data(n_f,preffix)
+            delete_time_partials(preffix, n_shards)
+    if progress is not None:  # the case is done
+        progress.finish(delete=True)
+    if combiner:
+        release_combine_lock(preffix)
+
+    return turbs if ensemble else turbs[0]
+
+
+def _point_columns(spat_df, all_spat_df, decimals=10):
+    """Column of all_spat_df simulating each point of spat_df. The points kept by
+    combine_spat_con have the same label in both; the ones it dropped as duplicates
+    are matched on their coordinates rounded to decimals places."""
+    col_idx = all_spat_df.columns.get_indexer(spat_df.columns)
+    dropped = col_idx < 0
+    if dropped.any():
+        n_all = all_spat_df.shape[1]
+        pt_ids = _row_ids(np.concatenate((all_spat_df.values.T,
+                                          spat_df.values.T[dropped])), decimals)
+        col_idx[dropped] = pd.Index(pt_ids[:n_all]).get_indexer(pt_ids[n_all:])
+    return col_idx
+
+
+def _turb_columns(spat_df, decimals=10):
+    """Names of the time series of the points of spat_df as given by clean_turb:
+    component and index of the location among the unique locations (rounded to
+    decimals places), e.g. ``u_p0``"""
+    xyz = spat_df.loc[['x', 'y', 'z']].values.astype(float).T
+    pids = _match_points(xyz, xyz[_first_rows(xyz, decimals)])
+    return pd.Index([f'{"uvw"[int(k)]}_p{pid}'
+                     for (k, pid) in zip(spat_df.loc['k'].values, pids)])
+
+
+def _open_output(target, shape, dtype):
+    """Output array: new array (target None), .npy memory map (target a file name) or
+    the target array after checking its shape and dtype"""
+    if target is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(target, str):
+        return np.lib.format.open_memmap(target, mode='w+', dtype=dtype, shape=shape)
+    if (target.shape != shape) or (target.dtype != dtype):
+        raise ValueError(f'Output array must have shape {shape} and dtype {dtype}, '
+                         + f'not {target.shape} and {target.dtype}!')
+    return target
+
+
+def _is_sink(target):
+    """Whether an output target is a sink (see pyconturb.io.sinks)"""
+    return hasattr(target, 'write')
+
+
+def _write_columns(out, pts, chunk):
+    """Write the time series of the points pts to the columns of an array"""
+    out[:, pts] = chunk
+
+
+def _to_time_domain(src, write, cols, wsp_values, n_t, freq_domain=True, n_workers=1,
+                    n_pts_chunk=1):
+    """Pass the time series of the columns ``cols`` of ``src`` plus the mean wind
+    ``wsp_values``, ``n_pts_chunk`` points at a time, to ``write(pts, chunk)``, with
+    ``pts`` the indices of the chunk's points in ``cols`` and ``chunk`` (n_t, n_pts).
+    ``src`` is the spectrum (n_f, n_c), converted with irffts on ``n_workers``
+    threads, or the time series (n_t, n_c) if not ``freq_domain``."""
+    for i_p in range(0, len(cols), n_pts_chunk):
+        pts = np.arange(i_p, min(i_p + n_pts_chunk, len(cols)))
+        chunk = src[:, cols[pts]]  # copy of the chunk (also from a memmap)
+        if freq_domain:
+            chunk = scipy.fft.irfft(chunk, axis=0, n=n_t, workers=n_workers)
+            chunk *= n_t
+        chunk += wsp_values[pts]
+        write(pts, chunk)
+
 
-    return turb_df
+def _elect_combiner(preffix, combine_freq_data):
+    """Whether this call combines the results. With 'auto', only the call that gets
+    the combine lock does; with True the call always does (and holds the lock if it
+    can, so that 'auto' calls do not combine as well). The combiner deletes the
+    manifest with the other files of the case before releasing the lock, so a call
+    that gets there without a manifest comes after the case was combined, and does
+    not combine it again."""
+    if combine_freq_data == 'auto':
+        combiner = acquire_combine_lock(preffix)
+    elif combine_freq_data:
+        acquire_combine_lock(preffix)
+        combiner = True
+    else:
+        return False
+    if combiner and not os.path.exists(manifest_filename(preffix)):  # already combined
+        release_combine_lock(preffix)
+        print('Results with preffix "{}" already combined'.format(preffix))
+        return False
+    return combiner
+
+
+def get_phase_key(seed=None):
+    """Key of the counter-based random generator used for the phases. The key is
+    derived from ``seed`` (random if None), so that ``get_unc_phases`` gives the same
+    phases for the same seed and frequency index."""
+    return np.random.SeedSequence(seed).generate_state(2, dtype=np.uint64)
+
+
+def get_unc_phases(i_fs, n_pha, n_t, pha_key, dtype=np.complex128):
+    """Uncorrelated phasors for the frequency indices in ``i_fs``, shape
+    ``(len(i_fs), n_pha)``. Each frequency has its own Philox stream, keyed by
+    ``pha_key`` with the frequency index in the counter, so the phases of a frequency
+    do not depend on which other frequencies are generated. The random numbers are
+    the same for all dtypes (e.g., complex64), only the phasors are rounded."""
+    unc_pha = np.empty((len(i_fs), n_pha), dtype=dtype)
+    for j_f, i_f in enumerate(i_fs):
+        rng = np.random.Generator(np.random.Philox(key=pha_key, counter=[0, 0, 0, i_f]))
+        pha = 2*np.pi * rng.random(n_pha)  # one row at a time in double
+        if not (n_t % 2) and (i_f == n_t // 2):  # even time steps, last phase 0 or pi
+            pha = np.round(np.cos(pha)) * np.pi
+        unc_pha[j_f].real = np.cos(pha)
+        unc_pha[j_f].imag = np.sin(pha)
+    return unc_pha
+
+
+def _correlate_chunk(i_fs, freq, all_spat_df, blocks, chunk_mags, conturb_fft,
+                     pha_keys, n_t, n_d, coh_model='iec', dtype=np.float64, sLbl='',
+                     coh_cache=None, pair_chunk=10000, log=True, **kwargs):
+    """Correlated Fourier components for the frequency indices in i_fs (with
+    magnitudes ``chunk_mags``, ``(len(i_fs), n_s)``) and the seeds of ``pha_keys``
+    (shape ``(n_seeds, 2)``). The coherence blocks are processed
+    separately, and the correlation of each block is applied to the phases of all
+    seeds at once. Returns a ``(len(i_fs), n_seeds * n_s)`` complex array (seed-major
+    columns).
+
+    Since ``chol(D C D) = D chol(C)`` for the diagonal magnitude matrix ``D``, the
+    coherence matrices are factored in place and their rows scaled by the magnitudes,
+    so a single ``(nf_chunk, n_b, n_b)`` buffer is used per block (zero magnitudes
+    give zero rows). With a ``coh_cache``, the factors of the coherence matrices are
+    taken from (or added to) the cache. The coherences are computed for
+    ``pair_chunk`` pairs of points at a time. The stages are timed if ``log``."""
+    n_seeds, n_s = len(pha_keys), all_spat_df.shape[1]
+    dtype_complex = np.result_type(dtype, np.complex64)
+    cor_pha = np.empty((len(i_fs), n_seeds, n_s), dtype=dtype_complex)
+    # (nf_chunk, n_s - n_d, n_seeds)
+    sim_unc_pha = np.stack([get_unc_phases(i_fs, n_s - n_d, n_t, key,
+                                           dtype=dtype_complex)
+                            for key in pha_keys], axis=-1)
+    for (idx, coupled) in blocks:
+        n_db = np.count_nonzero(idx < n_d)  # no. constraints in block
+        mags = chunk_mags[:, idx]  # (nf_chunk, n_b)
+        dat_pha = conturb_fft[np.ix_(i_fs, idx[:n_db])]
+        sim_pha = sim_unc_pha[:, idx[n_db:] - n_d]
+        if not coupled:  # identity coherence, cholesky factor is diag(mags)
+            dat_unc_pha = _safe_divide(dat_pha, mags[:, :n_db])[:, :, np.newaxis]
+            dat_unc_pha = np.repeat(dat_unc_pha, n_seeds, axis=2)
+            unc_pha = np.concatenate((dat_unc_pha, sim_pha), axis=1)
+            cor_pha[:, :, idx] = np.swapaxes(mags[:, :, np.newaxis] * unc_pha, 1, 2)
+            continue
+        blk_spat_df = all_spat_df.iloc[:, idx]
+        def coh_factors(frq):  # (len(frq), n_b, n_b) factors of the coherence matrices
+            # coherence of the block, stacked as (len(frq), n_b, n_b) (a copy only
+            # for the backward_comp models, whose stacks are not C-contiguous)
+            coh_mat = np.ascontiguousarray(np.moveaxis(
+                get_coh_mat(frq, blk_spat_df, coh_model=coh_model, dtype=dtype,
+                            pair_chunk=pair_chunk, **kwargs), -1, 0))
+            return _cholesky_inplace(coh_mat)
+        with  Timer(sLbl+'Cholesky:') if log else nullcontext():
+            if coh_cache is not None:
+                geom_key = coh_geom_key(blk_spat_df, coh_model=coh_model, dtype=dtype,
+                                        **kwargs)
+                key_freq = coh_key_freq(freq[i_fs], coh_model=coh_model, **kwargs)
+                cor_mat = coh_cache.factors(geom_key, freq[i_fs], coh_factors,
+                                            key_freq=key_freq)  # new array, not cached
+            else:
+                cor_mat = coh_factors(freq[i_fs])
+        with  Timer(sLbl+'Solve:') if log else nullcontext():
+            cor_pha[:, :, idx] = _apply_cor_mat(cor_mat, mags, dat_pha, sim_pha, n_db)
+    return cor_pha.reshape(len(i_fs), -1)
+
+
+def _get_chunk_mags(i_fs, uniq_spat_df, spec_func, mag_scale, conturb_fft,
+                    dtype=np.float64, **kwargs):
+    """Magnitudes (len(i_fs), n_d + n_u) of the constraints and the unique points to
+    simulate"""
+    sim_mags = get_chunk_magnitudes(i_fs, uniq_spat_df, spec_func, mag_scale, **kwargs)
+    con_mags = np.abs(conturb_fft[i_fs])  # mags of constraints
+    return np.concatenate((con_mags, sim_mags), axis=1, dtype=dtype)
+
+
+def _get_sim_chunk_mags(i_fs, sim):
+    """Magnitudes (len(i_fs), n_s) of a chunk, from the shared magnitudes if any"""
+    if sim['all_mags'] is not None:
+        return sim['all_mags'][i_fs][:, sim['mag_idx']]
+    mags = _get_chunk_mags(i_fs, sim['uniq_spat_df'], sim['spec_func'], sim['mag_scale'],
+                           sim['conturb_fft'], sim['dtype'], **sim['kwargs'])
+    return mags[:, sim['mag_idx']]
 
-def freq_data_filename(preffix,i_f):
-    return preffix+'pyConTurb_'+str(i_f)+'.pkl'
 
-def save_freq_data(cor_pha,filename):
-    """ Save correlated Fourier coefficients for a given frequency to pickle file"""
+def _is_picklable(obj):
+    """Whether obj can be sent to another process"""
     try:
-        pickle.dump(cor_pha, open(filename,'wb'))
-    except:
-        pass
+        pickle.dumps(obj)
+    except Exception:
+        return False
+    return True
+
+
+# small matrices are factored/solved in batched numpy calls (the per-call overhead of
+# the LAPACK loop dominates) through a temporary copy of at most _BATCH_BYTES per call
+_BATCH_CHOL_MAX_N = 24  # largest matrix size factored in batches
+_BATCH_SOLVE_MAX_N = 8  # largest matrix size solved in batches (general LU solve)
+_BATCH_BYTES = 2**20  # max. size of the temporary copy of a batch
+
+
+def _cholesky_inplace(mats):
+    """Lower Cholesky factors of a stack of symmetric matrices (n_f, n, n), written to
+    ``mats`` (the upper triangles are zeroed). Returns ``mats``.
+
+    Matrices up to ``_BATCH_CHOL_MAX_N`` are factored with ``np.linalg.cholesky`` on
+    slices of the stack of at most ``_BATCH_BYTES`` and copied back: one call per
+    slice instead of one per matrix, for a small temporary copy. Larger matrices, for
+    which the factorization outweighs the call overhead and memory is what matters,
+    are factored one by one with LAPACK in place (no copy if they are C-contiguous,
+    else the factor of LAPACK's copy is written back)."""
+    n_f, n = mats.shape[:2]
+    if n <= _BATCH_CHOL_MAX_N:
+        n_batch = max(1, _BATCH_BYTES // max(1, n * n * mats.itemsize))
+        for i_f in range(0, n_f, n_batch):
+            mats[i_f:i_f + n_batch] = np.linalg.cholesky(mats[i_f:i_f + n_batch])
+        return mats
+    potrf, = scipy.linalg.lapack.get_lapack_funcs(('potrf',), (mats,))
+    for mat in mats:
+        # the transpose of a C-ordered symmetric matrix is itself, in Fortran order,
+        # so its upper factor is the lower factor of mat
+        fac, info = potrf(mat.T, lower=False, overwrite_a=True, clean=True)
+        if info:
+            raise np.linalg.LinAlgError('Matrix is not positive definite')
+        if not np.may_share_memory(fac, mat):  # factored a copy, mat not C-ordered
+            mat[...] = fac.T
+    return mats
+
+
+def _solve_lower(mats, rhs):
+    """Solutions ``x`` of ``L x = b`` for a stack of lower-triangular matrices ``L``
+    (n_f, n, n) and right-hand sides ``b`` (n_f, n, n_rhs), one LAPACK triangular
+    solve per matrix for all right-hand sides. Matrices up to ``_BATCH_SOLVE_MAX_N``
+    are solved with ``np.linalg.solve`` on slices of the stack instead, as a general
+    solve of a tiny matrix costs less than a call per matrix."""
+    trtrs, = scipy.linalg.lapack.get_lapack_funcs(('trtrs',), (mats, rhs))
+    out = np.empty(rhs.shape, dtype=trtrs.dtype)
+    if not out.size:  # e.g., no constraints in the block
+        return out
+    n_f, n = mats.shape[:2]
+    if n <= _BATCH_SOLVE_MAX_N:
+        n_batch = max(1, _BATCH_BYTES // (n * rhs.shape[2] * out.itemsize))
+        for i_f in range(0, n_f, n_batch):
+            out[i_f:i_f + n_batch] = np.linalg.solve(mats[i_f:i_f + n_batch],
+                                                     rhs[i_f:i_f + n_batch])
+        return out
+    for j_f, (mat, vec) in enumerate(zip(mats, rhs)):
+        out[j_f], info = trtrs(mat, vec, lower=True)
+        if info:
+            raise np.linalg.LinAlgError('Singular triangular matrix')
+    return out
+
+
+def _safe_divide(num, den):
+    """num / den, 0 where den is 0"""
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape,
+                                            dtype=np.result_type(num, den)),
+                     where=(den != 0))
+
+
+def _apply_cor_mat(cor_mat, mags, dat_pha, sim_pha, n_db):
+    """Correlated components of a block from the stacked Cholesky factors ``cor_mat``
+    of its coherence matrices (scaled in place by the magnitudes ``mags``), the
+    constraint components ``dat_pha`` (nf_chunk, n_db) and the uncorrelated phases
+    ``sim_pha`` (nf_chunk, n_b - n_db, n_seeds). Returns (nf_chunk, n_seeds, n_b)."""
+    # if constraints, assign data unc_pha (same for all seeds). D_c L_c x = dat_pha. The
+    # leading block of the factor is the factor of the constraint block, so only a
+    # triangular solve on it is needed, whatever the simulated points
+    dat_unc_pha = _safe_divide(dat_pha, mags[:, :n_db])[:, :, np.newaxis]
+    dat_unc_pha = _solve_lower(cor_mat[:, :n_db, :n_db], dat_unc_pha)
+    cor_mat *= mags[:, :, np.newaxis]  # cholesky factor of D C D
+    unc_pha = np.concatenate((np.repeat(dat_unc_pha, sim_pha.shape[2], axis=2), sim_pha),
+                             axis=1)  # (nf_chunk, n_b, n_seeds)
+    if np.iscomplexobj(cor_mat):
+        return np.swapaxes(cor_mat @ unc_pha, 1, 2)
+    # real factor: multiply real and imaginary parts at once, a real @ complex product
+    # would cast the (large) factor to complex
+    n_seeds = unc_pha.shape[2]
+    re_im = np.concatenate((unc_pha.real, unc_pha.imag), axis=2).astype(cor_mat.dtype)
+    cor_pha = cor_mat @ re_im
+    return np.swapaxes(cor_pha[:, :, :n_seeds] + 1j * cor_pha[:, :, n_seeds:], 1, 2)
 
-def load_freq_data(n_f, n_s, preffix, dtype_complex):
-    """ Combine the pickle files generated for each frequency (>0)
-    A retry policy is used just in case files are missing and being generated by another process
+
+def _process_chunk(i_chunk, i_fs, sim):
+    """Correlate the frequencies of a chunk and store/save the results. Returns the
+    number of frequencies computed, the time spent [s] and the number of frequencies
+    skipped (already in the store)."""
+    t0, n_fs = time.perf_counter(), len(i_fs)
+    log = sim['chunk_log']
+    if sim['store'] is not None:  # skip frequencies already in the store
+        i_fs = np.intersect1d(i_fs, sim['store'].missing())
+        if not i_fs.size:
+            if log:
+                print('>>> Files exist, skipping chunk ', i_chunk)
+            return 0, time.perf_counter() - t0, n_fs
+    sLbl='{:5d}/{} - '.format(i_chunk + 1, sim['n_chunks'])
+    if sim['verbose']:
+        print(f'  Processing chunk {i_chunk + 1} / {sim["n_chunks"]}')
+    with Timer(sLbl+'Freq_loop:') if log else nullcontext():
+        cor_pha = _correlate_chunk(i_fs, sim['freq'], sim['all_spat_df'], sim['blocks'],
+                                   _get_sim_chunk_mags(i_fs, sim), sim['conturb_fft'],
+                                   sim['pha_keys'], sim['n_t'], sim['n_d'],
+                                   coh_model=sim['coh_model'], dtype=sim['dtype'],
+                                   sLbl=sLbl, coh_cache=sim['coh_cache'],
+                                   pair_chunk=sim['pair_chunk'], log=log, **sim['kwargs'])
+        # calculate and save correlated Fourier components
+        if sim['store'] is not None:
+            sim['store'].write(i_fs, cor_pha)
+        else:  # chunks have distinct rows, so workers can write directly
+            rows = i_fs if sim['rows'] is None else sim['rows'][i_fs]
+            sim['turb_fft'][rows, :] = cor_pha
+    return i_fs.size, time.perf_counter() - t0, n_fs - i_fs.size
+
+
+@contextmanager
+def _limit_blas_threads(n_workers):
+    """Limit the BLAS threads so n_workers workers do not oversubscribe the cores.
+    Does nothing if threadpoolctl is not installed."""
+    if threadpool_limits is None:
+        yield
+        return
+    with threadpool_limits(max(1, os.cpu_count() // n_workers), user_api='blas'):
+        yield
+
+
+_SHARED_ARRAYS = ['freq', 'all_spat_df', 'all_mags', 'conturb_fft',
+                  'turb_fft']  # arrays put in shared memory for the process pool
+_WORKER_SIM = {}  # state of a process-pool worker, filled by _init_worker
+
+
+def _to_shm(arr):
+    """Copy an array into a new shared-memory block. Returns the block and a
+    picklable (name, shape, dtype) description used by workers to attach to it."""
+    arr = np.asarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _from_shm(desc):
+    """Attach to a shared-memory block made by _to_shm. Returns block and array."""
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(shm_descs, sim, n_workers):
+    """Attach a process-pool worker to the shared arrays"""
+    _WORKER_SIM.update(sim)
+    _WORKER_SIM['shms'] = []  # keep the blocks open while the worker lives
+    for key, desc in shm_descs.items():
+        shm, arr = _from_shm(desc)
+        _WORKER_SIM['shms'].append(shm)
+        _WORKER_SIM[key] = arr
+    _WORKER_SIM['all_spat_df'] = pd.DataFrame(_WORKER_SIM['all_spat_df'],
+                                              index=_spat_rownames)
+    if threadpool_limits is not None:  # limit lasts for the life of the worker
+        _WORKER_SIM['blas_limits'] = threadpool_limits(
+            max(1, os.cpu_count() // n_workers), user_api='blas')
+
+
+def _process_chunk_in_worker(i_chunk, i_fs):
+    """Process a chunk in a process-pool worker"""
+    return _process_chunk(i_chunk, i_fs, _WORKER_SIM)
+
+
+def _process_chunks_in_pool(freq_chunks, sim, n_workers, record=lambda res: None):
+    """Process the frequency chunks in a pool of processes. The input arrays and the
+    output spectrum are placed in shared memory, so the workers write their frequency
+    rows in place and nothing but chunk indices is pickled. The result of each chunk
+    (see ``_process_chunk``) is passed to ``record``. Returns turb_fft (or None if the
+    results are saved to file)."""
+    sim = dict(sim, all_spat_df=sim['all_spat_df'].values.astype(float))
+    shms, shm_descs = {}, {}
+    try:
+        for key in _SHARED_ARRAYS:
+            if sim[key] is None:
+                continue
+            shms[key], shm_descs[key] = _to_shm(sim.pop(key))
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(shm_descs, sim, n_workers)) as pool:
+            for res in pool.map(_process_chunk_in_worker, range(len(freq_chunks)),
+                                freq_chunks):
+                record(res)
+        if 'turb_fft' not in shm_descs:
+            return None
+        _, shape, dtype = shm_descs['turb_fft']
+        return np.ndarray(shape, dtype=dtype, buffer=shms['turb_fft'].buf).copy()
+    finally:
+        for shm in shms.values():
+            shm.close()
+            shm.unlink()
+
+def load_freq_data(store):
+    """ Combine the frequency data written to the store (for each frequency >0).
+    The store is polled until the last frequency is done, in case frequencies are
+    being generated by another process. Returns a read-only memmap of the spectrum
+    (no copy).
     """
-    # delay = 2^n *10s + 300s maximum 1h
-    @retry(wait_exponential_multiplier=10*1000, wait_exponential_max=300*1000, stop_max_delay=3600*1000)
-    def Combine():
-        files=glob.glob(preffix+'pyConTurb_*.pkl')
-        print('Combining files, {}/{} present'.format(len(files), n_f-1))
-        # Load all pickles
-        turb_fft = np.zeros((n_f, n_s), dtype=dtype_complex)
-        for i_f in range(1, n_f):
-            filename = freq_data_filename(preffix,i_f)
-            turb_fft[i_f, :] = pickle.load(open(filename,'rb'))
-        return turb_fft
-
-    turb_fft=Combine()
-    return turb_fft 
-
-def delete_freq_data(n_f,preffix):
-    """ Delete pickle files that were generated for each frequency. Should only be call upon success. """
+    return combine_store(store)
+
+def load_time_partials(preffix, n_shards, dtype):
+    """ Sum the time-domain partials of all shards. Each partial is added to a running
+    sum as soon as it is written by its (possibly other) process.
+    """
+    return combine_time_partials(preffix, n_shards, dtype=dtype)
+
+def delete_time_partials(preffix, n_shards):
+    """ Delete the time-domain partials. Should only be call upon success. """
+    try:
+        for i_shard in range(n_shards):
+            os.remove(partial_filename(preffix, i_shard, n_shards))
+        delete_combine_files(preffix)
+    except:
+        print('[FAIL] to delete all partial files with preffix: {}'.format(preffix))
+
+def delete_freq_data(store):
+    """ Delete the files of the store. Should only be call upon success. """
     try:
-        for i_f in range(1, n_f):
-            filename=freq_data_filename(preffix,i_f)
-            os.remove(filename)
+        store.delete()
+        delete_combine_files(store.preffix)
     except:
-        print('[FAIL] to delete all pickles files with preffix: {}'.format(preffix))
+        print('[FAIL] to delete the store files: {}'.format(store.data_path))
 
 
 
@@ -18,11 +18,16 @@ def get_spec_values(f, spat_df, spec_func, **kwargs):
 
         spec_values = spec_func(f, k, y, z, **kwargs)
 
-    where f, k, y and z can be floats, np.arrays or pandas.Series. You can use
-    the functions built into PyConTurb (see below) or define your own custom
-    function. The output is assumed to be in (m^2/s^2)/Hz = m^2/s. There is no
-    need to scale to the correct variance -- the spectrum is scaled during simulation
-    in order to produce the standard deviation specified by ``sig_func``.
+    where f, k, y and z can be floats, np.arrays or pandas.Series. You can use the
+    functions built into PyConTurb (see below) or define your own custom function. A
+    function whose values at a frequency do not depend on the other frequencies in
+    ``f`` can declare it with ``spec_func.freq_pointwise = True``, which lets
+    ``gen_turb`` evaluate it chunk by chunk. A function that only depends on some of
+    the coordinates can declare them, e.g. ``spec_func.spatial_coords = ('k', 'z')``,
+    and is then only evaluated on the unique values of those coordinates. The output
+    is assumed to be in (m^2/s^2)/Hz = m^2/s. There is no need to scale to the
+    correct variance -- the spectrum is scaled during simulation in order to produce
+    the standard deviation specified by ``sig_func``.
 
     Parameters
     ----------
@@ -105,6 +110,10 @@ def data_spectrum(f, k, y, z, con_tc=None, **kwargs):
     return spec_values
 
 
+data_spectrum.freq_pointwise = True  # each frequency interpolated on its own
+data_spectrum.spatial_coords = ('k', 'y', 'z')
+
+
 def kaimal_spectrum(f, k, y, z, u_ref=_DEF_KWARGS['u_ref'], **kwargs):
     """Kaimal PSD as specified in IEC 61400-1 Ed. 3.
     f is (nf,); k, y and z are (n_sp,), u_ref is float or int. returns (nf, n_sp,).
@@ -140,4 +149,8 @@ def kaimal_spectrum(f, k, y, z, u_ref=_DEF_KWARGS['u_ref'], **kwargs):
     l_k = lambda_1 * (8.1 * (k == 0) + 2.7 * (k == 1) + 0.66 * (k == 2))
     tau = np.reshape((l_k / kwargs['u_ref']), (1, -1))  # L_k / U. row vector
     spec_values = (4 * tau) / np.power(1. + 6 * tau * f, 5. / 3.)  # Kaimal 1972
-    return spec_values.astype(float)  # pandas causes object issues, ensure float
+    return spec_values.astype(float, copy=False)  # pandas may give object, ensure float
+
+
+kaimal_spectrum.freq_pointwise = True  # closed form in f
+kaimal_spectrum.spatial_coords = ('k', 'z')  # no lateral variation
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Progress of the cases simulated by parallel calls to gen_turb
+
+The calls to ``gen_turb`` with ``write_freq_data`` or ``time_partials`` keep their
+progress in the status file of their case, ``<preffix>pyConTurb_status.json`` (see
+``pyconturb._progress``). This module summarizes these files, one line per case: the
+calls running, done or dead (processes of this host that stopped before the end), their
+stages, the frequencies done out of the frequencies of all calls, the throughput of the
+running calls, the ETA of the slowest one and the time since the last update.
+
+Can be run from the command line, e.g. for the cases of 01_GenerateTurbBox.py::
+
+    python -m pyconturb.status data
+"""
+import argparse
+import os
+import time
+
+from pyconturb.tictoc import pretty_time
+from pyconturb._progress import read_status, format_entry, is_alive, status_filename
+
+
+_STATUS_SUFFIX = status_filename('')
+
+
+def find_status_files(paths=('.',)):
+    """Status files in the given files and directories (searched recursively)"""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            found += [os.path.join(root, name) for name in sorted(files)
+                      if name.endswith(_STATUS_SUFFIX)]
+    return found
+
+
+def case_status(path):
+    """Summary of the status file of a case.
+
+    Returns
+    -------
+    status : dict
+        ``case`` (the prefix of the case), ``calls`` (the entries of the status file,
+        with their ``state``: ``'running'``, ``'done'`` or ``'dead'``), ``n_running``,
+        ``n_done`` and ``n_dead``, ``stages`` (number of running calls per stage),
+        ``frequencies`` (done and total of all calls), ``rate`` (frequencies per
+        second of the running calls), ``eta`` [s] (of the slowest running call, or
+        None) and ``updated`` (time of the last update).
+    """
+    calls = read_status(path)
+    for entry in calls.values():
+        entry['state'] = ('done' if entry['stage'] == 'done'
+                          else 'running' if is_alive(entry) else 'dead')
+    running = [entry for entry in calls.values() if entry['state'] == 'running']
+    stages = {}
+    for entry in running:
+        stages[entry['stage']] = stages.get(entry['stage'], 0) + 1
+    etas = [entry['eta'] for entry in running if entry['eta'] is not None]
+    return {'case': os.path.normpath(path)[:-len(_STATUS_SUFFIX)], 'calls': calls,
+            'n_running': len(running),
+            'n_done': sum(entry['state'] == 'done' for entry in calls.values()),
+            'n_dead': sum(entry['state'] == 'dead' for entry in calls.values()),
+            'stages': stages,
+            'frequencies': [sum(entry['frequencies'][i] for entry in calls.values())
+                            for i in range(2)],
+            'rate': sum(entry['rate'] or 0 for entry in running
+                        if entry['stage'] == 'frequencies'),
+            'eta': max(etas) if etas else None,
+            'updated': max([entry['updated'] for entry in calls.values()], default=0)}
+
+
+def format_status(statuses, calls=False):
+    """Table of case summaries of ``case_status`` (and of their calls if `calls`)"""
+    now = time.time()
+    lines = ['{:30s} {:>16s} {:24s} {:>20s} {:>9s} {:>7s} {:>8s}'.format(
+        'Case', 'Run/done/dead', 'Stages', 'Frequencies', 'Freq/s', 'ETA', 'Updated')]
+    for st in statuses:
+        n_fs, n_tot = st['frequencies']
+        lines.append('{:30s} {:>16s} {:24s} {:>20s} {:>9.3g} {:>7s} {:>8s}'.format(
+            st['case'] or '.', '{n_running}/{n_done}/{n_dead}'.format(**st),
+            ', '.join(f'{stage} {n}' for (stage, n) in st['stages'].items()) or '-',
+            f'{n_fs}/{n_tot} ({n_fs / n_tot:.0%})' if n_tot else '-', st['rate'],
+            '-' if st['eta'] is None else pretty_time(st['eta']).strip(),
+            pretty_time(now - st['updated']).strip()))
+        if calls:
+            lines += [f'    {format_entry(key, entry)} [{entry["state"]}]'
+                      for (key, entry) in st['calls'].items()]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Command-line interface, see ``python -m pyconturb.status --help``"""
+    parser = argparse.ArgumentParser(
+        prog='python -m pyconturb.status',
+        description='Summarize the progress of the cases simulated by gen_turb.')
+    parser.add_argument('paths', nargs='*', default=['.'],
+                        help='status files or directories to search (default: .)')
+    parser.add_argument('--all', action='store_true',
+                        help='also show the cases whose calls are all done or dead')
+    parser.add_argument('--calls', action='store_true',
+                        help='show the progress of every call')
+    args = parser.parse_args(argv)
+    statuses = [case_status(path) for path in find_status_files(args.paths)]
+    if not args.all:
+        statuses = [st for st in statuses if st['n_running']]
+    print(format_status(statuses, calls=args.calls))
+    return statuses
+
+
+if __name__ == '__main__':
+    main()
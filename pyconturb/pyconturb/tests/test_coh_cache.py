@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Test functions in _coh_cache.py
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from pyconturb import gen_turb
+from pyconturb._coh_cache import CohCache, coh_geom_key
+from pyconturb._utils import gen_spat_grid
+
+
+def test_coh_cache_tiers(tmp_path):
+    """factors are computed once, found on disk by a new cache and evicted by size"""
+    # given
+    fac = np.ones((3, 4, 4))  # 128 bytes per frequency
+    calls = []
+    def compute(freq):
+        calls.append(list(freq))
+        return fac[:len(freq)] * np.reshape(freq, (-1, 1, 1))
+    cache = CohCache(str(tmp_path), max_bytes=3 * 256, max_mem_bytes=2 * 128)
+    # when
+    first = cache.factors('geom', [0.1, 0.2], compute)
+    second = cache.factors('geom', [0.2, 0.3, 0.1], compute)
+    new_cache = pickle.loads(pickle.dumps(cache))  # e.g., worker process
+    third = new_cache.factors('geom', [0.1, 0.2, 0.3], compute)
+    cache.factors('geom', [0.4, 0.5], compute)  # disk can only hold 3 files
+    # then
+    assert calls == [[0.1, 0.2], [0.3], [0.4, 0.5]]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(third, fac * np.reshape([0.1, 0.2, 0.3], (-1, 1, 1)))
+    assert (cache.hits, cache.misses) == (2, 5)
+    assert len(cache._mem) == 2  # memory tier holds 2 factors
+    assert len(os.listdir(tmp_path)) <= 3
+
+
+def test_coh_geom_key():
+    """key changes with coherence inputs but not with x, u_ref or other kwargs"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'l_c': 340.2, 'ed': 3, 'turb_class': 'B'}
+    moved_df = spat_df.copy()
+    moved_df.loc['x'] = 2
+    # when
+    key = coh_geom_key(spat_df, **kwargs)
+    # then
+    assert key == coh_geom_key(moved_df, **{**kwargs, 'turb_class': 'A'})
+    assert key == coh_geom_key(spat_df, **{**kwargs, 'u_ref': 11})  # reduced freq.
+    assert key != coh_geom_key(spat_df, **{**kwargs, 'l_c': 42})
+    assert key != coh_geom_key(spat_df, coh_model='3d', **kwargs)
+    assert key != coh_geom_key(spat_df.iloc[:, :-1], **kwargs)
+
+
+def test_gen_turb_coh_cache(tmp_path):
+    """simulations with a cache match the ones without, and reuse the factors"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80], comps=[0, 1, 2])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'coh_model': '3d', 'nf_chunk': 4}
+    cache = CohCache(str(tmp_path))
+    # when
+    turb_df = gen_turb(spat_df, seed=1, **kwargs)
+    miss_df = gen_turb(spat_df, seed=1, coh_cache=cache, **kwargs)
+    n_miss = cache.misses
+    hit_df = gen_turb(spat_df, seed=1, coh_cache=cache, sig_func=lambda k, y, z, **kw: 2.,
+                      **kwargs)
+    path_df = gen_turb(spat_df, seed=1, coh_cache=str(tmp_path), **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, miss_df, check_exact=False, rtol=1e-10)
+    pd.testing.assert_frame_equal(miss_df, path_df)
+    assert n_miss == 3 * 20  # 3 components times 20 frequencies
+    assert cache.misses == n_miss and cache.hits == n_miss
+    assert not np.allclose(hit_df.values, miss_df.values)  # other sigma
+
+
+def test_gen_turb_coh_cache_reduced_freq():
+    """factors are reused across u_ref where the reduced frequencies coincide"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5, 'seed': 1, 'nf_chunk': 6}
+    cache = CohCache()
+    # when
+    gen_turb(spat_df, u_ref=8, coh_cache=cache, **kwargs)
+    turb_df = gen_turb(spat_df, u_ref=10, **kwargs)
+    hit_df = gen_turb(spat_df, u_ref=10, coh_cache=cache, **kwargs)
+    # then
+    assert cache.hits == 4  # f = i / T at 8 m/s equals f = 1.25 i / T at 10 m/s
+    assert cache.reuse_ratio == 4 / 40
+    pd.testing.assert_frame_equal(turb_df, hit_df, check_exact=False, rtol=1e-10)
+
+
+if __name__ == '__main__':
+    test_coh_geom_key()
+    test_gen_turb_coh_cache_reduced_freq()
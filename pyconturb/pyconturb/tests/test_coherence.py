@@ -13,7 +13,7 @@ import pandas as pd
 import pytest
 
 from pyconturb.simulation import gen_turb
-from pyconturb.coherence import get_coh_mat
+from pyconturb.coherence import get_coh_mat, get_coh_blocks
 from pyconturb._utils import gen_spat_grid, _spat_rownames
 
 
@@ -110,6 +110,45 @@ def test_3d_value():
         np.testing.assert_allclose(coh, coh_theory, atol=1e-6)
 
 
+def test_coh_blocks():
+    """Coherence between points in different blocks should be zero, identity blocks
+    should be identity"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    freq = [0.1, 0.5]
+    kwargs = {'u_ref': 2, 'l_c': 3}
+    for coh_model, n_blocks in [('iec', 2), ('3d', 3)]:
+        # when
+        coh = get_coh_mat(freq, spat_df, coh_model=coh_model, **kwargs)
+        blocks = get_coh_blocks(spat_df, coh_model=coh_model)
+        # then
+        assert len(blocks) == n_blocks
+        blk_mat = np.zeros_like(coh)
+        for (idx, coupled) in blocks:
+            blk_coh = coh[np.ix_(idx, idx)]
+            if not coupled:
+                np.testing.assert_array_equal(blk_coh, np.eye(idx.size)[:, :, None]
+                                              * np.ones(len(freq)))
+            blk_mat[np.ix_(idx, idx)] = blk_coh
+        np.testing.assert_array_equal(coh, blk_mat)
+
+
+def test_coh_mat_stacked():
+    """Moving the frequency axis first should give a contiguous stack without copy"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    freq = [0.1, 0.5, 1]
+    kwargs = {'u_ref': 2, 'l_c': 3}
+    for coh_model in ['iec', '3d']:
+        # when
+        coh = get_coh_mat(freq, spat_df, coh_model=coh_model, **kwargs)
+        coh_stack = np.moveaxis(coh, -1, 0)
+        # then
+        assert coh_stack.flags['C_CONTIGUOUS']
+        assert np.shares_memory(coh, coh_stack)
+        np.testing.assert_array_equal(coh_stack[1], coh[:, :, 1])
+
+
 @pytest.mark.slow  # mark this as a slow test
 @pytest.mark.skipci  # don't run in CI
 def test_verify_iec_sim_coherence():
@@ -154,3 +193,5 @@ if __name__ == '__main__':
     test_3d_missingkwargs()
     test_iec_value()
     test_3d_value()
+    test_coh_blocks()
+    test_coh_mat_stacked()
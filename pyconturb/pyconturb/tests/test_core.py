@@ -3,8 +3,10 @@
 """
 import numpy as np
 import pandas as pd
+import pytest
 
-from pyconturb import TimeConstraint
+from pyconturb import TimeConstraint, SpatialGrid
+from pyconturb._utils import gen_spat_grid
 
 
 def test_timecon_get_spat():
@@ -60,8 +62,37 @@ def test_timecon_from_condata():
     pd.testing.assert_frame_equal(theo_tc, con_tc2, check_dtype=False)
 
 
+def test_spatial_grid():
+    """SpatialGrid gives the spat_df of gen_spat_grid, columns found by arithmetic"""
+    # given
+    y, z = np.linspace(-10, 10, 5), [70, 75, 80]
+    spat_df = gen_spat_grid(y, z).astype(float)
+    # when
+    grid = SpatialGrid(y, z)
+    grid_vw = SpatialGrid(y, z, comps=[1, 2])
+    # then
+    pd.testing.assert_frame_equal(grid.to_df(), spat_df)
+    assert grid.shape == spat_df.shape and grid.k.dtype == np.int8
+    assert (grid.dy, grid.nz, grid.z0) == (5, 3, 70)
+    iy, iz = grid.nearest([-9, 4.9], [81, 72])
+    np.testing.assert_array_equal([iy, iz], [[0, 3], [2, 0]])
+    for k in range(3):
+        cols = spat_df.columns[grid.index(iy, iz, k)]
+        np.testing.assert_array_equal(spat_df.loc['k', cols], k)
+        np.testing.assert_array_equal(spat_df.loc['y', cols], y[iy])
+        np.testing.assert_array_equal(spat_df.loc['z', cols], np.array(z)[iz])
+    assert grid_vw.index(1, 2, 2) == 11
+    with pytest.raises(ValueError):  # u not in grid
+        grid_vw.index(0, 0, 0)
+    with pytest.raises(ValueError):  # not evenly spaced
+        SpatialGrid([0, 1, 3], z)
+    with pytest.raises(ValueError):  # bad components
+        SpatialGrid(y, z, comps=[0, 3])
+
+
 if __name__ == '__main__':
     test_timecon_get_spat()
     test_timecon_get_time()
     test_timecon_get_T()
     test_timecon_from_condata()
+    test_spatial_grid()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Test functions in _freq_store.py
+"""
+import json
+import os
+import socket
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyconturb._freq_store import (FreqStore, partial_filename, save_time_partial,
+                                   sum_time_partials, acquire_combine_lock,
+                                   release_combine_lock, combine_lock_filename,
+                                   combine_record_filename, combine_store,
+                                   combine_time_partials, hash_inputs, open_manifest)
+
+
+def test_freq_store_write_load(tmp_path):
+    """rows written by two store objects end up in the same file, bitmap is updated"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    n_f, n_s = 5, 3
+    data = np.arange(n_f * n_s).reshape(n_f, n_s) * (1 + 1j)
+    data[0] = 0
+    store_a = FreqStore(preffix, n_f, n_s)
+    store_b = FreqStore(preffix, n_f, n_s)  # attach to existing store
+    # when
+    store_a.write([1, 3], data[[1, 3]])
+    missing = store_b.missing()
+    store_b.write([4, 2], data[[4, 2]])
+    # then
+    np.testing.assert_array_equal(missing, [2, 4])
+    assert store_a.is_complete()
+    loaded = store_a.load()
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, data)
+    del loaded
+    store_a.delete()
+    assert not os.listdir(tmp_path)
+
+
+def test_freq_store_mismatch(tmp_path):
+    """attaching to a store with different size or dtype should raise an error"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    FreqStore(preffix, 5, 3)
+    # when and then
+    with pytest.raises(ValueError):
+        FreqStore(preffix, 5, 4)
+    with pytest.raises(ValueError):
+        FreqStore(preffix, 5, 3, dtype=np.complex64)
+
+
+def test_time_partials_sum(tmp_path):
+    """sum of the partials of the shards equals the inverse fft of the full spectrum"""
+    # given
+    n_t, n_s = 10, 7
+    n_f = n_t // 2 + 1
+    rng = np.random.default_rng(1337)
+    spec = rng.random((n_f, n_s)) + 1j * rng.random((n_f, n_s))
+    spec[[0, -1]] = spec[[0, -1]].real
+    i_fs_shards = [[1, 4], [2, 3, 5]]
+    paths = [partial_filename(os.path.join(tmp_path, 'case_'), i, 2) for i in range(2)]
+    # when
+    for path, i_fs in zip(paths, i_fs_shards):
+        save_time_partial(path, spec[i_fs], i_fs, n_t, n_pts_chunk=3)
+    turb_arr = sum_time_partials(paths, n_pts_chunk=2)
+    # then
+    spec[0] = 0
+    np.testing.assert_allclose(turb_arr, np.fft.irfft(spec, axis=0, n=n_t) * n_t)
+
+
+def test_manifest(tmp_path):
+    """the manifest keeps the phase key of the inputs and refuses other inputs"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    df = pd.DataFrame([[0., 1.], [2., 3.]], index=['k', 'y'])
+    hash_a = hash_inputs(df, np.sum, None, {'T': 600, 'dt': 1})
+    hash_b = hash_inputs(df * 2, np.sum, None, {'T': 600, 'dt': 1})
+    # when
+    key_a = open_manifest(preffix, hash_a, np.array([1, 2], dtype=np.uint64))
+    key_b = open_manifest(preffix, hash_a, np.array([3, 4], dtype=np.uint64))
+    # then
+    assert hash_a == hash_inputs(df.copy(), np.sum, None, {'dt': 1, 'T': 600})
+    np.testing.assert_array_equal(key_a, key_b)
+    with pytest.raises(ValueError):
+        open_manifest(preffix, hash_b, key_a)
+
+
+def test_hash_inputs_functions():
+    """functions hash by code, defaults and closure contents, not only by name"""
+    # given
+    def make_sig(scale, offset=0.5):
+        def sig_func(k, y, z, **kwargs):
+            return scale * np.exp(-z) + offset
+        return sig_func
+    def fact(n):  # recursive closure
+        return 1 if n < 2 else n * fact(n - 1)
+    # when
+    hashes = [hash_inputs(func) for func in [make_sig(1.), make_sig(2.),
+                                            make_sig(1., offset=1.),
+                                            lambda k, y, z: z, lambda k, y, z: 2 * z]]
+    # then
+    assert len(set(hashes)) == len(hashes)
+    assert hashes[0] == hash_inputs(make_sig(1.))
+    assert hash_inputs(fact) == hash_inputs(fact)
+    assert hash_inputs(np.sum) == hash_inputs(np.sum)
+    with pytest.warns(UserWarning):  # repr with an address, changes every run
+        hash_inputs(object())
+
+
+def test_combine_lock(tmp_path):
+    """only one process gets the combine lock, a lock of a dead process is taken over"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    # when
+    first, second = acquire_combine_lock(preffix), acquire_combine_lock(preffix)
+    release_combine_lock(preffix)
+    with open(combine_lock_filename(preffix), 'w') as fid:  # lock of a dead process
+        fid.write(f'{socket.gethostname()} {2**22 + 1}')
+    stale = acquire_combine_lock(preffix)
+    # then
+    assert first and not second
+    assert stale
+    release_combine_lock(preffix)
+    assert not os.listdir(tmp_path)
+
+
+def test_combine_store(tmp_path):
+    """combining returns the spectrum once complete, times out if rows are missing"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    store = FreqStore(preffix, 4, 2)
+    store.write([1, 2], np.ones((2, 2)))
+    # when and then
+    with pytest.raises(TimeoutError):
+        combine_store(store, poll=0.01, timeout=0.05)
+    store.write([3], np.ones((1, 2)))
+    np.testing.assert_array_equal(combine_store(store, poll=0.01), [[0, 0]] + [[1, 1]] * 3)
+    with open(combine_record_filename(preffix), 'r') as fid:
+        assert json.load(fid)['n_done'] == 4
+
+
+def test_combine_time_partials_resume(tmp_path):
+    """an interrupted combination is resumed (or rebuilt) from the progress record"""
+    # given
+    preffix = os.path.join(tmp_path, 'case_')
+    n_t, n_s, n_shards = 6, 3, 3
+    parts = [np.full((n_t, n_s), 10.**i) for i in range(n_shards)]
+    paths = [partial_filename(preffix, i, n_shards) for i in range(n_shards)]
+    for path, part in zip(paths[:2], parts):
+        np.save(path, part)
+    # when
+    with pytest.raises(TimeoutError):  # last partial is missing
+        combine_time_partials(preffix, n_shards, poll=0.01, timeout=0.05)
+    with open(combine_record_filename(preffix), 'r') as fid:
+        ingested = json.load(fid)['ingested']
+    np.save(paths[2], parts[2])
+    resumed = combine_time_partials(preffix, n_shards, poll=0.01)
+    with open(combine_record_filename(preffix), 'w') as fid:  # died while adding
+        json.dump({'ingested': [0, 1], 'pending': 2}, fid)
+    rebuilt = combine_time_partials(preffix, n_shards, poll=0.01, n_pts_chunk=2)
+    # then
+    assert sorted(ingested) == [0, 1]
+    np.testing.assert_array_equal(resumed, sum(parts))
+    np.testing.assert_array_equal(rebuilt, sum(parts))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Test the chunk sizing in _mem_plan.py
+"""
+import numpy as np
+import pytest
+
+from pyconturb._mem_plan import plan_chunks, format_plan
+
+
+def test_plan_chunks_budget():
+    """the chunks fill the budget left by the arrays held in memory"""
+    # given
+    kwargs = {'n_t': 6000, 'n_s': 900, 'n_coh': 300, 'n_workers': 2}
+    budget = 2**30
+    # when
+    plan = plan_chunks(mem_budget=budget, **kwargs)
+    plan_32 = plan_chunks(mem_budget=budget, dtype=np.float32, **kwargs)
+    plan_fix = plan_chunks(mem_budget=budget, nf_chunk=3, **kwargs)
+    plan_def = plan_chunks(**kwargs)
+    # then
+    mem = plan['mem']
+    work = mem['chunks'] + mem['pairs']
+    assert 0.9 * budget < mem['spectrum'] + mem['magnitudes'] + mem['output'] + work
+    assert mem['spectrum'] + mem['magnitudes'] + mem['output'] + work <= budget
+    assert mem['spectrum'] + mem['output'] + mem['final'] <= budget
+    assert plan_32['nf_chunk'] > plan['nf_chunk'] > 1
+    assert plan_fix['nf_chunk'] == 3
+    assert (plan_def['nf_chunk'], plan_def['pair_chunk']) == (1, 10000)
+    assert format_plan(plan).startswith(f'nf_chunk={plan["nf_chunk"]}, ')
+
+
+def test_plan_chunks_small():
+    """at least one frequency per worker and no more chunks than needed"""
+    # given
+    kwargs = {'n_t': 100, 'n_s': 10, 'n_workers': 4}
+    # when
+    plan = plan_chunks(mem_budget=2**30, **kwargs)
+    # then
+    assert plan['nf_chunk'] == 13  # 50 frequencies on 4 workers
+    assert plan['pair_chunk'] == 45  # all pairs at once
+    assert plan['n_pts_chunk'] == 10
+    with pytest.warns(UserWarning):  # the spectrum alone exceeds the budget
+        plan = plan_chunks(mem_budget=10, **kwargs)
+    assert (plan['nf_chunk'], plan['n_pts_chunk']) == (1, 1)
+
+
+if __name__ == '__main__':
+    test_plan_chunks_budget()
+    test_plan_chunks_small()
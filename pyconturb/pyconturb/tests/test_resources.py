@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Test the resource estimates in resources.py
+"""
+import numpy as np
+import pytest
+
+from pyconturb import estimate_resources, SpatialGrid
+from pyconturb.resources import format_estimate, main
+from pyconturb._mem_plan import plan_chunks
+
+
+def test_estimate_resources():
+    """memory from the chunk plan, operations and disk from the problem sizes"""
+    # given
+    grid = SpatialGrid([-10, 0, 10], [50, 60, 70, 80])  # 12 u, v and w points
+    kwargs = {'T': 100, 'dt': 0.5, 'con_tc': 3, 'dtype': np.float32, 'u_ref': 10}
+    n_t, n_f, n_u = 200, 101, 12 + 1  # u block with the constraint
+    # when
+    est = estimate_resources(grid, benchmark=False, **kwargs)
+    est_out = estimate_resources(grid, benchmark=False, out_formats=['bts', 'hawc2'],
+                                 shard=(0, 2), write_freq_data=True, seed=[1, 2],
+                                 **kwargs)
+    # then
+    assert (est['n_t'], est['n_f'], est['n_s'], est['n_sp']) == (n_t, n_f, 39, 36)
+    assert est['plan'] == plan_chunks(n_t, 39, n_sp=36, n_coh=n_u, dtype=np.float32,
+                                      mags_in_memory=False)
+    assert est['mem']['peak'] == max(est['mem']['correlation'], est['mem']['final'])
+    assert est['flops']['factorization'] == pytest.approx((n_f - 1) * n_u**3 / 3)
+    assert est['flops']['coherence'] == (n_f - 1) * 12 * n_u * (n_u - 1) // 2
+    assert est['disk']['total'] == 0 and est['runtime'] is None
+    assert est_out['disk']['output'] == 2 * (2 + 4) * n_t * 36
+    assert est_out['disk']['store'] == n_f * 2 * 39 * 8 + n_f
+    assert est_out['flops']['irfft'] == pytest.approx(2 * est['flops']['irfft'])
+    with pytest.raises(ValueError):
+        estimate_resources(grid, out_formats='csv')
+
+
+def test_estimate_runtime():
+    """the benchmark gives positive rates and the runtime of every stage"""
+    # given
+    grid = SpatialGrid([-10, 0, 10], [50, 60])
+    # when
+    est = estimate_resources(grid, T=20, dt=0.5, coh_model='3d')
+    # then
+    assert all(rate > 0 for rate in est['rates'].values())
+    assert est['runtime']['total'] == pytest.approx(sum(
+        sec for (stage, sec) in est['runtime'].items() if stage != 'total'))
+    assert format_estimate(est).splitlines()[-1].startswith('Time:')
+
+
+def test_resources_cli(capsys):
+    """the command line estimates a regular grid"""
+    # when
+    est = main(['--y', '-10', '10', '3', '--z', '50', '80', '4', '--T', '100', '--dt',
+                '0.5', '--n-con', '3', '--dtype', 'float32', '--no-benchmark'])
+    # then
+    assert est['n_s'] == 39
+    assert capsys.readouterr().out.startswith('Points: 36 (39 with constraints)')
+
+
+if __name__ == '__main__':
+    test_estimate_resources()
+    test_estimate_runtime()
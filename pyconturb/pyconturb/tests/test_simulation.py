@@ -7,15 +7,20 @@ Jenni Rinker
 rink@dtu.dk
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import pytest
 
-from pyconturb import gen_turb, TimeConstraint
+from pyconturb import gen_turb, gen_turb_arr, TimeConstraint, SpatialGrid, simulation
+from pyconturb.magnitudes import get_unique_points
+from pyconturb.simulation import (get_phase_key, get_unc_phases, _cholesky_inplace,
+                                  _solve_lower)
 from pyconturb.sig_models import iec_sig
 from pyconturb.spectral_models import kaimal_spectrum
 from pyconturb.wind_profiles import constant_profile, power_profile
-from pyconturb._utils import gen_spat_grid, _spat_rownames
+from pyconturb._utils import gen_spat_grid, clean_turb, _spat_rownames
 
 
 def test_iec_turb_mn_std_dev():
@@ -189,6 +194,403 @@ def test_gen_turb_sims_collocated():
     assert sim_turb_df is None
 
 
+def test_gen_turb_nf_chunk():
+    """the frequency chunk size should not change the result"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337}
+    for coh_model in ['iec', '3d']:
+        # when
+        turb_df = gen_turb(spat_df, coh_model=coh_model, **kwargs)
+        chnk_df = gen_turb(spat_df, coh_model=coh_model, nf_chunk=7, **kwargs)
+        # then
+        pd.testing.assert_frame_equal(turb_df, chnk_df)
+
+
+def test_gen_turb_nf_chunk_backward_comp():
+    """the frequency chunk size should not change the result of the old coh models"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'backward_comp': True}
+    for coh_model in ['iec', '3d']:
+        # when
+        turb_df = gen_turb(spat_df, coh_model=coh_model, **kwargs)
+        chnk_df = gen_turb(spat_df, coh_model=coh_model, nf_chunk=4, **kwargs)
+        # then
+        pd.testing.assert_frame_equal(turb_df, chnk_df)
+
+
+def test_gen_turb_n_workers():
+    """threaded and multiprocess simulation should give the same result as serial"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 3}
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    thrd_df = gen_turb(spat_df, n_workers=4, **kwargs)
+    proc_df = gen_turb(spat_df, n_workers=2, backend='processes', **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, thrd_df)
+    pd.testing.assert_frame_equal(turb_df, proc_df)
+    with pytest.raises(ValueError):  # bad backend
+        gen_turb(spat_df, n_workers=2, backend='dog', **kwargs)
+
+
+def test_gen_turb_seed_ensemble(tmp_path):
+    """a list of seeds gives the same boxes as one call per seed"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80], comps=[0, 1, 2])
+    t = np.arange(40) / 2
+    con_tc = TimeConstraint(np.vstack(([[0, 1, 2], [0, 0, 0], [0, 0, 0], [75, 75, 75]],
+                                       np.sin(t)[:, None] * [1, 0.5, 0.2] + [9, 0, 0])),
+                            index=_spat_rownames + list(t))
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'coh_model': '3d', 'con_tc': con_tc, 'nf_chunk': 3}
+    seeds = [1, 2, 3]
+    # when
+    turb_dfs = [gen_turb(spat_df, seed=seed, **kwargs) for seed in seeds]
+    ens_dfs = gen_turb(spat_df, seed=seeds, **kwargs)
+    disk_dfs = gen_turb(spat_df, seed=seeds, write_freq_data=True, combine_freq_data=True,
+                        preffix=str(tmp_path / 'case_'), **kwargs)
+    # then
+    assert len(ens_dfs) == len(disk_dfs) == len(seeds)
+    for turb_df, ens_df, disk_df in zip(turb_dfs, ens_dfs, disk_dfs):
+        pd.testing.assert_frame_equal(turb_df, ens_df, check_exact=False, rtol=1e-10)
+        pd.testing.assert_frame_equal(ens_df, disk_df)
+    assert not turb_dfs[0].equals(turb_dfs[1])
+    with pytest.raises(ValueError):
+        gen_turb(spat_df, seed=[], **kwargs)
+
+
+def test_gen_turb_chunk_mags():
+    """magnitudes computed per chunk give the same box as all magnitudes at once"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 3}
+    spec_func = lambda f, k, y, z, **kw: kaimal_spectrum(f, k, y, z, **kw)
+    # when
+    turb_df = gen_turb(spat_df, spec_func=spec_func, **kwargs)  # all at once
+    chnk_df = gen_turb(spat_df, **kwargs)  # kaimal is pointwise in f
+    spec_func.freq_pointwise = True  # can't be pickled, shared with the processes
+    proc_df = gen_turb(spat_df, spec_func=spec_func, n_workers=2, backend='processes',
+                       **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, chnk_df, check_exact=False, rtol=1e-10)
+    pd.testing.assert_frame_equal(turb_df, proc_df, check_exact=False, rtol=1e-10)
+
+
+def test_gen_turb_unique_points():
+    """spectrum and sigma evaluated on unique (k, z) give the same box as on all points"""
+    # given
+    spat_df = gen_spat_grid([-5, 0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337}
+    calls = []
+    def spec_func(f, k, y, z, **kw):  # no spatial_coords, evaluated on all points
+        calls.append(len(k))
+        return kaimal_spectrum(f, k, y, z, **kw)
+    # when
+    dens_df = gen_turb(spat_df, spec_func=spec_func, **kwargs)
+    n_dens = calls.pop()
+    spec_func.spatial_coords = ('k', 'z')
+    uniq_df, inv = get_unique_points(spat_df, spec_func, iec_sig)
+    turb_df = gen_turb(spat_df, spec_func=spec_func, **kwargs)
+    # then
+    assert (n_dens, calls.pop(), uniq_df.shape[1]) == (18, 6, 6)  # 3 comps x 2 heights
+    np.testing.assert_array_equal(uniq_df.loc[['k', 'z']].values[:, inv],
+                                  spat_df.loc[['k', 'z']].values)
+    pd.testing.assert_frame_equal(dens_df, turb_df, check_exact=False, rtol=1e-10)
+
+
+def test_gen_turb_zero_mags():
+    """points with zero magnitude get zero turbulence, the others are unaffected"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80], comps=[0, 2])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'coh_model': '3d', 'nf_chunk': 4,
+              'wsp_func': constant_profile}
+    def sig_func(k, y, z, **kwargs):  # no w turbulence at z = 80 m
+        w_80 = (np.asarray(k) == 2) & (np.asarray(z) == 80)
+        return np.where(w_80, 0, iec_sig(k, y, z, **kwargs))
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    zero_df = gen_turb(spat_df, sig_func=sig_func, **kwargs)
+    # then
+    np.testing.assert_array_equal(zero_df[['w_p1', 'w_p3']], 0)
+    np.testing.assert_allclose(zero_df.filter(like='u_'), turb_df.filter(like='u_'))
+
+
+def test_gen_turb_float32(tmp_path):
+    """single precision: float32/complex64 arrays, close to the double-precision box"""
+    # given
+    con_spat_df = pd.DataFrame([[0, 0, 0, 70]], columns=_spat_rownames).T
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 4}
+    con_turb_df = gen_turb(con_spat_df, **kwargs)
+    con_tc = TimeConstraint().from_con_data(con_spat_df=con_spat_df.T,
+                                            con_turb_df=con_turb_df)
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    preffix = str(tmp_path / 'case_')
+    # when
+    dbl_df = gen_turb(spat_df, con_tc=con_tc, **kwargs)
+    gen_turb(spat_df, con_tc=con_tc, dtype=np.float32, write_freq_data=True,
+             preffix=preffix, **kwargs)
+    store_dtype = np.load(preffix + 'pyConTurb_fft.npy', mmap_mode='r').dtype
+    sgl_df = gen_turb(spat_df, con_tc=con_tc, dtype=np.float32, write_freq_data=True,
+                      combine_freq_data=True, preffix=preffix, **kwargs)
+    pha = get_unc_phases([1, 20], 3, 40, get_phase_key(1), dtype=np.complex64)
+    # then
+    assert store_dtype == np.complex64
+    assert (sgl_df.dtypes == np.float32).all()
+    assert pha.dtype == np.complex64
+    np.testing.assert_allclose(pha, get_unc_phases([1, 20], 3, 40, get_phase_key(1)),
+                               atol=1e-6)
+    np.testing.assert_allclose(sgl_df, dbl_df, atol=1e-5 * dbl_df.std().max())
+
+
+def test_gen_turb_write_combine(tmp_path):
+    """writing frequency data to the store and combining gives the same result"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 4, 'preffix': str(tmp_path / 'case_')}
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    none_df = gen_turb(spat_df, write_freq_data=True, **kwargs)
+    comb_df = gen_turb(spat_df, write_freq_data=True, combine_freq_data=True, **kwargs)
+    # then
+    assert none_df is None
+    pd.testing.assert_frame_equal(turb_df, comb_df)
+    assert not list(tmp_path.iterdir())  # files deleted after combining
+
+
+def test_gen_turb_shard(tmp_path):
+    """simulating the frequencies in shards gives the same result as a single call"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 2, 'preffix': str(tmp_path / 'case_')}
+    n_shards = 3
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    for i_shard in range(n_shards - 1):
+        gen_turb(spat_df, write_freq_data=True, shard=(i_shard, n_shards), **kwargs)
+    shrd_df = gen_turb(spat_df, write_freq_data=True, combine_freq_data=True,
+                       shard=(n_shards - 1, n_shards), **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, shrd_df)
+    with pytest.raises(ValueError):  # bad shard
+        gen_turb(spat_df, write_freq_data=True, shard=(3, 3), **kwargs)
+
+
+def test_gen_turb_out(tmp_path):
+    """point-chunked conversion to file/array targets gives the same boxes"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'nf_chunk': 4, 'wsp_func': power_profile}
+    path = str(tmp_path / 'box.npy')
+    arrs = [np.zeros((40, 12)) for _ in range(2)]
+    # when
+    turb_df = gen_turb(spat_df, seed=1, **kwargs)
+    file_df = gen_turb(spat_df, seed=1, out=path, mem_budget=1, n_workers=2, **kwargs)
+    ens_dfs = gen_turb(spat_df, seed=[1, 2], out=arrs, mem_budget=2000, **kwargs)
+    part_df = gen_turb(spat_df, seed=1, time_partials=True, combine_freq_data=True,
+                       preffix=str(tmp_path / 'case_'), mem_budget=1, **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, file_df)
+    pd.testing.assert_frame_equal(turb_df, ens_dfs[0])
+    pd.testing.assert_frame_equal(turb_df, part_df)
+    np.testing.assert_array_equal(np.load(path), turb_df.values)
+    assert np.shares_memory(ens_dfs[1].values, arrs[1])
+    with pytest.raises(ValueError):  # bad shape
+        gen_turb(spat_df, seed=1, out=np.zeros((40, 11)), **kwargs)
+    with pytest.raises(ValueError):  # one target per seed
+        gen_turb(spat_df, seed=[1, 2], out=arrs[:1], **kwargs)
+
+
+def test_gen_turb_arr():
+    """the array core gives the boxes of gen_turb, which names them as clean_turb"""
+    # given
+    con_spat_df = pd.DataFrame([[0, 0, 0, 70]], columns=_spat_rownames).T
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337}
+    con_tc = TimeConstraint().from_con_data(con_spat_df=con_spat_df.T,
+                                            con_turb_df=gen_turb(con_spat_df, **kwargs))
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    spat_df = pd.concat([spat_df, spat_df.iloc[:, [4]]], axis=1)  # repeated point
+    spat_df.columns = range(spat_df.shape[1])
+    uniq_spat_df = spat_df.iloc[:, :-1]
+    theo_cols = clean_turb(spat_df, uniq_spat_df.copy(), pd.DataFrame(
+        np.zeros((1, uniq_spat_df.shape[1])), columns=uniq_spat_df.columns)).columns
+    # when
+    turb_arr = gen_turb_arr(*spat_df.loc[['k', 'y', 'z']].values, con_tc=con_tc,
+                            **kwargs)
+    turb_df = gen_turb(spat_df, con_tc=con_tc, **kwargs)
+    # then
+    assert isinstance(turb_arr, np.ndarray)
+    np.testing.assert_array_equal(turb_arr, turb_df.values)
+    np.testing.assert_array_equal(turb_df.index, np.arange(40) * 0.5)
+    pd.testing.assert_index_equal(turb_df.columns, theo_cols)
+    np.testing.assert_allclose(turb_arr[:, 0], con_tc.get_time().iloc[:, 0], atol=1e-12)
+    np.testing.assert_array_equal(turb_arr[:, 4], turb_arr[:, -1])
+    grid_df = gen_turb(SpatialGrid([0, 5], [70, 80]), con_tc=con_tc, **kwargs)
+    pd.testing.assert_frame_equal(grid_df, turb_df.iloc[:, :-1])
+
+
+def test_gen_turb_combine_auto(tmp_path):
+    """with combine_freq_data='auto', exactly one of the parallel shards combines"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 2, 'preffix': str(tmp_path / 'case_')}
+    n_shards = 3
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    for disk_kwargs in [{'write_freq_data': True}, {'time_partials': True}]:
+        with ThreadPoolExecutor(max_workers=n_shards) as pool:
+            shrd_dfs = list(pool.map(
+                lambda i: gen_turb(spat_df, combine_freq_data='auto',
+                                   shard=(i, n_shards), **disk_kwargs, **kwargs),
+                range(n_shards)))
+        # then
+        comb_dfs = [df for df in shrd_dfs if df is not None]
+        assert len(comb_dfs) == 1
+        pd.testing.assert_frame_equal(turb_df, comb_dfs[0])
+        assert not list(tmp_path.iterdir())  # files deleted after combining
+
+
+def test_gen_turb_combine_late(tmp_path, monkeypatch):
+    """a shard electing the combiner after the case was combined returns None"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 2, 'preffix': str(tmp_path / 'case_'),
+              'combine_freq_data': 'auto'}
+    elect = simulation._elect_combiner
+    turb_df = gen_turb(spat_df, **{**kwargs, 'combine_freq_data': False})
+    for disk_kwargs in [{'write_freq_data': True}, {'time_partials': True}]:
+        comb_dfs = []
+        def late_elect(*args):  # shard 0 combines before shard 1 gets to the election
+            monkeypatch.setattr(simulation, '_elect_combiner', elect)
+            comb_dfs.append(gen_turb(spat_df, shard=(0, 2), **disk_kwargs, **kwargs))
+            return elect(*args)
+        monkeypatch.setattr(simulation, '_elect_combiner', late_elect)
+        # when
+        late_df = gen_turb(spat_df, shard=(1, 2), **disk_kwargs, **kwargs)
+        # then
+        assert late_df is None
+        pd.testing.assert_frame_equal(turb_df, comb_dfs[0])
+        assert not list(tmp_path.iterdir())  # no lock or status file left
+
+
+def test_gen_turb_resume(tmp_path):
+    """a rerun continues an interrupted run, other inputs are refused"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5, 'seed': 1337,
+              'nf_chunk': 2, 'preffix': str(tmp_path / 'case_')}
+    turb_df = gen_turb(spat_df, u_ref=10, **kwargs)
+    # when
+    gen_turb(spat_df, u_ref=10, write_freq_data=True, shard=(0, 2), **kwargs)  # "killed"
+    with pytest.raises(ValueError):
+        gen_turb(spat_df, u_ref=12, write_freq_data=True, **kwargs)
+    rsm_df = gen_turb(spat_df, u_ref=10, write_freq_data=True, combine_freq_data=True,
+                      **kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, rsm_df)
+    assert not list(tmp_path.iterdir())
+
+
+def test_gen_turb_time_partials(tmp_path):
+    """summing the time-domain partials of the shards gives the same result"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'nf_chunk': 2, 'preffix': str(tmp_path / 'case_')}
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    part_none = gen_turb(spat_df, time_partials=True, shard=(1, 2), **kwargs)
+    part_df = gen_turb(spat_df, time_partials=True, combine_freq_data=True,
+                       shard=(0, 2), **kwargs)
+    # then
+    assert part_none is None
+    pd.testing.assert_frame_equal(turb_df, part_df)
+    assert not list(tmp_path.iterdir())  # partials deleted after combining
+    with pytest.raises(ValueError):  # only one type of intermediate file
+        gen_turb(spat_df, time_partials=True, write_freq_data=True, **kwargs)
+
+
+def test_gen_turb_mem_budget(tmp_path):
+    """chunks sized from the budget give the same box, also shards with other budgets"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1337, 'coh_model': '3d'}
+    part_kwargs = {'time_partials': True, 'preffix': str(tmp_path / 'case_'), **kwargs}
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    plan_df = gen_turb(spat_df, mem_budget=2**20, **kwargs)
+    gen_turb(spat_df, shard=(1, 2), mem_budget=2**16, **part_kwargs)
+    part_df = gen_turb(spat_df, shard=(0, 2), mem_budget=2**22, combine_freq_data=True,
+                       **part_kwargs)
+    # then
+    pd.testing.assert_frame_equal(turb_df, plan_df)
+    pd.testing.assert_frame_equal(turb_df, part_df)
+
+
+def test_unc_phases_counter_based():
+    """phases of a frequency don't depend on the other frequencies generated"""
+    # given
+    n_t, n_pha, key = 10, 4, get_phase_key(1337)
+    # when
+    all_pha = get_unc_phases(np.arange(n_t // 2 + 1), n_pha, n_t, key)
+    sub_pha = get_unc_phases([5, 2], n_pha, n_t, key)
+    # then
+    np.testing.assert_array_equal(sub_pha, all_pha[[5, 2]])
+    np.testing.assert_allclose(np.abs(all_pha), 1)
+    np.testing.assert_allclose(np.imag(all_pha[-1]), 0, atol=1e-12)  # nyquist is real
+    assert not np.allclose(get_unc_phases([2], n_pha, n_t, get_phase_key(1)), all_pha[2])
+
+
+def test_cholesky_inplace():
+    """in-place factors match numpy's and are lower triangular, for small (batched) and
+    large (LAPACK loop) matrices, also for stacks that are not C-contiguous"""
+    # given
+    rng = np.random.default_rng(1)
+    for n in [4, 30]:
+        mats = rng.random((3, n, n))
+        mats = mats @ np.swapaxes(mats, 1, 2) + n * np.eye(n)  # symmetric pos. def.
+        for stack in [mats.copy(), np.moveaxis(np.moveaxis(mats, 0, -1).copy(), -1, 0)]:
+            # when
+            fac = _cholesky_inplace(stack)
+            # then
+            assert fac is stack
+            np.testing.assert_allclose(fac, np.linalg.cholesky(mats), rtol=1e-12)
+            np.testing.assert_array_equal(np.triu(fac, 1), 0)
+
+
+def test_solve_lower():
+    """batched triangular solves match general solves, in the precision of the inputs,
+    for small (batched) and large (LAPACK loop) matrices"""
+    # given
+    rng = np.random.default_rng(1)
+    for n in [4, 12]:
+        mats = np.tril(rng.random((3, n, n))) + np.eye(n)
+        rhs = rng.random((3, n, 2)) + 1j * rng.random((3, n, 2))
+        # when
+        sol = _solve_lower(mats, rhs)
+        sgl = _solve_lower(mats.astype(np.float32), rhs.astype(np.complex64))
+        # then
+        np.testing.assert_allclose(sol, np.linalg.solve(mats, rhs), rtol=1e-10)
+        assert sgl.dtype == np.complex64
+        assert _solve_lower(mats[:, :0, :0], rhs[:, :0]).shape == (3, 0, 2)
+
+
 if __name__ == '__main__':
     test_iec_turb_mn_std_dev()
     test_gen_turb_con()
@@ -199,3 +601,9 @@ if __name__ == '__main__':
     test_gen_turb_sig_func()
     test_gen_turb_spec_func()
     test_gen_turb_sims_collocated()
+    test_gen_turb_nf_chunk()
+    test_gen_turb_nf_chunk_backward_comp()
+    test_gen_turb_n_workers()
+    test_gen_turb_arr()
+    test_unc_phases_counter_based()
+    test_cholesky_inplace()
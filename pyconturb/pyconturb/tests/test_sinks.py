@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Test the output sinks in io/sinks.py
+"""
+import struct
+
+import numpy as np
+import pytest
+
+from pyconturb import gen_turb, SpatialGrid
+from pyconturb.io.sinks import BtsSink, Hawc2Sink, MultiSink
+from pyconturb.wind_profiles import power_profile
+from pyconturb._utils import gen_spat_grid
+
+
+def read_bts(path):
+    """(3, n_t, ny, nz) dequantized field of a .bts file without tower points"""
+    with open(path, 'rb') as fid:
+        _, nz, ny, _, nt = struct.unpack('<h4l', fid.read(18))
+        fid.read(24)
+        scl_off = np.array(struct.unpack('<6f', fid.read(24)), dtype=np.float32)
+        n_char, = struct.unpack('<l', fid.read(4))
+        fid.read(n_char)
+        raw = np.fromfile(fid, dtype='<i2').reshape(nt, nz, ny, 3)
+    scl, off = scl_off[::2], scl_off[1::2]
+    return np.transpose((raw - off) / scl, (3, 0, 2, 1)), scl
+
+
+def test_sinks(tmp_path):
+    """.bts and HAWC2 files written chunk by chunk hold the box of gen_turb"""
+    # given
+    y, z = [-5, 0, 5], [70, 80]
+    spat_df = gen_spat_grid(y, z)
+    kwargs = {'u_ref': 10, 'turb_class': 'B', 'z_ref': 70, 'T': 20, 'dt': 0.5,
+              'seed': 1, 'wsp_func': power_profile, 'mem_budget': 2000}
+    path = str(tmp_path / 'box')
+    sink = MultiSink(BtsSink(path + '.bts', spat_df), Hawc2Sink(path, spat_df))
+    grid = SpatialGrid(y[::-1], z)
+    # when
+    turb_df = gen_turb(spat_df, **kwargs)
+    out = gen_turb(spat_df, out=sink, **kwargs)
+    bts, scl = read_bts(path + '.bts')
+    h2 = [np.fromfile(f'{path}.{c}', dtype='<f').reshape(40, 3, 2) for c in 'uvw']
+    grid_df = gen_turb(grid, **kwargs)
+    gen_turb(grid, out=Hawc2Sink(path + '_grid', grid), **kwargs)
+    # then
+    assert out is sink
+    for c in 'uvw':  # y of the grid decreasing as in the files
+        box = grid_df.filter(regex=f'{c}_').values.reshape(40, 3, 2)
+        np.testing.assert_allclose(np.fromfile(f'{path}_grid.{c}', dtype='<f'),
+                                   (box - box.mean(axis=0)).ravel(), atol=1e-5)
+    for k, c in enumerate('uvw'):
+        box = turb_df.filter(regex=f'{c}_').values.reshape(40, 3, 2)  # z fastest
+        fluc = box - box.mean(axis=0)
+        np.testing.assert_allclose(bts[k], box if c == 'u' else fluc, atol=1 / scl[k])
+        np.testing.assert_allclose(h2[k][:, ::-1], fluc, atol=1e-5)  # y flipped
+
+
+def test_sink_bad_grid(tmp_path):
+    """sinks need each component once on a y-z grid"""
+    # given
+    spat_df = gen_spat_grid([0, 5], [70, 80])
+    # when & then
+    with pytest.raises(ValueError):
+        BtsSink(str(tmp_path / 'box.bts'), spat_df.iloc[:, :-1])
+    with pytest.raises(ValueError):  # sink of another grid
+        gen_turb(spat_df.iloc[:, :6], T=20, dt=0.5, u_ref=10, out=Hawc2Sink(
+            str(tmp_path / 'box'), spat_df))
+
+
+if __name__ == '__main__':
+    test_sinks()
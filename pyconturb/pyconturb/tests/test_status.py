@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Test the progress reporting in _progress.py and status.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+from pyconturb import gen_turb, SpatialGrid
+from pyconturb.status import case_status, find_status_files, format_status, main
+from pyconturb._progress import Progress, read_status, status_filename, update_status
+
+
+def test_progress_status(tmp_path):
+    """the calls of a case write their own entries, summarized per case"""
+    # given
+    preffix = str(tmp_path / 'A1_')
+    progs = [Progress(preffix, shard=(i, 2), interval=0, log=False) for i in range(2)]
+    # when
+    for prog in progs:
+        prog.start('frequencies', 100)
+    dead = dict(progs[0].entry, pid=2**31 - 1, frequencies=[0, 0])  # no such process
+    progs[0].add(10, seconds=2., n_skipped=30)
+    progs[1].add(20, seconds=2.)
+    progs[1].add(80, seconds=4.)
+    progs[1].start('time series', 30, unit='points')
+    update_status(status_filename(preffix), 'dead', dead)
+    status = case_status(find_status_files([str(tmp_path)])[0])
+    # then
+    calls = read_status(status_filename(preffix))
+    assert sorted(calls) == ['dead', 'shard 0of2', 'shard 1of2']
+    assert calls['shard 0of2']['n_done'] == 40
+    assert calls['shard 0of2']['sec_per_unit'] == 0.2
+    assert calls['shard 0of2']['eta'] > 0
+    assert calls['shard 1of2']['frequencies'] == [100, 100]
+    assert status['frequencies'] == [140, 200]
+    assert (status['n_running'], status['n_done'], status['n_dead']) == (2, 0, 1)
+    assert status['stages'] == {'frequencies': 1, 'time series': 1}
+    assert status['case'] == os.path.normpath(preffix)
+    assert 'shard 0of2: frequencies 40/100' in format_status([status], calls=True)
+
+
+def test_update_status_concurrent(tmp_path):
+    """concurrent updates keep the entries of all calls"""
+    # given
+    path = str(tmp_path / 'pyConTurb_status.json')
+    keys = [f'call {i}' for i in range(20)]
+    # when
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda key: [update_status(path, key, {'n': i})
+                                   for i in range(10)], keys))
+    # then
+    assert read_status(path) == {key: {'n': 9} for key in keys}
+
+
+def test_gen_turb_status(tmp_path, capsys):
+    """the shards of gen_turb report their progress, the status command shows the
+    running cases only, the status file is deleted when the case is done"""
+    # given
+    grid = SpatialGrid([-10, 0, 10], [50, 60])
+    kwargs = {'T': 20, 'dt': 0.5, 'u_ref': 10, 'seed': 1, 'write_freq_data': True,
+              'preffix': str(tmp_path / 'A1_')}
+    # when
+    gen_turb(grid, shard=(1, 2), **kwargs)
+    running = main([str(tmp_path)])
+    stopped = main([str(tmp_path), '--all'])
+    turb_df = gen_turb(grid, shard=(0, 2), combine_freq_data=True, **kwargs)
+    # then
+    assert turb_df is not None
+    assert running == []  # shard 1 done, shard 0 not started
+    assert stopped[0]['frequencies'] == [10, 10]
+    assert stopped[0]['n_done'] == 1
+    assert not list(tmp_path.iterdir())  # status deleted with the case files
+    assert '[PROGRESS] shard 0of2: time series 18/18 points' in capsys.readouterr().out
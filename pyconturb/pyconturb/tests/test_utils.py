@@ -215,12 +215,34 @@ def test_interpolator_badinput():
         utils.interpolator(points, values, xi)
 
 
+def test_match_points():
+    """cell-hashed matching gives the first np.isclose point, rounded ids as pandas"""
+    # given
+    rng = np.random.default_rng(1)
+    ref = np.c_[rng.integers(0, 3, 200), rng.choice([0, -0., 5], 200),
+                rng.choice([-10, 0, 10], 200) + rng.choice([0, 1e-12, 2e-4], 200),
+                rng.choice([70, 480], 200) + rng.choice([0, 1e-9, 3e-3, 1e-2], 200)]
+    pts = ref[rng.integers(0, 200, 300)] + rng.choice([0, 1e-9, 1e-3], (300, 4))
+    close = np.isclose(pts[:, None], ref[None]).all(axis=2)  # brute force [n_p, n_r]
+    theo_match = np.where(close.any(axis=1), close.argmax(axis=1), -1)
+    # when
+    match = utils._match_points(pts, ref)
+    first = utils._first_rows(ref, decimals=10)
+    # then
+    np.testing.assert_array_equal(match, theo_match)
+    assert (match >= 0).any() and (match < 0).any()
+    np.testing.assert_array_equal(first,
+                                  ~pd.DataFrame(np.round(ref, 10)).duplicated().values)
+    np.testing.assert_array_equal(utils._match_points(pts[:0], ref), [])
+
+
 if __name__ == '__main__':
     test_check_sims_collocated()
     test_clean_turb()
     test_combine_spat_con_empty()
     test_combine_spat_con_nonunique()
     test_combine_spat_con_tcinspat()
+    test_match_points()
     test_pctdf_to_h2turb()
     test_gen_spat_grid()
     test_get_freq_values()